@@ -1,9 +1,12 @@
 from app import create_app
-from models.database import init_db
+from app.startup import start_warm_up
+from models.database import ensure_schema
 
 app = create_app()
 
 if __name__ == '__main__':
     with app.app_context():
-        init_db()
+        # Only runs the DDL when the schema version is missing or out of date
+        ensure_schema()
+    start_warm_up(app)
     app.run(debug=True)
\ No newline at end of file
@@ -1,6 +1,14 @@
 from flask import Flask
 from config import Config
-from models.database import close_db, init_db
+from models.database import close_db, init_db_command
+from app.admission import init_admission
+from app.idempotency import init_idempotency, purge_idempotency_keys_command
+from app.assets import init_assets
+from app.fragments import init_fragments
+from app.search import init_search
+from app.profiler import init_profiler
+from app.startup import init_startup, bench_startup_command
+from models.sharding import init_sharding, shards_cli
 
 def create_app():
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
@@ -9,6 +17,30 @@ def create_app():
     # Register database teardown
     app.teardown_appcontext(close_db)
     
+    # Refuse shard layouts the app can't serve before taking traffic
+    init_sharding(app)
+    
+    # Per-plate admission control for checkout and claim routes
+    init_admission(app)
+    
+    # Replay the first result to duplicate checkout/claim submissions
+    init_idempotency(app)
+    
+    # Fingerprinted static assets
+    init_assets(app)
+    
+    # Cached plate-card fragments and compiled-template cache
+    init_fragments(app)
+    
+    # In-memory plate search index for the marketplace
+    init_search(app)
+    
+    # On-demand sampling profiler, controlled from the admin dashboard
+    init_profiler(app)
+    
+    # /healthz and /readyz; warm-up itself is started by the server entry point
+    init_startup(app)
+    
     # Register blueprints
     from app.blueprints.auth import bp as auth_bp
     from app.blueprints.restaurant import bp as restaurant_bp
@@ -20,4 +52,27 @@ def create_app():
     app.register_blueprint(customer_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
     
+    # Register CLI commands
+    from models.seed import seed_command
+    from models.archive import archive_command
+    from models.allocation import allocate_command
+    from models.change_feed import feed_cli
+    from models.ledger import ledger_cli
+    from models.jobs import worker_command, jobs_cli
+    from models.read_models import read_models_cli
+    from models.geo import geo_cli
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(allocate_command)
+    app.cli.add_command(feed_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(purge_idempotency_keys_command)
+    app.cli.add_command(bench_startup_command)
+    app.cli.add_command(worker_command)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(read_models_cli)
+    app.cli.add_command(geo_cli)
+    
     return app
\ No newline at end of file
@@ -0,0 +1,125 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, flash, redirect, url_for
+
+BUSY_MESSAGE = 'Sorry, this item is sold out or too busy right now. Please try again in a moment.'
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class _Slot:
+    __slots__ = ('active', 'waiting', 'ready')
+
+    def __init__(self, lock):
+        self.active = 0
+        self.waiting = 0
+        self.ready = threading.Condition(lock)
+
+
+class AdmissionController:
+    """Caps concurrent requests per key (e.g. per plate) with a small bounded wait queue.
+
+    Limits are per worker process. Requests beyond max_concurrent wait up to max_wait
+    seconds; once max_queue requests are already waiting further ones are rejected
+    immediately instead of tying up another worker thread.
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _acquire(self, key, deadline):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot(self._lock)
+
+            if slot.active < self.max_concurrent:
+                slot.active += 1
+                return
+
+            if slot.waiting >= self.max_queue:
+                self._discard_if_idle(key, slot)
+                raise AdmissionRejected(key)
+
+            slot.waiting += 1
+            try:
+                while slot.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionRejected(key)
+                    slot.ready.wait(remaining)
+                slot.active += 1
+            finally:
+                slot.waiting -= 1
+                self._discard_if_idle(key, slot)
+
+    def _release(self, key):
+        with self._lock:
+            slot = self._slots[key]
+            slot.active -= 1
+            slot.ready.notify()
+            self._discard_if_idle(key, slot)
+
+    def _discard_if_idle(self, key, slot):
+        if slot.active == 0 and slot.waiting == 0:
+            self._slots.pop(key, None)
+
+    @contextmanager
+    def admit(self, keys):
+        """Hold a slot for every key; keys are taken in sorted order to avoid deadlock"""
+        deadline = time.monotonic() + self.max_wait
+        acquired = []
+        try:
+            for key in sorted(set(keys)):
+                self._acquire(key, deadline)
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+
+
+def init_admission(app):
+    app.extensions['admission'] = AdmissionController(
+        app.config['ADMISSION_MAX_CONCURRENT'],
+        app.config['ADMISSION_MAX_QUEUE'],
+        app.config['ADMISSION_MAX_WAIT_SECONDS'],
+    )
+
+
+def admission_control(keys, in_stock=None, fallback='customer.marketplace'):
+    """Decorate a write route so it only runs once admitted for every key it touches.
+
+    `keys(**view_args)` returns the keys the request will lock. `in_stock(keys)` is an
+    optional cheap, non-locking check; when it returns False the request is turned
+    away before it queues behind the row locks.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(**view_args):
+            request_keys = keys(**view_args)
+            if not request_keys:
+                return view(**view_args)
+
+            if in_stock is not None and not in_stock(request_keys):
+                flash(BUSY_MESSAGE, 'error')
+                return redirect(url_for(fallback))
+
+            controller = current_app.extensions['admission']
+            try:
+                with controller.admit(request_keys):
+                    return view(**view_args)
+            except AdmissionRejected:
+                flash(BUSY_MESSAGE, 'error')
+                return redirect(url_for(fallback))
+        return wrapped
+    return decorator
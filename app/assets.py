@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import Blueprint, current_app, request, send_from_directory, url_for, abort
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+bp = Blueprint('assets', __name__)
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+ONE_YEAR = 365 * 24 * 3600
+
+# Tried in order against the client's Accept-Encoding
+ENCODINGS = (('br', '.br'), ('zstd', '.zst'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+
+
+def _compress(path, data):
+    """Write every precompressed variant we have an encoder for; return their encodings"""
+    written = []
+    if brotli is not None:
+        with open(path + '.br', 'wb') as out:
+            out.write(brotli.compress(data, quality=11))
+        written.append('br')
+    if zstandard is not None:
+        with open(path + '.zst', 'wb') as out:
+            out.write(zstandard.ZstdCompressor(level=19).compress(data))
+        written.append('zstd')
+    # mtime=0 keeps the .gz output byte-identical between builds
+    with open(path + '.gz', 'wb') as out:
+        out.write(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append('gzip')
+    return written
+
+
+def build_assets(static_folder):
+    """Fingerprint every file under static/ into static/dist and write the manifest"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    os.makedirs(dist)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as handle:
+                data = handle.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, ext = os.path.splitext(logical)
+            hashed = f'{stem}.{digest}{ext}'
+            target = os.path.join(dist, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as out:
+                out.write(data)
+
+            encodings = _compress(target, data) if ext in COMPRESSIBLE else []
+            manifest[logical] = {'path': hashed, 'encodings': encodings}
+
+    with open(os.path.join(dist, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(app):
+    path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+    try:
+        with open(path) as handle:
+            manifest = json.load(handle)
+    except FileNotFoundError:
+        manifest = {}
+    app.extensions['asset_manifest'] = manifest
+    app.extensions['asset_files'] = {entry['path']: entry for entry in manifest.values()}
+    return manifest
+
+
+def asset_url(filename):
+    """url_for('static', ...) replacement that points at the fingerprinted build when there is one"""
+    entry = current_app.extensions['asset_manifest'].get(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('assets.serve', filename=entry['path'])
+
+
+@bp.route('/assets/<path:filename>')
+def serve(filename):
+    entry = current_app.extensions['asset_files'].get(filename)
+    if entry is None:
+        abort(404)
+
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in entry['encodings'] and request.accept_encodings[name]:
+            encoding = name
+            filename += suffix
+            break
+
+    # The fingerprinted name is a stable ETag across servers and deploys
+    response = send_from_directory(dist, filename, mimetype=mimetype, max_age=ONE_YEAR, etag=filename)
+    response.headers.pop('Content-Disposition', None)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The URL changes whenever the content does, so browsers never need to revalidate
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    return response
+
+
+assets_cli = AppGroup('assets', help='Static asset pipeline')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Fingerprint and precompress static files"""
+    manifest = build_assets(current_app.static_folder)
+    for logical, entry in sorted(manifest.items()):
+        encodings = ', '.join(entry['encodings']) or 'uncompressed'
+        click.echo(f"{logical} -> {entry['path']} ({encodings})")
+
+
+def init_assets(app):
+    load_manifest(app)
+    app.register_blueprint(bp)
+    app.add_template_global(asset_url)
+    app.cli.add_command(assets_cli)
@@ -1,5 +1,8 @@
-from flask import Blueprint, render_template, session, flash, redirect, url_for, request
-from models.database import get_db
+from flask import Blueprint, render_template, session, flash, redirect, url_for, request, current_app, jsonify, Response
+from models.database import get_db, stream_query
+from models.sharding import scatter, scatter_stream, gather
+from app.streaming import stream_page
+from app.profiler import start_session, stop_session, current_session, collapsed_stacks, profiled_requests
 from datetime import datetime, timedelta
 
 bp = Blueprint('admin', __name__)
@@ -14,7 +17,7 @@ def dashboard():
 
     # 2. Get Filter Parameters
     report_type = request.args.get('report_type')
-    year = request.args.get('year', datetime.now().year)
+    year = request.args.get('year', datetime.now().year, type=int)
     start_date = request.args.get('start_date')
     search_query = request.args.get('search_query', '')
 
@@ -45,18 +48,19 @@ def dashboard():
 
 
 
-        cursor.execute(
-            "SELECT DATE(created_at) as date, type, SUM(amount) as total FROM transactions WHERE created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY) GROUP BY DATE(created_at), type ORDER BY DATE(created_at) ASC")
-        fin_rows = cursor.fetchall()
+        fin_rows = scatter(
+            "SELECT DATE(created_at) as date, type, SUM(amount) as total FROM transactions_all WHERE created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY) GROUP BY DATE(created_at), type ORDER BY DATE(created_at) ASC")
 
-        unique_dates = sorted(list(set(row['date'].strftime('%Y-%m-%d') for row in fin_rows)))
+        # str() of a DATE is YYYY-MM-DD on both backends
+        unique_dates = sorted(list(set(str(row['date']) for row in fin_rows)))
 
         val_map = {}
         for row in fin_rows:
-            d = row['date'].strftime('%Y-%m-%d')
+            d = str(row['date'])
             t = row['type']
             if d not in val_map: val_map[d] = {}
-            val_map[d][t] = float(row['total'])
+            # Each shard reports its own total for the day
+            val_map[d][t] = val_map[d].get(t, 0) + float(row['total'])
 
         customer_data = []
         donor_data = []
@@ -76,14 +80,13 @@ def dashboard():
         if search_query:
             query = "SELECT user_id, name, email, user_type, phone, address, created_at FROM users WHERE name LIKE %s OR email LIKE %s"
             search_param = f"%{search_query}%"
-            cursor.execute(query, (search_param, search_param))
-            data = cursor.fetchall()
+            data = stream_query(query, (search_param, search_param)).prefetch()
 
 
     # Restaurant Activity
 
     elif report_type == 'restaurant_activity':
-        query = "SELECT u.name, COUNT(p.plate_id) as listings_count, COALESCE(SUM(p.quantity_original),0) as total_plates, COALESCE(SUM(p.quantity_original-p.quantity_available),0) as sold_plates FROM users u LEFT JOIN plates p ON u.user_id = p.restaurant_id WHERE u.user_type = 'restaurant'"
+        query = "SELECT u.user_id, u.name, COUNT(p.plate_id) as listings_count, COALESCE(SUM(p.quantity_original),0) as total_plates, COALESCE(SUM(p.quantity_original-p.quantity_available),0) as sold_plates FROM users u LEFT JOIN plates p ON u.user_id = p.restaurant_id WHERE u.user_type = 'restaurant'"
 
         if start_date:
             query += " AND p.created_at >= %s"
@@ -91,68 +94,124 @@ def dashboard():
         else:
             params = ()
         query += " GROUP BY u.user_id"
-        cursor.execute(query, params)
-        data = cursor.fetchall()
+        data = gather(query, params, group_by='user_id',
+                      sums=('listings_count', 'total_plates', 'sold_plates'))
 
 
     # Customer Purchases
 
     elif report_type == 'customer_purchases':
-        query = "SELECT r.created_at as date, u.name as user_name, p.title as plate_title, rest.name as restaurant_name, r.qty, (r.qty * p.price) as total_price FROM reservations r JOIN users u ON r.user_id = u.user_id JOIN plates p ON r.plate_id = p.plate_id JOIN users rest ON p.restaurant_id = rest.user_id WHERE r.status = 'CONFIRMED'"
+        query = "SELECT r.created_at as date, u.name as user_name, p.title as plate_title, rest.name as restaurant_name, r.qty, (r.qty * p.price) as total_price FROM reservations_all r JOIN users u ON r.user_id = u.user_id JOIN plates p ON r.plate_id = p.plate_id JOIN users rest ON p.restaurant_id = rest.user_id WHERE r.status = 'CONFIRMED'"
 
         params = []
         if start_date:
             query += " AND r.created_at >= %s"
             params.append(start_date)
         query += " ORDER BY r.created_at DESC"
-        cursor.execute(query, tuple(params))
-        data = cursor.fetchall()
+        data = scatter_stream(query, tuple(params), order_by='date', reverse=True).prefetch()
 
 
     # Donor History
 
     elif report_type == 'donor_purchases':
-        query = "SELECT r.created_at as date, u.name as donor_name, p.title as plate_title, rest.name as restaurant_name, r.qty, (r.qty * p.price) as total_donation FROM reservations r JOIN users u ON r.donor_id = u.user_id JOIN plates p ON r.plate_id = p.plate_id JOIN users rest ON p.restaurant_id = rest.user_id WHERE r.status IN ('DONATED', 'CLAIMED')"
+        query = "SELECT r.created_at as date, u.name as donor_name, p.title as plate_title, rest.name as restaurant_name, r.qty, (r.qty * p.price) as total_donation FROM reservations_all r JOIN users u ON r.donor_id = u.user_id JOIN plates p ON r.plate_id = p.plate_id JOIN users rest ON p.restaurant_id = rest.user_id WHERE r.status IN ('DONATED', 'CLAIMED')"
 
         params = []
         if start_date:
             query += " AND r.created_at >= %s"
             params.append(start_date)
         query += " ORDER BY r.created_at DESC"
-        cursor.execute(query, tuple(params))
-        data = cursor.fetchall()
+        data = scatter_stream(query, tuple(params), order_by='date', reverse=True).prefetch()
 
 
     # Annual Free Plate Report
 
     elif report_type == 'free_plates':
-        cursor.execute(
-            "SELECT u.name, COUNT(r.reservation_id) as plates_received, MAX(r.claimed_at) as last_pickup FROM reservations r JOIN users u ON r.user_id = u.user_id WHERE r.status = 'CLAIMED' AND YEAR(r.claimed_at) = %s GROUP BY u.user_id",
-            (year,))
-        data = cursor.fetchall()
+        data = gather(
+            "SELECT u.user_id, u.name, COUNT(r.reservation_id) as plates_received, MAX(r.claimed_at) as last_pickup FROM reservations_all r JOIN users u ON r.user_id = u.user_id WHERE r.status = 'CLAIMED' AND YEAR(r.claimed_at) = %s GROUP BY u.user_id",
+            (year,), group_by='user_id', sums=('plates_received',), maxes=('last_pickup',))
 
-        cursor.execute(
-            "SELECT COUNT(r.reservation_id) as total_count, SUM(p.price*r.qty) as total_value FROM reservations r JOIN plates p ON r.plate_id = p.plate_id WHERE r.status = 'CLAIMED' AND YEAR(r.claimed_at) = %s",
+        shard_totals = scatter(
+            "SELECT COUNT(r.reservation_id) as total_count, SUM(p.price*r.qty) as total_value FROM reservations_all r JOIN plates p ON r.plate_id = p.plate_id WHERE r.status = 'CLAIMED' AND YEAR(r.claimed_at) = %s",
             (year,))
-        summary = cursor.fetchone()
+        summary = {
+            'total_count': sum(row['total_count'] for row in shard_totals),
+            'total_value': sum(row['total_value'] or 0 for row in shard_totals),
+        }
 
 
     # Tax Donation Report
 
     elif report_type == 'tax_report':
-        cursor.execute(
-            "SELECT u.name, u.email, u.address, SUM(t.amount) as total_donated, COUNT(t.transaction_id) as transaction_count FROM transactions t JOIN users u ON t.payer_user_id = u.user_id WHERE t.type = 'DONATION_PURCHASE' AND YEAR(t.created_at) = %s GROUP BY u.user_id",
-            (year,))
-        data = cursor.fetchall()
+        data = gather(
+            "SELECT u.user_id, u.name, u.email, u.address, SUM(t.amount) as total_donated, COUNT(t.transaction_id) as transaction_count FROM transactions_all t JOIN users u ON t.payer_user_id = u.user_id WHERE t.type = 'DONATION_PURCHASE' AND YEAR(t.created_at) = %s GROUP BY u.user_id",
+            (year,), group_by='user_id', sums=('total_donated', 'transaction_count'))
 
     cursor.close()
 
-    return render_template('admin/dashboard.html',
-                           data=data,
-                           report_type=report_type,
-                           chart_data=chart_data,
-                           year=year,
-                           start_date=start_date,
-                           search_query=search_query,
-                           summary=summary,
-                           current_date=datetime.now().strftime('%Y-%m-%d'))
\ No newline at end of file
+    # Streamed reports ran their queries above, before the response started, so a
+    # database error is a plain error page rather than a half-sent one. The remaining
+    # rows are read from the cursor while the page streams out
+    return stream_page('admin/dashboard.html',
+                       data=data,
+                       report_type=report_type,
+                       chart_data=chart_data,
+                       year=year,
+                       start_date=start_date,
+                       search_query=search_query,
+                       summary=summary,
+                       current_date=datetime.now().strftime('%Y-%m-%d'))
+
+
+@bp.route('/profiler', methods=['GET', 'POST'])
+def profiler():
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        flash('Please login as admin', 'error')
+        return redirect(url_for('auth.login'))
+
+    if request.method == 'POST':
+        if not current_app.config['PROFILER_POLL_SECONDS']:
+            flash('The profiler is turned off (PROFILER_POLL_SECONDS=0)', 'error')
+        elif request.form.get('action') == 'stop':
+            stop_session()
+            flash('Profiling stopped', 'info')
+        else:
+            try:
+                start_session(endpoint=request.form.get('endpoint') or None,
+                              percent=float(request.form.get('percent') or 100),
+                              duration=float(request.form.get('duration') or 30),
+                              interval=float(request.form.get('interval_ms') or 10) / 1000)
+                flash(f"Profiling started; every worker joins within {current_app.config['PROFILER_POLL_SECONDS']:g}s",
+                      'success')
+            except ValueError:
+                flash('Percent, duration and interval must be numbers', 'error')
+        return redirect(url_for('admin.profiler'))
+
+    profile = current_session()
+    endpoints = sorted(rule.endpoint for rule in current_app.url_map.iter_rules()
+                       if rule.endpoint != 'static')
+    return render_template('admin/profiler.html',
+                           profile=profile,
+                           endpoints=endpoints,
+                           requests=profiled_requests(profile['session_id'], 50) if profile else [])
+
+
+@bp.route('/profiler/stacks.txt')
+def profiler_stacks():
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        flash('Please login as admin', 'error')
+        return redirect(url_for('auth.login'))
+
+    # Collapsed stacks from every worker: feed to flamegraph.pl or open in speedscope
+    profile = current_session()
+    return Response(collapsed_stacks(profile['session_id']) if profile else '', mimetype='text/plain')
+
+
+@bp.route('/profiler/requests.json')
+def profiler_requests():
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        flash('Please login as admin', 'error')
+        return redirect(url_for('auth.login'))
+
+    profile = current_session()
+    return jsonify(profiled_requests(profile['session_id']) if profile else [])
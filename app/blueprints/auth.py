@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from werkzeug.security import generate_password_hash, check_password_hash
-from models.database import get_db
-import mysql.connector
+from models.database import get_db, DatabaseError
+from models.sharding import assign_restaurant, mirror_users, shard_names
+from models.read_models import rename_user
+from models.geo import locate_restaurant, parse_coordinates
 
 bp = Blueprint('auth', __name__)
 
@@ -24,6 +26,15 @@ def register():
             flash('Passwords do not match!', 'error')
             return redirect(url_for('auth.register'))
         
+        # Optional for restaurants; the address is geocoded when they're left blank
+        coordinates = None
+        if user_type == 'restaurant':
+            try:
+                coordinates = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+            except ValueError as err:
+                flash(str(err), 'error')
+                return redirect(url_for('auth.register'))
+        
         password_hash = generate_password_hash(password)
         
         try:
@@ -37,6 +48,9 @@ def register():
             
             user_id = cursor.lastrowid
             
+            if user_type == 'restaurant':
+                assign_restaurant(cursor, user_id, request.form.get('region'))
+            
             if user_type in ['customer', 'donner']:
                 card_number = request.form.get('card_number')
                 card_holder = request.form.get('card_holder')
@@ -50,15 +64,18 @@ def register():
             
             db.commit()
             cursor.close()
+            mirror_users([user_id])
+            if user_type == 'restaurant':
+                locate_restaurant(user_id, address, coordinates)
             
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('auth.login'))
             
-        except mysql.connector.Error as err:
+        except DatabaseError as err:
             flash(f'Registration failed: {err}', 'error')
             return redirect(url_for('auth.register'))
     
-    return render_template('register.html')
+    return render_template('register.html', regions=shard_names() if len(shard_names()) > 1 else [])
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -110,6 +127,20 @@ def profile():
         address = request.form.get('address')
         phone = request.form.get('phone')
         
+        if session['user_type'] == 'restaurant':
+            try:
+                coordinates = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+            except ValueError as err:
+                flash(str(err), 'error')
+                return redirect(url_for('auth.profile'))
+            cursor.execute('''
+                SELECT u.address, loc.latitude, loc.longitude, loc.source
+                FROM users u
+                LEFT JOIN restaurant_locations loc ON loc.restaurant_id = u.user_id
+                WHERE u.user_id = %s
+            ''', (session['user_id'],))
+            before = cursor.fetchone()
+        
         cursor.execute('''
             UPDATE users 
             SET name = %s, address = %s, phone = %s
@@ -129,13 +160,33 @@ def profile():
             ''', (card_holder, card_number, expiry_date, cvv, session['user_id']))
         
         db.commit()
+        mirror_users([session['user_id']])
+        if name != session.get('name'):
+            rename_user(session['user_id'], name)
+        if session['user_type'] == 'restaurant':
+            # Only typed-in positions are shown in the form, so blank means "use the address"
+            if coordinates is not None:
+                moved = (before['source'] != 'manual'
+                         or coordinates != (before['latitude'], before['longitude']))
+            else:
+                moved = before['source'] == 'manual' or address != before['address']
+            if moved:
+                locate_restaurant(session['user_id'], address, coordinates)
         session['name'] = name
+        # The marketplace geocodes the address again on the next "near my address"
+        session.pop('home_coords', None)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('auth.profile'))
     
     cursor.execute('SELECT * FROM users WHERE user_id = %s', (session['user_id'],))
     user = cursor.fetchone()
     
+    location = None
+    if session['user_type'] == 'restaurant':
+        cursor.execute('SELECT latitude, longitude, source FROM restaurant_locations WHERE restaurant_id = %s',
+                       (session['user_id'],))
+        location = cursor.fetchone()
+    
     payment_info = None
     if session['user_type'] in ['customer', 'donner']:
         cursor.execute('SELECT * FROM payment_info WHERE user_id = %s', (session['user_id'],))
@@ -143,4 +194,4 @@ def profile():
     
     cursor.close()
     
-    return render_template('profile.html', user=user, payment_info=payment_info)
\ No newline at end of file
+    return render_template('profile.html', user=user, payment_info=payment_info, location=location)
\ No newline at end of file
@@ -1,9 +1,181 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models.database import get_db
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, jsonify
+from models.database import get_db, shard_targets
+from models.sharding import scatter, scatter_stream, fetch_by_id, group_by_shard
+from models.change_feed import (record_events, PLATE_STOCK_CHANGED, RESERVATION_CREATED,
+                                RESERVATION_UPDATED, RESERVATION_CLAIMED)
+from models.ledger import credit_restaurants
+from models.jobs import enqueue, PRIORITY_HIGH
+from models.read_models import sync_reservations
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from app.streaming import stream_page
+from app.admission import admission_control
+from app.idempotency import idempotent
+from app.search import search_plates, price_range, ENDING_WINDOWS, RADII_KM
+from models.geo import geocode_many, parse_coordinates
 import secrets
 
 bp = Blueprint('customer', __name__)
 
+def _cart_plate_keys():
+    if 'user_id' not in session:
+        return []
+    return [('plate', item['plate_id']) for item in session.get('cart', [])]
+
+def _cart_in_stock(keys):
+    """Cheap non-locking check that every cart plate still has the requested quantity"""
+    wanted = {item['plate_id']: item['qty'] for item in session.get('cart', [])}
+    
+    rows = fetch_by_id('''
+        SELECT plate_id, quantity_available FROM plates
+        WHERE plate_id IN ({ids}) AND is_active = 1
+    ''', list(wanted))
+    available = {row['plate_id']: row['quantity_available'] for row in rows}
+    
+    return all(available.get(plate_id, 0) >= qty for plate_id, qty in wanted.items())
+
+def _needy_cart_keys():
+    if session.get('user_type') != 'needy':
+        return []
+    return [('reservation', item['reservation_id']) for item in session.get('needy_cart', [])]
+
+def _claim_free_keys(reservation_id):
+    if session.get('user_type') != 'needy':
+        return []
+    return [('reservation', reservation_id)]
+
+def _donations_available(keys):
+    """Cheap non-locking check that the donated reservations are still unclaimed"""
+    reservation_ids = [reservation_id for _, reservation_id in keys]
+    
+    rows = fetch_by_id('''
+        SELECT reservation_id FROM reservations
+        WHERE reservation_id IN ({ids}) AND status = 'DONATED'
+    ''', reservation_ids)
+    
+    return len(rows) == len(reservation_ids)
+
+def _claimed_today(user_id):
+    """Free plates this needy user has claimed today, across every shard"""
+    rows = scatter('''
+        SELECT COALESCE(SUM(qty), 0) as total_claimed
+        FROM reservations 
+        WHERE user_id = %s AND status IN ('CLAIMED', 'PICKED_UP')
+          AND DATE(claimed_at) = CURDATE()
+    ''', (user_id,))
+    return sum(int(row['total_claimed']) for row in rows)
+
+def _single_shard(ids):
+    """The shard owning every id, or None when the ids span shards"""
+    shards = group_by_shard(ids)
+    if len(shards) > 1:
+        return None
+    # Unknown ids fall through to the first shard and simply aren't found there
+    return next(iter(shards or shard_targets()))
+
+def open_donations():
+    """Donated plates that haven't been claimed yet (shared with the startup cache warm-up)"""
+    return scatter('''
+        SELECT reservation_id, available_qty, plate_id, title, description,
+               price, start_time, end_time, restaurant_name, created_at
+        FROM open_donation_rows
+        WHERE end_time >= NOW() AND start_time <= NOW()
+        ORDER BY created_at ASC
+    ''', order_by='created_at')
+
+def _home_coordinates():
+    """The logged-in user's address geocoded from the lookup table, cached in the session"""
+    if 'home_coords' not in session:
+        cursor = get_db().cursor()
+        cursor.execute('SELECT address FROM users WHERE user_id = %s', (session['user_id'],))
+        row = cursor.fetchone()
+        cursor.close()
+        address = row[0] if row else ''
+        session['home_coords'] = geocode_many([address]).get(address)
+    return session['home_coords']
+
+def _marketplace_filters():
+    """Search and facet filters from the query string; every one is optional"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'price': request.args.get('price'),
+        'ending': request.args.get('ending', type=int),
+        'restaurant': request.args.get('restaurant', type=int),
+        'lat': None,
+        'lng': None,
+        'radius': None,
+    }
+    if filters['ending'] not in ENDING_WINDOWS:
+        filters['ending'] = None
+    
+    # "Near me": a position from the browser, or near=home for the account's address
+    try:
+        near = parse_coordinates(request.args.get('lat'), request.args.get('lng'))
+    except ValueError:
+        near = None
+    if near is None and request.args.get('near') == 'home':
+        near = _home_coordinates()
+    if near is not None:
+        filters['lat'], filters['lng'] = round(near[0], 5), round(near[1], 5)
+        filters['radius'] = request.args.get('radius', type=int)
+        if filters['radius'] not in RADII_KM:
+            filters['radius'] = current_app.config['GEO_DEFAULT_RADIUS_KM']
+    return filters
+
+def _marketplace_results(filters):
+    """One page of search results with live stock (shared by the page and /api/plates)"""
+    min_price, max_price = price_range(filters['price'])
+    near = (filters['lat'], filters['lng']) if filters['lat'] is not None else None
+    results = search_plates(query=filters['q'], min_price=min_price, max_price=max_price,
+                            ending_within=filters['ending'], restaurant_id=filters['restaurant'],
+                            near=near, radius_km=filters['radius'],
+                            page=request.args.get('page', 1, type=int))
+    
+    # The index trails the database by a moment; show live stock for this page only
+    if results.plates:
+        rows = fetch_by_id('''
+            SELECT plate_id, quantity_available FROM plates
+            WHERE plate_id IN ({ids}) AND is_active = 1
+        ''', [plate['plate_id'] for plate in results.plates])
+        stock = {row['plate_id']: row['quantity_available'] for row in rows}
+        for plate in results.plates:
+            plate['quantity_available'] = stock.get(plate['plate_id'], 0)
+        results.plates = [plate for plate in results.plates if plate['quantity_available'] > 0]
+    return results
+
+def _order_history(user_id, user_type):
+    """Purchases (customers) or claims (needy users), newest first, as a row stream"""
+    # One index range scan on the history read model per shard
+    statuses = ('CONFIRMED', 'PICKED_UP') if user_type == 'customer' else ('CLAIMED', 'PICKED_UP')
+    return scatter_stream('''
+        SELECT reservation_id, qty, status, pickup_code, confirmed_at, claimed_at, created_at,
+               title, description, price, start_time, end_time, restaurant_name, donated_by,
+               total_price, ordered_at
+        FROM order_history_rows
+        WHERE user_id = %s AND status IN (%s, %s)
+        ORDER BY ordered_at DESC
+    ''', (user_id, *statuses), order_by='ordered_at', reverse=True)
+
+def _free_plate_allowance(user_id):
+    """(claimed today, requested but not yet allocated, still allowed) for a needy user"""
+    # Check how many plates this needy user has already claimed today
+    total_claimed = _claimed_today(user_id)
+    
+    # In batch mode, plates already requested but not yet allocated count against the limit
+    pending_requested = 0
+    if current_app.config['FREE_PLATE_ALLOCATION'] == 'batch':
+        cursor = get_db().cursor(dictionary=True)
+        cursor.execute('''
+            SELECT COALESCE(SUM(qty - qty_allocated), 0) as pending
+            FROM claim_requests
+            WHERE user_id = %s AND status = 'PENDING'
+        ''', (user_id,))
+        pending_requested = cursor.fetchone()['pending']
+        cursor.close()
+    
+    return total_claimed, pending_requested, max(0, 2 - total_claimed - pending_requested)
+
 @bp.route('/marketplace')
 def marketplace():
     if 'user_id' not in session:
@@ -15,23 +187,18 @@ def marketplace():
         flash('As a needy user, you can access free donated plates only', 'info')
         return redirect(url_for('customer.free_plates'))
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
+    filters = _marketplace_filters()
+    if request.args.get('near') == 'home' and filters['lat'] is None:
+        flash("We couldn't place your address on the map; try Near me instead", 'info')
+    results = _marketplace_results(filters)
     
-    # Get available plates
-    cursor.execute('''
-        SELECT p.plate_id, p.title, p.description, p.price, p.quantity_available,
-               p.start_time, p.end_time, u.name as restaurant_name
-        FROM plates p
-        JOIN users u ON u.user_id = p.restaurant_id
-        WHERE p.is_active = 1 AND p.quantity_available > 0
-          AND NOW() BETWEEN p.start_time AND p.end_time
-        ORDER BY p.end_time ASC
-    ''')
-    plates = cursor.fetchall()
-    cursor.close()
+    def page_url(**changes):
+        """This search with some filters changed; any filter change goes back to page 1"""
+        args = {**filters, 'page': None, **changes}
+        return url_for('customer.marketplace', **{k: v for k, v in args.items() if v not in (None, '')})
     
-    return render_template('customer/marketplace.html', plates=plates)
+    return render_template('customer/marketplace.html', plates=results.plates, results=results,
+                           filters=filters, page_url=page_url)
 
 @bp.route('/free-plates')
 def free_plates():
@@ -39,33 +206,10 @@ def free_plates():
         flash('This page is for needy users only', 'error')
         return redirect(url_for('auth.login'))
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    # Check how many plates this needy user has already claimed today
-    cursor.execute('''
-        SELECT COALESCE(SUM(qty), 0) as total_claimed
-        FROM reservations 
-        WHERE user_id = %s AND status IN ('CLAIMED', 'PICKED_UP')
-          AND DATE(claimed_at) = CURDATE()
-    ''', (session['user_id'],))
-    total_claimed = cursor.fetchone()['total_claimed']
-    
-    remaining_plates = max(0, 2 - total_claimed)
+    total_claimed, pending_requested, remaining_plates = _free_plate_allowance(session['user_id'])
+    allocation_mode = current_app.config['FREE_PLATE_ALLOCATION']
     
-    # Get donated plates that haven't been claimed yet
-    cursor.execute('''
-        SELECT r.reservation_id, r.qty as available_qty, p.plate_id, p.title, p.description, 
-               p.price, p.start_time, p.end_time, u.name as restaurant_name
-        FROM reservations r
-        JOIN plates p ON p.plate_id = r.plate_id
-        JOIN users u ON u.user_id = p.restaurant_id
-        WHERE r.status = 'DONATED'
-          AND NOW() BETWEEN p.start_time AND p.end_time
-        ORDER BY r.created_at ASC
-    ''')
-    donated_plates = cursor.fetchall()
-    cursor.close()
+    donated_plates = open_donations()
     
     # Initialize needy cart if it doesn't exist
     if 'needy_cart' not in session:
@@ -76,7 +220,67 @@ def free_plates():
                           total_claimed=total_claimed,
                           remaining_plates=remaining_plates,
                           max_allowed=2,
-                          needy_cart=session.get('needy_cart', []))
+                          needy_cart=session.get('needy_cart', []),
+                          allocation_mode=allocation_mode,
+                          pending_requested=pending_requested)
+
+@bp.route('/request-free-plates', methods=['POST'])
+def request_free_plates():
+    if 'user_id' not in session or session.get('user_type') != 'needy':
+        flash('This action is for needy users only', 'error')
+        return redirect(url_for('auth.login'))
+    
+    if current_app.config['FREE_PLATE_ALLOCATION'] != 'batch':
+        return redirect(url_for('customer.free_plates'))
+    
+    qty = int(request.form.get('qty', 1))
+    if qty < 1:
+        flash('Quantity must be at least 1', 'error')
+        return redirect(url_for('customer.free_plates'))
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    try:
+        # Lock this user's pending requests so two submissions can't both pass the limit
+        cursor.execute('''
+            SELECT COALESCE(SUM(qty - qty_allocated), 0) as pending
+            FROM claim_requests
+            WHERE user_id = %s AND status = 'PENDING'
+            FOR UPDATE
+        ''', (session['user_id'],))
+        pending = cursor.fetchone()['pending']
+        
+        cursor.execute('''
+            SELECT COALESCE(SUM(qty), 0) as total_claimed
+            FROM reservations 
+            WHERE user_id = %s AND status IN ('CLAIMED', 'PICKED_UP')
+              AND DATE(claimed_at) = CURDATE()
+        ''', (session['user_id'],))
+        total_claimed = cursor.fetchone()['total_claimed']
+        
+        if total_claimed + pending + qty > 2:
+            db.rollback()
+            flash(f'Cannot request {qty} plate(s). You can only receive 2 plates per day, including pending requests.', 'error')
+            return redirect(url_for('customer.free_plates'))
+        
+        cursor.execute('''
+            INSERT INTO claim_requests (user_id, qty)
+            VALUES (%s, %s)
+        ''', (session['user_id'], qty))
+        # Have a worker run the allocator now instead of waiting for the next tick
+        enqueue(cursor, 'allocation.run', priority=PRIORITY_HIGH, coalesce=True)
+        db.commit()
+        
+        flash(f'Request for {qty} plate(s) received! Plates are handed out every few seconds; your pickup codes will appear in My History.', 'success')
+        return redirect(url_for('customer.free_plates'))
+        
+    except Exception as e:
+        db.rollback()
+        flash(f'Error requesting plates: {e}', 'error')
+        return redirect(url_for('customer.free_plates'))
+    finally:
+        cursor.close()
 
 @bp.route('/add-to-cart', methods=['POST'])
 def add_to_cart():
@@ -121,24 +325,17 @@ def cart():
     if not cart_items:
         return render_template('customer/cart.html', cart_items=[], total=0)
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
     # Get details for all items in cart
     plate_ids = [item['plate_id'] for item in cart_items]
-    placeholders = ','.join(['%s'] * len(plate_ids))
     
-    cursor.execute(f'''
+    plates = fetch_by_id('''
         SELECT p.plate_id, p.title, p.description, p.price, p.quantity_available,
                p.start_time, p.end_time, u.name as restaurant_name, p.is_active
         FROM plates p
         JOIN users u ON u.user_id = p.restaurant_id
-        WHERE p.plate_id IN ({placeholders})
+        WHERE p.plate_id IN ({ids})
     ''', plate_ids)
     
-    plates = cursor.fetchall()
-    cursor.close()
-    
     # Merge cart quantities with plate details
     cart_details = []
     total = 0
@@ -258,23 +455,23 @@ def remove_from_needy_cart(reservation_id):
     return redirect(url_for('customer.free_plates'))
 
 @bp.route('/claim-free/<int:reservation_id>', methods=['POST'])
+@idempotent(fallback='customer.free_plates')
+@admission_control(_claim_free_keys, _donations_available, fallback='customer.free_plates')
 def claim_free(reservation_id):
     if 'user_id' not in session or session.get('user_type') != 'needy':
         flash('This action is for needy users only', 'error')
         return redirect(url_for('auth.login'))
     
-    db = get_db()
+    if current_app.config['FREE_PLATE_ALLOCATION'] == 'batch':
+        flash('Free plates are allocated in batches. Please submit a request instead.', 'info')
+        return redirect(url_for('customer.free_plates'))
+    
+    db = get_db(reservation_id=reservation_id)
     cursor = db.cursor(dictionary=True)
     
     try:
         # Check how many plates user has claimed today (by quantity)
-        cursor.execute('''
-            SELECT COALESCE(SUM(qty), 0) as total_claimed
-            FROM reservations 
-            WHERE user_id = %s AND status IN ('CLAIMED', 'PICKED_UP')
-              AND DATE(claimed_at) = CURDATE()
-        ''', (session['user_id'],))
-        total_claimed = cursor.fetchone()['total_claimed']
+        total_claimed = _claimed_today(session['user_id'])
         
         if total_claimed >= 2:
             flash('You have already claimed your maximum of 2 free plates today. Please come back tomorrow!', 'error')
@@ -303,6 +500,8 @@ def claim_free(reservation_id):
                 claimed_at = NOW(), confirmed_at = NOW()
             WHERE reservation_id = %s
         ''', (session['user_id'], pickup_code, reservation_id))
+        record_events(cursor, [(RESERVATION_CLAIMED, reservation['plate_id'], reservation_id)])
+        sync_reservations(cursor, [reservation_id])
         
         db.commit()
         
@@ -317,29 +516,35 @@ def claim_free(reservation_id):
         cursor.close()
 
 @bp.route('/claim-selected-plates', methods=['POST'])
+@idempotent(fallback='customer.free_plates')
+@admission_control(_needy_cart_keys, _donations_available, fallback='customer.free_plates')
 def claim_selected_plates():
     if 'user_id' not in session or session.get('user_type') != 'needy':
         flash('This action is for needy users only', 'error')
         return redirect(url_for('auth.login'))
     
+    if current_app.config['FREE_PLATE_ALLOCATION'] == 'batch':
+        flash('Free plates are allocated in batches. Please submit a request instead.', 'info')
+        return redirect(url_for('customer.free_plates'))
+    
     cart = session.get('needy_cart', [])
     
     if not cart:
         flash('No plates selected', 'error')
         return redirect(url_for('customer.free_plates'))
     
-    db = get_db()
+    # Each claim is one shard-local transaction
+    shard = _single_shard([item['reservation_id'] for item in cart])
+    if shard is None:
+        flash('Your selection has plates from more than one region. Please claim each region separately.', 'error')
+        return redirect(url_for('customer.free_plates'))
+    
+    db = get_db(shard=shard)
     cursor = db.cursor(dictionary=True)
     
     try:
         # Check how many plates user has already claimed today
-        cursor.execute('''
-            SELECT COALESCE(SUM(qty), 0) as total_claimed
-            FROM reservations 
-            WHERE user_id = %s AND status IN ('CLAIMED', 'PICKED_UP')
-              AND DATE(claimed_at) = CURDATE()
-        ''', (session['user_id'],))
-        total_claimed = cursor.fetchone()['total_claimed']
+        total_claimed = _claimed_today(session['user_id'])
         
         # Calculate cart total
         cart_total = sum(item['qty'] for item in cart)
@@ -348,22 +553,27 @@ def claim_selected_plates():
             flash(f'Cannot claim {cart_total} plates. You have already claimed {total_claimed} today. Maximum is 2 plates total.', 'error')
             return redirect(url_for('customer.free_plates'))
         
+        wanted = {item['reservation_id']: item['qty'] for item in cart}
+        placeholders = ','.join(['%s'] * len(wanted))
+        
+        # Lock every selected donation with one statement
+        cursor.execute(f'''
+            SELECT r.*, p.restaurant_id, p.title
+            FROM reservations r
+            JOIN plates p ON p.plate_id = r.plate_id
+            WHERE r.reservation_id IN ({placeholders}) AND r.status = 'DONATED'
+            FOR UPDATE
+        ''', list(wanted))
+        donations = {row['reservation_id']: row for row in cursor.fetchall()}
+        
         claimed_items = []
+        events = []
+        splits = []
+        split_claims = []
+        whole_claims = []
         
-        for cart_item in cart:
-            reservation_id = cart_item['reservation_id']
-            requested_qty = cart_item['qty']
-            
-            # Get the donated reservation with lock
-            cursor.execute('''
-                SELECT r.*, p.restaurant_id, p.title
-                FROM reservations r
-                JOIN plates p ON p.plate_id = r.plate_id
-                WHERE r.reservation_id = %s AND r.status = 'DONATED'
-                FOR UPDATE
-            ''', (reservation_id,))
-            
-            reservation = cursor.fetchone()
+        for reservation_id, requested_qty in wanted.items():
+            reservation = donations.get(reservation_id)
             
             if not reservation:
                 db.rollback()
@@ -376,43 +586,45 @@ def claim_selected_plates():
                 flash(f'Not enough "{reservation["title"]}" available. Only {reservation["qty"]} left.', 'error')
                 return redirect(url_for('customer.free_plates'))
             
+            pickup_code = f"{secrets.randbelow(10**8):08d}"
             # If requesting less than total available, split the reservation
             if reservation['qty'] > requested_qty:
-                # Update existing reservation to reduce quantity
-                cursor.execute('''
-                    UPDATE reservations 
-                    SET qty = qty - %s
-                    WHERE reservation_id = %s
-                ''', (requested_qty, reservation_id))
-                
-                # Create new reservation for claimed portion
-                pickup_code = f"{secrets.randbelow(10**8):08d}"
-                cursor.execute('''
-                    INSERT INTO reservations (user_id, donor_id, plate_id, qty, status, pickup_code, claimed_at, confirmed_at)
-                    VALUES (%s, %s, %s, %s, 'CLAIMED', %s, NOW(), NOW())
-                ''', (session['user_id'], reservation['donor_id'], reservation['plate_id'], requested_qty, pickup_code))
-                
-                claimed_items.append({
-                    'title': reservation['title'],
-                    'qty': requested_qty,
-                    'pickup_code': pickup_code
-                })
+                splits.append((requested_qty, reservation_id))
+                split_claims.append((session['user_id'], reservation['donor_id'], reservation['plate_id'],
+                                     requested_qty, pickup_code))
+                events.append((RESERVATION_UPDATED, reservation['plate_id'], reservation_id))
+                # The claimed portion is a multi-row insert, so the feed carries only its plate
+                events.append((RESERVATION_CLAIMED, reservation['plate_id'], None))
             else:
-                # Claim entire reservation
-                pickup_code = f"{secrets.randbelow(10**8):08d}"
-                cursor.execute('''
-                    UPDATE reservations 
-                    SET user_id = %s, status = 'CLAIMED', pickup_code = %s, 
-                        claimed_at = NOW(), confirmed_at = NOW()
-                    WHERE reservation_id = %s
-                ''', (session['user_id'], pickup_code, reservation_id))
-                
-                claimed_items.append({
-                    'title': reservation['title'],
-                    'qty': requested_qty,
-                    'pickup_code': pickup_code
-                })
+                whole_claims.append((session['user_id'], pickup_code, reservation_id))
+                events.append((RESERVATION_CLAIMED, reservation['plate_id'], reservation_id))
+            
+            claimed_items.append({
+                'title': reservation['title'],
+                'qty': requested_qty,
+                'pickup_code': pickup_code
+            })
+        
+        if splits:
+            cursor.executemany('''
+                UPDATE reservations 
+                SET qty = qty - %s
+                WHERE reservation_id = %s
+            ''', splits)
+            cursor.executemany('''
+                INSERT INTO reservations (user_id, donor_id, plate_id, qty, status, pickup_code, claimed_at, confirmed_at)
+                VALUES (%s, %s, %s, %s, 'CLAIMED', %s, NOW(), NOW())
+            ''', split_claims)
+        if whole_claims:
+            cursor.executemany('''
+                UPDATE reservations 
+                SET user_id = %s, status = 'CLAIMED', pickup_code = %s, 
+                    claimed_at = NOW(), confirmed_at = NOW()
+                WHERE reservation_id = %s
+            ''', whole_claims)
         
+        record_events(cursor, events)
+        sync_reservations(cursor, plate_ids=[donations[reservation_id]['plate_id'] for reservation_id in wanted])
         db.commit()
         
         # Clear needy cart
@@ -446,26 +658,19 @@ def checkout():
         flash('Your cart is empty', 'info')
         return redirect(url_for('customer.marketplace'))
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
     # Get details for all items in cart
     plate_ids = [item['plate_id'] for item in cart_items]
-    placeholders = ','.join(['%s'] * len(plate_ids))
     
-    cursor.execute(f'''
+    plates = fetch_by_id('''
         SELECT p.plate_id, p.title, p.description, p.price, p.quantity_available,
                p.start_time, p.end_time, p.restaurant_id, u.name as restaurant_name, p.is_active
         FROM plates p
         JOIN users u ON u.user_id = p.restaurant_id
-        WHERE p.plate_id IN ({placeholders})
+        WHERE p.plate_id IN ({ids})
           AND p.is_active = 1
           AND NOW() BETWEEN p.start_time AND p.end_time
     ''', plate_ids)
     
-    plates = cursor.fetchall()
-    cursor.close()
-    
     # Merge cart quantities with plate details and check availability
     cart_details = []
     total = 0
@@ -489,6 +694,8 @@ def checkout():
     return render_template('customer/checkout.html', cart_items=cart_details, total=total)
 
 @bp.route('/confirm-order', methods=['POST'])
+@idempotent(fallback='customer.cart')
+@admission_control(_cart_plate_keys, _cart_in_stock, fallback='customer.cart')
 def confirm_order():
     if 'user_id' not in session:
         flash('Please login first', 'error')
@@ -500,83 +707,91 @@ def confirm_order():
         flash('Your cart is empty', 'error')
         return redirect(url_for('customer.marketplace'))
     
-    db = get_db()
+    # Each checkout is one shard-local transaction
+    shard = _single_shard([item['plate_id'] for item in cart_items])
+    if shard is None:
+        flash('Your cart has plates from more than one region. Please check out each region separately.', 'error')
+        return redirect(url_for('customer.cart'))
+    
+    db = get_db(shard=shard)
     cursor = db.cursor(dictionary=True)
     
     try:
-        total_amount = 0
-        confirmed_items = []
+        wanted = {item['plate_id']: item['qty'] for item in cart_items}
+        placeholders = ','.join(['%s'] * len(wanted))
         
-        for cart_item in cart_items:
-            plate_id = cart_item['plate_id']
-            qty = cart_item['qty']
-            
-            # Get plate details and lock row for update
-            cursor.execute('''
-                SELECT p.*, u.user_id as restaurant_id
-                FROM plates p
-                JOIN users u ON p.restaurant_id = u.user_id
-                WHERE p.plate_id = %s AND p.is_active = 1
-                  AND p.quantity_available >= %s
-                  AND NOW() BETWEEN p.start_time AND p.end_time
-                FOR UPDATE
-            ''', (plate_id, qty))
-            
-            plate = cursor.fetchone()
-            
-            if not plate:
+        # Lock every plate in the cart with one statement; the work below is the same for any cart size
+        cursor.execute(f'''
+            SELECT p.*, u.user_id as restaurant_id
+            FROM plates p
+            JOIN users u ON p.restaurant_id = u.user_id
+            WHERE p.plate_id IN ({placeholders}) AND p.is_active = 1
+              AND NOW() BETWEEN p.start_time AND p.end_time
+            FOR UPDATE
+        ''', list(wanted))
+        plates = {plate['plate_id']: plate for plate in cursor.fetchall()}
+        
+        for plate_id, qty in wanted.items():
+            plate = plates.get(plate_id)
+            if not plate or plate['quantity_available'] < qty:
                 db.rollback()
                 flash(f'Item "{plate_id}" is no longer available in requested quantity', 'error')
                 return redirect(url_for('customer.cart'))
+        
+        cursor.executemany('''
+            UPDATE plates 
+            SET quantity_available = quantity_available - %s
+            WHERE plate_id = %s
+        ''', [(qty, plate_id) for plate_id, qty in wanted.items()])
+        
+        total_amount = Decimal(0)
+        confirmed_items = []
+        events = []
+        earned = defaultdict(Decimal)
+        reservations = []
+        transactions = []
+        donating = session['user_type'] == 'donner'
+        
+        for plate_id, qty in wanted.items():
+            plate = plates[plate_id]
+            # Exact cents, so balance credits match transactions.amount; SQLite hands DECIMAL back as float
+            amount = Decimal(str(plate['price'])) * int(qty)
+            events.append((PLATE_STOCK_CHANGED, plate_id, None))
+            # Ids of multi-row inserts aren't known; the feed carries the plate
+            events.append((RESERVATION_CREATED, plate_id, None))
             
-            # Update plate quantity
-            cursor.execute('''
-                UPDATE plates 
-                SET quantity_available = quantity_available - %s
-                WHERE plate_id = %s
-            ''', (qty, plate_id))
-            
-            # DONOR FLOW - Create donated reservation
-            if session['user_type'] == 'donner':
-                cursor.execute('''
-                    INSERT INTO reservations (donor_id, plate_id, qty, status, confirmed_at)
-                    VALUES (%s, %s, %s, 'DONATED', NOW())
-                ''', (session['user_id'], plate_id, qty))
-                
-                # Record transaction
-                amount = float(plate['price']) * int(qty)
-                cursor.execute('''
-                    INSERT INTO transactions (payer_user_id, payee_restaurant_id, amount, type)
-                    VALUES (%s, %s, %s, 'DONATION_PURCHASE')
-                ''', (session['user_id'], plate['restaurant_id'], amount))
-                
-                total_amount += amount
-            
-            # CUSTOMER FLOW - Normal purchase
+            # DONOR FLOW - donated reservation; CUSTOMER FLOW - confirmed purchase with a pickup code
+            if donating:
+                reservations.append((None, session['user_id'], plate_id, qty, 'DONATED', None))
+                transactions.append((session['user_id'], plate['restaurant_id'], amount, 'DONATION_PURCHASE'))
             else:
-                # Generate pickup code
                 pickup_code = f"{secrets.randbelow(10**8):08d}"
-                
-                # Create confirmed reservation
-                cursor.execute('''
-                    INSERT INTO reservations (user_id, plate_id, qty, status, pickup_code, confirmed_at)
-                    VALUES (%s, %s, %s, 'CONFIRMED', %s, NOW())
-                ''', (session['user_id'], plate_id, qty, pickup_code))
-                
-                # Record transaction
-                amount = float(plate['price']) * int(qty)
-                cursor.execute('''
-                    INSERT INTO transactions (payer_user_id, payee_restaurant_id, amount, type)
-                    VALUES (%s, %s, %s, 'CUSTOMER_PURCHASE')
-                ''', (session['user_id'], plate['restaurant_id'], amount))
-                
-                total_amount += amount
+                reservations.append((session['user_id'], None, plate_id, qty, 'CONFIRMED', pickup_code))
+                transactions.append((session['user_id'], plate['restaurant_id'], amount, 'CUSTOMER_PURCHASE'))
                 confirmed_items.append({
                     'title': plate['title'],
                     'qty': qty,
                     'pickup_code': pickup_code
                 })
+            earned[plate['restaurant_id']] += amount
+            total_amount += amount
+        
+        cursor.executemany('''
+            INSERT INTO reservations (user_id, donor_id, plate_id, qty, status, pickup_code, confirmed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ''', reservations)
+        cursor.executemany('''
+            INSERT INTO transactions (payer_user_id, payee_restaurant_id, amount, type)
+            VALUES (%s, %s, %s, %s)
+        ''', transactions)
         
+        # Running balances commit atomically with the transactions above
+        credit_restaurants(cursor, earned)
+        record_events(cursor, events)
+        sync_reservations(cursor, plate_ids=list(wanted))
+        if donating and current_app.config['FREE_PLATE_ALLOCATION'] == 'batch':
+            # New donations can fill waiting requests; allocation runs after we respond
+            enqueue(cursor, 'allocation.run', priority=PRIORITY_HIGH, coalesce=True)
         db.commit()
         
         # Clear cart
@@ -611,51 +826,81 @@ def order_history():
         flash('Order history is not available for your account type', 'info')
         return redirect(url_for('customer.marketplace'))
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
     orders = []
     
     try:
-        if user_type == 'customer':
-            # Get customer's purchase history
-            cursor.execute('''
-                SELECT r.reservation_id, r.qty, r.status, r.pickup_code, 
-                       r.confirmed_at, r.created_at,
-                       p.title, p.description, p.price, p.start_time, p.end_time,
-                       u.name as restaurant_name,
-                       (r.qty * p.price) as total_price
-                FROM reservations r
-                JOIN plates p ON p.plate_id = r.plate_id
-                JOIN users u ON p.restaurant_id = u.user_id
-                WHERE r.user_id = %s AND r.status IN ('CONFIRMED', 'PICKED_UP')
-                ORDER BY r.confirmed_at DESC
-            ''', (session['user_id'],))
-            orders = cursor.fetchall()
-            
-        elif user_type == 'needy':
-            # Get needy user's claimed plates history
-            cursor.execute('''
-                SELECT r.reservation_id, r.qty, r.status, r.pickup_code,
-                       r.claimed_at, r.created_at,
-                       p.title, p.description, p.price, p.start_time, p.end_time,
-                       u.name as restaurant_name,
-                       donor.name as donated_by
-                FROM reservations r
-                JOIN plates p ON p.plate_id = r.plate_id
-                JOIN users u ON p.restaurant_id = u.user_id
-                LEFT JOIN users donor ON r.donor_id = donor.user_id
-                WHERE r.user_id = %s AND r.status IN ('CLAIMED', 'PICKED_UP')
-                ORDER BY r.claimed_at DESC
-            ''', (session['user_id'],))
-            orders = cursor.fetchall()
-        
-        cursor.close()
+        # The query runs here, before the response starts, so a database error still
+        # gets the flash and redirect below
+        orders = _order_history(session['user_id'], user_type).prefetch()
         
-        return render_template('customer/order_history.html', 
-                             orders=orders, 
-                             user_type=user_type)
+        # The remaining rows are read from the cursor while the page streams out
+        return stream_page('customer/order_history.html', 
+                           orders=orders, 
+                           user_type=user_type)
     
     except Exception as e:
         flash(f'Error loading order history: {e}', 'error')
-        return redirect(url_for('customer.marketplace'))
\ No newline at end of file
+        return redirect(url_for('customer.marketplace'))
+
+def _json_row(row, columns):
+    """A dict or streamed (named tuple) row as JSON-ready values: ISO timestamps and float prices"""
+    out = {}
+    for column in columns:
+        value = row[column] if isinstance(row, dict) else getattr(row, column)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        out[column] = value
+    return out
+
+def _api_error(message, status):
+    return jsonify(error=message), status
+
+_PLATE_FIELDS = ('plate_id', 'restaurant_id', 'title', 'description', 'price', 'quantity_available',
+                 'start_time', 'end_time', 'restaurant_name', 'latitude', 'longitude', 'distance_km')
+_DONATION_FIELDS = ('reservation_id', 'plate_id', 'available_qty', 'title', 'description', 'price',
+                    'start_time', 'end_time', 'restaurant_name', 'created_at')
+_ORDER_FIELDS = ('reservation_id', 'qty', 'status', 'pickup_code', 'title', 'description', 'price',
+                 'total_price', 'start_time', 'end_time', 'restaurant_name', 'donated_by', 'ordered_at')
+
+@bp.route('/api/plates')
+def marketplace_json():
+    if 'user_id' not in session:
+        return _api_error('login required', 401)
+    if session.get('user_type') == 'needy':
+        return _api_error('needy accounts can only browse free plates', 403)
+    
+    filters = _marketplace_filters()
+    results = _marketplace_results(filters)
+    return jsonify(
+        plates=[_json_row(plate, _PLATE_FIELDS) for plate in results.plates],
+        total=results.total,
+        page=results.page,
+        pages=results.pages,
+        facets=results.facets,
+    )
+
+@bp.route('/api/free-plates')
+def free_plates_json():
+    if 'user_id' not in session or session.get('user_type') != 'needy':
+        return _api_error('needy accounts only', 403)
+    
+    total_claimed, pending_requested, remaining_plates = _free_plate_allowance(session['user_id'])
+    return jsonify(
+        plates=[_json_row(plate, _DONATION_FIELDS) for plate in open_donations()],
+        total_claimed=total_claimed,
+        pending_requested=int(pending_requested),
+        remaining_plates=remaining_plates,
+    )
+
+@bp.route('/api/order-history')
+def order_history_json():
+    if 'user_id' not in session:
+        return _api_error('login required', 401)
+    user_type = session.get('user_type')
+    if user_type not in ['customer', 'needy']:
+        return _api_error('order history is not available for this account type', 403)
+    
+    orders = _order_history(session['user_id'], user_type)
+    return jsonify(orders=[_json_row(order, _ORDER_FIELDS) for order in orders])
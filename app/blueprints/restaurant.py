@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models.database import get_db
-import mysql.connector
+from models.database import get_db, DatabaseError, stream_query, shard_for_restaurant
+from models.change_feed import record_events, PLATE_CREATED
+from models.ledger import get_balance
+from app.streaming import stream_page
 
 bp = Blueprint('restaurant', __name__)
 
@@ -10,18 +12,24 @@ def dashboard():
         flash('Please login as a restaurant', 'error')
         return redirect(url_for('auth.login'))
     
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    
-    cursor.execute('''
-        SELECT * FROM plates 
-        WHERE restaurant_id = %s 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],))
-    plates = cursor.fetchall()
-    cursor.close()
+    try:
+        balance, lifetime_total = get_balance(session['user_id'])
+        
+        # The query runs here, before the response starts, so a database error still
+        # gets the flash and redirect below
+        plates = stream_query('''
+            SELECT * FROM plates 
+            WHERE restaurant_id = %s 
+            ORDER BY created_at DESC
+        ''', (session['user_id'],), shard=shard_for_restaurant(session['user_id'])).prefetch()
+        
+        # The remaining rows are read from the cursor while the page streams out
+        return stream_page('restaurant/dashboard.html', plates=plates,
+                           balance=balance, lifetime_total=lifetime_total)
     
-    return render_template('restaurant/dashboard.html', plates=plates)
+    except DatabaseError as err:
+        flash(f'Error loading dashboard: {err}', 'error')
+        return redirect(url_for('auth.index'))
 
 @bp.route('/create-listing', methods=['GET', 'POST'])
 def create_listing():
@@ -34,11 +42,12 @@ def create_listing():
         description = request.form.get('description')
         price = request.form.get('price')
         quantity = request.form.get('quantity')
-        start_time = request.form.get('start_time')
-        end_time = request.form.get('end_time')
+        # datetime-local inputs send 'YYYY-MM-DDTHH:MM'; store the canonical form
+        start_time = (request.form.get('start_time') or '').replace('T', ' ')
+        end_time = (request.form.get('end_time') or '').replace('T', ' ')
         
         try:
-            db = get_db()
+            db = get_db(restaurant_id=session['user_id'])
             cursor = db.cursor()
             
             cursor.execute('''
@@ -46,6 +55,7 @@ def create_listing():
                 (restaurant_id, title, description, price, quantity_available, quantity_original, start_time, end_time, is_active)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1)
             ''', (session['user_id'], title, description, price, quantity, quantity, start_time, end_time))
+            record_events(cursor, [(PLATE_CREATED, cursor.lastrowid, None)])
             
             db.commit()
             cursor.close()
@@ -53,7 +63,7 @@ def create_listing():
             flash('Listing created successfully!', 'success')
             return redirect(url_for('restaurant.dashboard'))
             
-        except mysql.connector.Error as err:
+        except DatabaseError as err:
             flash(f'Error creating listing: {err}', 'error')
             return redirect(url_for('restaurant.create_listing'))
     
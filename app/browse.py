@@ -0,0 +1,161 @@
+"""Asyncio front end for the read-only browse pages.
+
+The marketplace, free-plates and order-history pages (and their /api JSON
+twins) are where the fan-out is: many clients, many of them on slow mobile
+links. Under gunicorn's gthread workers every such client pins a thread, and
+its DB connection, until the last byte is written. BrowseApp is an ASGI app
+(run it under uvicorn, see asgi.py) that keeps every connection on the event
+loop and hands only the request itself to a small thread pool, where it runs
+through the regular Flask app. Queries, the search index, the fragment cache,
+templates and the session cookie are all shared with the WSGI deployment.
+
+Only GET/HEAD requests for BROWSE_ENDPOINTS are answered; everything else
+gets a 404 and belongs on the WSGI app (route it there at the proxy).
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+from app.startup import start_warm_up
+
+BROWSE_ENDPOINTS = frozenset({
+    'customer.marketplace', 'customer.marketplace_json',
+    'customer.free_plates', 'customer.free_plates_json',
+    'customer.order_history', 'customer.order_history_json',
+    'healthz', 'readyz',
+})
+
+_NOT_HERE = b'{"error": "not served by the browse server"}'
+_BUSY = b'{"error": "busy, retry shortly"}'
+
+
+def _environ(scope):
+    """A WSGI environ for an ASGI http scope (GET/HEAD only, so no body)"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': '0',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            continue
+        key = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class BrowseApp:
+    """ASGI callable that serves BROWSE_ENDPOINTS from a Flask app on a bounded thread pool"""
+
+    def __init__(self, flask_app, threads=None, max_queue=None):
+        self.flask_app = flask_app
+        # One thread per pooled DB connection: a request never waits on another for one
+        self.threads = threads or flask_app.config['BROWSE_THREADS']
+        self.max_queue = max_queue or flask_app.config['BROWSE_MAX_QUEUE']
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='browse')
+        self._adapter = flask_app.url_map.bind('localhost')
+        self._pending = 0
+
+    def _serves(self, method, path):
+        if method not in ('GET', 'HEAD'):
+            return False
+        try:
+            endpoint, _ = self._adapter.match(path, method='GET')
+        except HTTPException:
+            return False
+        return endpoint in BROWSE_ENDPOINTS
+
+    def _call_wsgi(self, environ):
+        """Run one request through Flask and read the whole body, on a pool thread"""
+        started = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+            return written.append
+
+        result = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            # Streamed pages are drained here, so the cursor is done before the slow write
+            body = b''.join(written) + b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        # The body is complete, so give a streamed page a length rather than chunking it
+        headers = list(started['headers'])
+        if not any(name.lower() == 'content-length' for name, _ in headers):
+            headers.append(('Content-Length', str(len(body))))
+        return started['status'], headers, body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if not self._serves(scope['method'], scope['path']):
+            await self._respond(send, 404, [('Content-Type', 'application/json')], _NOT_HERE)
+            return
+
+        # Shed load once the backlog would take longer to clear than a client will wait
+        if self._pending >= self.max_queue:
+            await self._respond(send, 503, [('Content-Type', 'application/json'), ('Retry-After', '1')],
+                                _BUSY)
+            return
+
+        environ = _environ(scope)
+        # Render HEAD as GET so a streamed page still reports its full Content-Length;
+        # werkzeug would hand back an empty body for it
+        environ['REQUEST_METHOD'] = 'GET'
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, body = await loop.run_in_executor(self.executor, self._call_wsgi, environ)
+        finally:
+            self._pending -= 1
+
+        if scope['method'] == 'HEAD':
+            body = b''
+        await self._respond(send, status, headers, body)
+
+    async def _respond(self, send, status, headers, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Same warm-up as a gunicorn worker; /readyz flips when it is done
+                start_warm_up(self.flask_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup, escape
+
+# Columns a plate card renders that only change when the listing itself changes
+STATIC_PLATE_FIELDS = ('plate_id', 'reservation_id', 'title', 'description', 'restaurant_name',
+                       'price', 'start_time', 'end_time')
+
+
+class FragmentCache:
+    """LRU of rendered template fragments bounded by an approximate byte budget.
+
+    Entries are tuples of static text split around named volatile slots, so a
+    cached fragment can be reassembled with fresh values on every request.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            parts = self._entries.get(key)
+            if parts is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return parts
+
+    def put(self, key, parts):
+        cost = sum(len(part) for part in parts)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= sum(len(part) for part in old)
+            self._entries[key] = parts
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sum(len(part) for part in evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def plate_version(plate):
+    """Cache key part covering everything static a card shows; any edit yields a new key"""
+    return tuple(plate.get(field) for field in STATIC_PLATE_FIELDS)
+
+
+def _render_parts(template_name, plate, variant, slots):
+    # A fresh random marker per render, so plate text can never forge a slot
+    token = uuid.uuid4().hex
+    placeholders = {name: Markup(f'{token}{name}{token}') for name in slots}
+    html = current_app.jinja_env.get_template(template_name).render(
+        plate=plate, variant=variant, **placeholders)
+    slot_re = re.compile(f"{token}({'|'.join(re.escape(name) for name in slots)}){token}")
+    # re.split alternates static text and slot names: [text, name, text, name, text]
+    return tuple(slot_re.split(html)) if slots else (html,)
+
+
+def plate_card(template_name, plate, variant=None, **volatile):
+    """Template global: render a plate card from cache, filling in only the volatile fields.
+
+    The fragment template sees `plate` and `variant` (part of the cache key, e.g. the
+    viewer's role) as static values; every keyword in `volatile` (stock counts, input
+    limits) is rendered fresh for this request.
+    """
+    cache = current_app.extensions['fragment_cache']
+    key = (template_name, variant, tuple(sorted(volatile)), plate_version(plate))
+    parts = cache.get(key)
+    if parts is None:
+        parts = _render_parts(template_name, plate, variant, volatile)
+        cache.put(key, parts)
+
+    out = []
+    for index, part in enumerate(parts):
+        out.append(escape(volatile[part]) if index % 2 else part)
+    return Markup(''.join(out))
+
+
+def init_fragments(app):
+    app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_BYTES'])
+    app.add_template_global(plate_card)
+
+    # Compiled templates survive restarts, so new workers skip Jinja compilation
+    cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja-cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
@@ -0,0 +1,185 @@
+import copy
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+import click
+from flask import current_app, flash, redirect, request, session, url_for
+from flask.cli import with_appcontext
+
+from models.database import get_db
+from models.jobs import job
+
+FORM_FIELD = 'idempotency_key'
+HEADER = 'Idempotency-Key'
+STILL_PROCESSING_MESSAGE = 'Your previous request is still being processed. Please check again in a moment.'
+
+
+def new_idempotency_key():
+    """Template global: one key per rendered form, so resubmits of that form share it"""
+    return uuid.uuid4().hex
+
+
+def _request_key():
+    key = request.form.get(FORM_FIELD) or request.headers.get(HEADER)
+    return key[:64] if key else None
+
+
+def _claim(user_id, key, endpoint):
+    """Insert the key as PENDING in its own short transaction. Returns True if we own it."""
+    db = get_db()
+    cursor = db.cursor()
+    cutoff = datetime.now() - timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+    # An expired key is free to reuse
+    cursor.execute('''
+        DELETE FROM idempotency_keys WHERE user_id = %s AND idem_key = %s AND created_at < %s
+    ''', (user_id, key, cutoff))
+    cursor.execute('''
+        INSERT IGNORE INTO idempotency_keys (user_id, idem_key, endpoint, status)
+        VALUES (%s, %s, %s, 'PENDING')
+    ''', (user_id, key, endpoint))
+    owned = cursor.rowcount == 1
+    db.commit()
+    cursor.close()
+    return owned
+
+
+def _finish(user_id, key, location, result):
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        UPDATE idempotency_keys SET status = 'DONE', location = %s, result = %s
+        WHERE user_id = %s AND idem_key = %s
+    ''', (location, json.dumps(result), user_id, key))
+    db.commit()
+    cursor.close()
+
+
+def _release(user_id, key):
+    """Forget a key whose first attempt raised or failed, so a retry runs again"""
+    db = get_db()
+    db.rollback()
+    cursor = db.cursor()
+    cursor.execute('DELETE FROM idempotency_keys WHERE user_id = %s AND idem_key = %s', (user_id, key))
+    db.commit()
+    cursor.close()
+
+
+def _wait_for_result(user_id, key):
+    """Poll the key row until the in-flight original finishes or we give up"""
+    db = get_db()
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+    delay = 0.02
+    while True:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute('''
+            SELECT status, location, result FROM idempotency_keys
+            WHERE user_id = %s AND idem_key = %s
+        ''', (user_id, key))
+        row = cursor.fetchone()
+        cursor.close()
+        # End the read so the next poll sees the original's commit
+        db.commit()
+        if row is None or row['status'] == 'DONE' or time.monotonic() >= deadline:
+            return row
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def _session_snapshot():
+    return {k: copy.deepcopy(v) for k, v in session.items() if k != '_flashes'}
+
+
+def idempotent(fallback='customer.marketplace'):
+    """Decorate a write route so a repeated submission replays the first result.
+
+    The form field `idempotency_key` (or an Idempotency-Key header) names the
+    attempt. The first request with a key runs the view and stores its redirect,
+    flashed messages and session changes. Duplicates never run the view: they
+    wait for the original to finish, then replay what it stored. Requests
+    without a key, or from anonymous users, run the view as before.
+
+    Only attempts that went through are stored. The write views flash an
+    'error' exactly when they rolled back or turned the request away (e.g. the
+    admission busy message), and those attempts release the key, so retrying
+    the same submission runs the view again instead of replaying the failure.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(**view_args):
+            key = _request_key()
+            user_id = session.get('user_id')
+            if not key or user_id is None:
+                return view(**view_args)
+
+            if not _claim(user_id, key, request.endpoint):
+                row = _wait_for_result(user_id, key)
+                if row is None or row['status'] != 'DONE':
+                    flash(STILL_PROCESSING_MESSAGE, 'info')
+                    return redirect(url_for(fallback))
+                result = json.loads(row['result'])
+                for name, value in result['session'].items():
+                    if value is None:
+                        session.pop(name, None)
+                    else:
+                        session[name] = value
+                for category, message in result['flashes']:
+                    flash(message, category)
+                return redirect(row['location'] or url_for(fallback))
+
+            before = _session_snapshot()
+            flashed = len(session.get('_flashes', []))
+            try:
+                response = view(**view_args)
+            except Exception:
+                _release(user_id, key)
+                raise
+
+            flashes = session.get('_flashes', [])[flashed:]
+            if any(category == 'error' for category, _ in flashes):
+                _release(user_id, key)
+                return response
+
+            after = _session_snapshot()
+            result = {
+                'flashes': flashes,
+                'session': {name: after.get(name) for name in before.keys() | after.keys()
+                            if before.get(name) != after.get(name)},
+            }
+            _finish(user_id, key, getattr(response, 'location', None), result)
+            return response
+        return wrapped
+    return decorator
+
+
+def purge_expired(ttl_hours=None):
+    """Delete keys older than the TTL. Returns the number deleted."""
+    if ttl_hours is None:
+        ttl_hours = current_app.config['IDEMPOTENCY_TTL_HOURS']
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('DELETE FROM idempotency_keys WHERE created_at < %s',
+                   (datetime.now() - timedelta(hours=ttl_hours),))
+    deleted = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return deleted
+
+
+@job('idempotency.purge')
+def _purge_job(payload):
+    purge_expired(payload.get('ttl_hours'))
+
+
+@click.command('purge-idempotency-keys')
+@click.option('--ttl-hours', type=int, default=None)
+@with_appcontext
+def purge_idempotency_keys_command(ttl_hours):
+    """Delete expired idempotency keys"""
+    click.echo(f'Deleted {purge_expired(ttl_hours)} idempotency keys')
+
+
+def init_idempotency(app):
+    app.add_template_global(new_idempotency_key)
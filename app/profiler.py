@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+
+from models.database import DatabaseError, get_db
+from models.query_log import QueryLog
+
+MAX_DURATION_SECONDS = 600
+MAX_STACK_DEPTH = 64
+
+
+def _collapse(frame):
+    """Render a frame chain as a collapsed stack: root;...;leaf"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# --- Sessions, shared by every worker through the home database ------------
+
+def start_session(endpoint=None, percent=100.0, duration=30.0, interval=0.01):
+    """Start a profiling session for every worker process; each picks it up on its next poll"""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        INSERT INTO profiler_sessions (endpoint, percent, interval_ms, ends_at)
+        VALUES (%s, %s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))
+    ''', (endpoint or None, max(0.0, min(100.0, percent)), max(0.001, interval) * 1000,
+          int(max(1.0, min(duration, MAX_DURATION_SECONDS)))))
+    session_id = cursor.lastrowid
+    # Only the latest session is ever shown
+    cursor.execute('DELETE FROM profiler_stacks WHERE session_id < %s', (session_id,))
+    cursor.execute('DELETE FROM profiler_requests WHERE session_id < %s', (session_id,))
+    db.commit()
+    cursor.close()
+    return session_id
+
+
+def stop_session():
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('UPDATE profiler_sessions SET ends_at = NOW() WHERE ends_at > NOW()')
+    db.commit()
+    cursor.close()
+
+
+def current_session():
+    """The latest session with its sample totals across workers, or None"""
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute('''
+        SELECT session_id, endpoint, percent, interval_ms, ends_at, NOW() AS db_now
+        FROM profiler_sessions
+        ORDER BY session_id DESC
+        LIMIT 1
+    ''')
+    session = cursor.fetchone()
+    if session is not None:
+        cursor.execute('''
+            SELECT COALESCE(SUM(samples), 0) AS samples, COUNT(DISTINCT pid) AS workers
+            FROM profiler_stacks WHERE session_id = %s
+        ''', (session['session_id'],))
+        session.update(cursor.fetchone())
+        session['remaining'] = max(0.0, (session['ends_at'] - session['db_now']).total_seconds())
+        session['running'] = session['remaining'] > 0
+    cursor.close()
+    return session
+
+
+def collapsed_stacks(session_id):
+    """Stacks summed over every worker, in the collapsed format flamegraph.pl and speedscope read"""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT stack, SUM(samples) AS total
+        FROM profiler_stacks
+        WHERE session_id = %s
+        GROUP BY stack_hash, stack
+        ORDER BY total DESC
+    ''', (session_id,))
+    lines = [f'{stack} {int(total)}' for stack, total in cursor.fetchall()]
+    cursor.close()
+    return '\n'.join(lines)
+
+
+def profiled_requests(session_id, limit=200):
+    """The session's latest profiled requests from every worker, oldest first"""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT record FROM profiler_requests
+        WHERE session_id = %s
+        ORDER BY request_id DESC
+        LIMIT %s
+    ''', (session_id, limit))
+    records = [json.loads(record) for record, in cursor.fetchall()]
+    cursor.close()
+    return records[::-1]
+
+
+# --- The per-process sampler -----------------------------------------------
+
+class SamplingProfiler:
+    """Samples the stacks of selected request threads on a background thread.
+
+    Sessions live in the profiler_sessions table, so a start or stop from any
+    worker reaches all of them: a sync thread in each process polls it every
+    PROFILER_POLL_SECONDS and flushes the samples and request records gathered
+    since its last poll into profiler_stacks and profiler_requests, tagged with
+    its pid. While inactive the only per-request cost is reading `active`. When
+    active, each sample costs one sys._current_frames() call, and the sampler
+    stops by itself once the session's duration is over.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = False
+        self.session_id = None
+        self.endpoint = None
+        self.percent = 100.0
+        self.interval = 0.01
+        self.until = 0.0
+        self._stacks = Counter()     # (session_id, stack) -> samples not yet flushed
+        self._requests = []          # (session_id, record) not yet flushed
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._pid = None
+
+    def ensure_sync(self):
+        """Start this process's sync thread; a forked worker doesn't inherit its parent's"""
+        if self._pid == os.getpid() or not self.app.config['PROFILER_POLL_SECONDS']:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.active = False
+            threading.Thread(target=self._sync_forever, name='wnk-profiler-sync', daemon=True).start()
+
+    def _sync_forever(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.sync()
+            except DatabaseError as e:
+                self.app.logger.warning('Profiler sync failed: %s', e)
+            time.sleep(self.app.config['PROFILER_POLL_SECONDS'])
+
+    def sync(self):
+        """Follow the shared session, then flush what this process has sampled"""
+        session = current_session()
+        if session is None or not session['running']:
+            self.active = False
+        elif session['session_id'] != self.session_id or not self.active:
+            self._start(session)
+        self.flush()
+
+    def _start(self, session):
+        with self._lock:
+            self.session_id = session['session_id']
+            self.endpoint = session['endpoint']
+            self.percent = session['percent']
+            self.interval = session['interval_ms'] / 1000
+            self.until = time.monotonic() + session['remaining']
+            self.active = True
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, name='wnk-profiler', daemon=True)
+                self._sampler.start()
+
+    def flush(self):
+        with self._lock:
+            stacks, self._stacks = self._stacks, Counter()
+            requests, self._requests = self._requests, []
+        if not stacks and not requests:
+            return
+        pid = os.getpid()
+        db = get_db()
+        cursor = db.cursor()
+        if stacks:
+            cursor.executemany('''
+                INSERT INTO profiler_stacks (session_id, pid, stack_hash, stack, samples)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE samples = samples + VALUES(samples)
+            ''', [(session_id, pid, hashlib.sha1(stack.encode()).hexdigest(), stack, count)
+                  for (session_id, stack), count in stacks.items()])
+        if requests:
+            cursor.executemany('''
+                INSERT INTO profiler_requests (session_id, pid, record) VALUES (%s, %s, %s)
+            ''', [(session_id, pid, json.dumps(record)) for session_id, record in requests])
+        db.commit()
+        cursor.close()
+
+    def should_profile(self, endpoint):
+        if self.endpoint is not None and endpoint != self.endpoint:
+            return False
+        return random.random() * 100 < self.percent
+
+    def begin(self):
+        with self._lock:
+            self._threads[threading.get_ident()] = True
+        return self.session_id
+
+    def end(self, session_id, record):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+            self._requests.append((session_id, record))
+
+    def _run(self):
+        own = threading.get_ident()
+        while self.active:
+            if time.monotonic() >= self.until:
+                self.active = False
+                break
+            with self._lock:
+                thread_ids = [tid for tid in self._threads if tid != own]
+            if thread_ids:
+                frames = sys._current_frames()
+                with self._lock:
+                    for tid in thread_ids:
+                        frame = frames.get(tid)
+                        if frame is not None:
+                            self._stacks[self.session_id, _collapse(frame)] += 1
+                del frames
+            time.sleep(self.interval)
+
+
+def _before_request():
+    profiler = current_app.extensions['profiler']
+    profiler.ensure_sync()
+    if not profiler.active:
+        return
+    if request.blueprint == 'admin' and request.endpoint.startswith('admin.profiler'):
+        return
+    if profiler.should_profile(request.endpoint):
+        # get_db records this request's statements and timings into g.query_log
+        g.query_log = QueryLog()
+        g.profile_started = time.perf_counter()
+        g.profile_session = profiler.begin()
+
+
+def _teardown_request(exc):
+    started = g.pop('profile_started', None)
+    if started is None:
+        return
+    log = g.pop('query_log')
+    current_app.extensions['profiler'].end(g.pop('profile_session'), {
+        'endpoint': request.endpoint,
+        'path': request.full_path.rstrip('?'),
+        'pid': os.getpid(),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        'sql_ms': round(log.total_time() * 1000, 2),
+        'queries': [{'sql': r.normalized, 'ms': round(r.duration * 1000, 3)} for r in log],
+    })
+
+
+def init_profiler(app):
+    app.extensions['profiler'] = SamplingProfiler(app)
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,319 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models.change_feed import read_events, head_seq, PLATE_CREATED, PLATE_STOCK_CHANGED, PLATE_UPDATED
+from models.database import shard_targets
+from models.geo import bounding_box, covering_cells, distance_km, geohash
+from models.sharding import scatter, fetch_by_id
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Field weights: a match in the title outranks one in the restaurant name or description
+FIELD_WEIGHTS = (('title', 3), ('restaurant_name', 2), ('description', 1))
+
+PRICE_BUCKETS = (
+    ('under-5', 'Under $5', None, 5),
+    ('5-10', '$5 - $10', 5, 10),
+    ('10-20', '$10 - $20', 10, 20),
+    ('20-up', '$20 and up', 20, None),
+)
+
+# Minutes until pickup closes
+ENDING_WINDOWS = (30, 60, 180)
+
+# Kilometres from the customer, for "near me" searches
+RADII_KM = (2, 5, 10, 25)
+
+PLATE_EVENTS = (PLATE_CREATED, PLATE_STOCK_CHANGED, PLATE_UPDATED)
+
+_INDEX_COLUMNS = '''
+    SELECT p.plate_id, p.restaurant_id, p.title, p.description, p.price, p.quantity_available,
+           p.start_time, p.end_time, p.is_active, u.name as restaurant_name,
+           loc.latitude, loc.longitude
+    FROM plates p
+    JOIN users u ON u.user_id = p.restaurant_id
+    LEFT JOIN restaurant_locations loc ON loc.restaurant_id = p.restaurant_id
+'''
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+class SearchResults:
+    def __init__(self, plates, total, page, pages, facets):
+        self.plates = plates
+        self.total = total
+        self.page = page
+        self.pages = pages
+        self.facets = facets
+
+
+class PlateIndex:
+    """In-process inverted index over plates that are, or will be, on sale.
+
+    Built from the database on first use, then kept current by replaying the
+    change feed of every shard: create_listing and every stock change record a
+    plate event, and the plate row is re-read when one arrives. Plates whose
+    restaurant has coordinates are also kept in geohash order for radius
+    queries. Each worker process holds its own copy; it trails the database
+    by about FEED_SETTLE_SECONDS.
+    """
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self.docs = {}
+        self._postings = defaultdict(dict)   # term -> {plate_id: weight}
+        self._doc_terms = {}                 # plate_id -> terms it is posted under
+        self._vocabulary = []                # sorted terms, for prefix matching
+        self._geo = []                       # sorted (geohash, plate_id, lat, lng), for radius queries
+        self._offsets = None                 # shard -> last applied feed seq
+        self._refreshed_at = 0
+        self._lock = threading.RLock()
+
+    # --- Maintenance --------------------------------------------------------
+
+    def _add(self, row):
+        plate_id = row['plate_id']
+        self._remove(plate_id)
+        doc = dict(row)
+        doc['price'] = float(doc['price'])
+        doc['geohash'] = None
+        if doc['latitude'] is not None:
+            doc['geohash'] = geohash(doc['latitude'], doc['longitude'])
+            insort(self._geo, (doc['geohash'], plate_id, doc['latitude'], doc['longitude']))
+        self.docs[plate_id] = doc
+
+        weights = Counter()
+        for field, weight in FIELD_WEIGHTS:
+            for term in tokenize(doc[field]):
+                weights[term] += weight
+        for term, weight in weights.items():
+            postings = self._postings[term]
+            if not postings:
+                insort(self._vocabulary, term)
+            # Damped so a word repeated in the description can't outrank the title
+            postings[plate_id] = 1 + math.log(weight)
+        self._doc_terms[plate_id] = tuple(weights)
+
+    def _remove(self, plate_id):
+        doc = self.docs.pop(plate_id, None)
+        if doc is None:
+            return
+        if doc['geohash'] is not None:
+            self._geo.pop(bisect_left(self._geo, (doc['geohash'], plate_id)))
+        for term in self._doc_terms.pop(plate_id):
+            postings = self._postings[term]
+            postings.pop(plate_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary.pop(bisect_left(self._vocabulary, term))
+
+    def _apply(self, rows, plate_ids, now):
+        found = {row['plate_id']: row for row in rows}
+        for plate_id in plate_ids:
+            row = found.get(plate_id)
+            if row and row['is_active'] and row['quantity_available'] > 0 and row['end_time'] > now:
+                self._add(row)
+            else:
+                self._remove(plate_id)
+
+    def _load(self):
+        # Take the feed position first so nothing that changes during the load is missed
+        offsets = {shard: head_seq(shard) for shard in shard_targets()}
+        rows = scatter(_INDEX_COLUMNS + '''
+            WHERE p.is_active = 1 AND p.quantity_available > 0 AND p.end_time > NOW()
+        ''')
+        self.docs.clear()
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._vocabulary.clear()
+        self._geo.clear()
+        for row in rows:
+            self._add(row)
+        self._offsets = offsets
+
+    def refresh(self, force=False):
+        """Apply plate events since the last refresh; at most once per refresh_seconds"""
+        if (self._offsets is not None and not force
+                and time.monotonic() - self._refreshed_at < self.refresh_seconds):
+            return
+        with self._lock:
+            if self._offsets is None:
+                self._load()
+            now = datetime.now()
+            for shard in shard_targets():
+                while True:
+                    events = read_events(self._offsets[shard], shard=shard)
+                    if not events:
+                        break
+                    plate_ids = list(dict.fromkeys(e['plate_id'] for e in events
+                                                   if e['event_type'] in PLATE_EVENTS))
+                    if plate_ids:
+                        self._apply(fetch_by_id(_INDEX_COLUMNS + '''
+                            WHERE p.plate_id IN ({ids})
+                        ''', plate_ids), plate_ids, now)
+                    self._offsets[shard] = events[-1]['seq']
+            # Listings past their pickup window never come back
+            for plate_id in [p for p, doc in self.docs.items() if doc['end_time'] <= now]:
+                self._remove(plate_id)
+            self._refreshed_at = time.monotonic()
+
+    # --- Queries ------------------------------------------------------------
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self._postings else []
+        vocabulary = self._vocabulary
+        position = bisect_left(vocabulary, term)
+        terms = []
+        while position < len(vocabulary) and vocabulary[position].startswith(term):
+            terms.append(vocabulary[position])
+            position += 1
+        return terms
+
+    def _near(self, latitude, longitude, radius_km):
+        """{plate_id: km} for located plates within radius_km, from a few geohash range scans"""
+        lat_span, lng_span = bounding_box(latitude, longitude, radius_km)
+        found = {}
+        geo = self._geo
+        for cell in covering_cells(latitude, longitude, radius_km):
+            position = bisect_left(geo, (cell,))
+            while position < len(geo) and geo[position][0].startswith(cell):
+                _, plate_id, lat, lng = geo[position]
+                position += 1
+                # Cells overhang the circle; a box test is much cheaper than the distance
+                if abs(lat - latitude) > lat_span or abs((lng - longitude + 180) % 360 - 180) > lng_span:
+                    continue
+                distance = distance_km(latitude, longitude, lat, lng)
+                if distance <= radius_km:
+                    found[plate_id] = distance
+        return found
+
+    def _match(self, query, candidates=None):
+        """{plate_id: score} for docs containing every query term (the last one as a prefix).
+
+        candidates, when given, limits the result to those plate ids.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return {plate_id: 0.0 for plate_id in (self.docs if candidates is None else candidates)}
+        total = len(self.docs) or 1
+        scores = None
+        for position, term in enumerate(terms):
+            term_scores = {}
+            for expanded in self._expand(term, prefix=position == len(terms) - 1):
+                postings = self._postings[expanded]
+                idf = math.log(1 + total / len(postings))
+                for plate_id, weight in postings.items():
+                    score = weight * idf
+                    if score > term_scores.get(plate_id, 0):
+                        term_scores[plate_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {plate_id: score + term_scores[plate_id]
+                          for plate_id, score in scores.items() if plate_id in term_scores}
+            if not scores:
+                break
+        if candidates is not None:
+            scores = {plate_id: score for plate_id, score in scores.items() if plate_id in candidates}
+        return scores
+
+    def search(self, query='', min_price=None, max_price=None, ending_within=None, restaurant_id=None,
+               near=None, radius_km=None, page=1, per_page=24, now=None):
+        """Ranked, paginated plates on sale now, with facet counts.
+
+        Each facet counts matches under every other active filter, so picking a
+        restaurant still shows how many plates the other restaurants have. With
+        near=(lat, lng), only located plates within radius_km are returned,
+        nearest first, and each carries its distance_km.
+        """
+        self.refresh()
+        now = now or datetime.now()
+        ending_cutoff = now + timedelta(minutes=ending_within) if ending_within else None
+
+        with self._lock:
+            distances = None
+            if near is not None:
+                radius_km = radius_km or max(RADII_KM)
+                # The widest radius, so the distance facet can count every choice
+                distances = self._near(near[0], near[1], max(RADII_KM + (radius_km,)))
+            matches = self._match(query, distances)
+            hits = []
+            restaurants = Counter()
+            restaurant_names = {}
+            prices = Counter()
+            endings = Counter()
+            radii = Counter()
+            for plate_id, score in matches.items():
+                doc = self.docs[plate_id]
+                if not doc['start_time'] <= now < doc['end_time']:
+                    continue
+                price_ok = ((min_price is None or doc['price'] >= min_price) and
+                            (max_price is None or doc['price'] < max_price))
+                ending_ok = ending_cutoff is None or doc['end_time'] <= ending_cutoff
+                restaurant_ok = restaurant_id is None or doc['restaurant_id'] == restaurant_id
+                distance = distances[plate_id] if distances is not None else None
+                distance_ok = distance is None or distance <= radius_km
+
+                if price_ok and ending_ok and distance_ok:
+                    restaurants[doc['restaurant_id']] += 1
+                    restaurant_names[doc['restaurant_id']] = doc['restaurant_name']
+                if ending_ok and restaurant_ok and distance_ok:
+                    for key, _, low, high in PRICE_BUCKETS:
+                        if (low is None or doc['price'] >= low) and (high is None or doc['price'] < high):
+                            prices[key] += 1
+                if price_ok and restaurant_ok and distance_ok:
+                    minutes_left = (doc['end_time'] - now).total_seconds() / 60
+                    for window in ENDING_WINDOWS:
+                        if minutes_left <= window:
+                            endings[window] += 1
+                if distance is not None and price_ok and ending_ok and restaurant_ok:
+                    for radius in RADII_KM:
+                        if distance <= radius:
+                            radii[radius] += 1
+                if price_ok and ending_ok and restaurant_ok and distance_ok:
+                    # Nearest first when searching near a position, otherwise best match first
+                    hits.append((distance or 0, -score, doc['end_time'], plate_id))
+
+            hits.sort()
+            pages = max(1, math.ceil(len(hits) / per_page))
+            page = min(max(1, page), pages)
+            plates = []
+            for distance, _, _, plate_id in hits[(page - 1) * per_page:page * per_page]:
+                plate = dict(self.docs[plate_id])
+                plate['distance_km'] = distance if near is not None else None
+                plates.append(plate)
+
+        facets = {
+            'restaurants': [(rid, restaurant_names[rid], count) for rid, count in restaurants.most_common(10)],
+            'prices': [(key, label, prices[key]) for key, label, _, _ in PRICE_BUCKETS],
+            'ending': [(window, endings[window]) for window in ENDING_WINDOWS],
+            'distance': [(radius, radii[radius]) for radius in RADII_KM] if near is not None else [],
+        }
+        return SearchResults(plates, len(hits), page, pages, facets)
+
+
+def price_range(bucket):
+    """(min_price, max_price) for a PRICE_BUCKETS key; unknown keys mean no filter"""
+    for key, _, low, high in PRICE_BUCKETS:
+        if key == bucket:
+            return low, high
+    return None, None
+
+
+def search_plates(**filters):
+    return current_app.extensions['plate_index'].search(per_page=current_app.config['SEARCH_PAGE_SIZE'],
+                                                         **filters)
+
+
+def init_search(app):
+    app.extensions['plate_index'] = PlateIndex(app.config['SEARCH_REFRESH_SECONDS'])
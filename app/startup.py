@@ -0,0 +1,199 @@
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import click
+from flask import current_app, jsonify
+from flask.cli import with_appcontext
+
+# Imported as early as the app package itself, so this approximates process boot
+BOOT_STARTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+RETRY_SECONDS = 2
+
+
+class StartupState:
+    """What a worker has warmed so far; /readyz reports it"""
+
+    def __init__(self):
+        self.ready = False
+        self.ready_after_ms = None
+        self.steps = {}
+        self.error = None
+
+
+def precompile_templates(app):
+    """Compile every template (or load it from the bytecode cache) ahead of the first request.
+
+    Safe to call in the gunicorn master: compiled templates are inherited by
+    forked workers.
+    """
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+
+def _open_connections(app):
+    from models.database import get_db, shard_targets
+    # Creating the MySQL pool opens all DB_POOL_SIZE connections; on SQLite this
+    # opens the file and applies the pragmas
+    get_db()
+    for shard in shard_targets():
+        get_db(shard=shard)
+
+
+def _prime_plate_cards(app):
+    from app.blueprints.customer import open_donations
+    from app.fragments import plate_card
+    from app.search import search_plates
+
+    # The marketplace renders search index docs, so the cache keys must come from them too
+    plates = []
+    page, pages = 1, 1
+    while page <= pages:
+        results = search_plates(page=page)
+        plates.extend(results.plates)
+        page, pages = page + 1, results.pages
+    donations = open_donations()
+
+    # Same templates, variants and slot names the marketplace and free-plates pages use
+    with app.test_request_context('/'):
+        for plate in plates:
+            for variant in ('customer', 'donner'):
+                plate_card('customer/_marketplace_card.html', plate, variant=variant,
+                           quantity=0, distance='')
+        for plate in donations:
+            plate_card('customer/_free_plate_card.html', plate,
+                       variant=app.config['FREE_PLATE_ALLOCATION'],
+                       quantity=0, max_qty=0, disabled='')
+
+
+def _build_search_index(app):
+    app.extensions['plate_index'].refresh(force=True)
+
+
+WARM_UP_STEPS = (
+    ('templates', precompile_templates),
+    ('connections', _open_connections),
+    ('search_index', _build_search_index),
+    ('plate_cards', _prime_plate_cards),
+)
+
+
+def warm_up(app):
+    """Run every warm-up step once in this process, then mark the worker ready"""
+    state = app.extensions['startup']
+    with app.app_context():
+        for name, step in WARM_UP_STEPS:
+            if name in state.steps:
+                continue
+            started = time.perf_counter()
+            step(app)
+            state.steps[name] = round((time.perf_counter() - started) * 1000, 1)
+    state.ready_after_ms = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+    state.error = None
+    state.ready = True
+
+
+def _warm_up_until_ready(app):
+    while True:
+        try:
+            warm_up(app)
+            return
+        except Exception as e:
+            # Typically the database is not reachable yet; stay unready and retry
+            app.extensions['startup'].error = str(e)
+            logger.warning('Warm-up failed, retrying in %ss: %s', RETRY_SECONDS, e)
+            time.sleep(RETRY_SECONDS)
+
+
+def start_warm_up(app):
+    """Warm up on a background thread so the worker can answer /healthz meanwhile"""
+    if not app.config['WARM_UP']:
+        app.extensions['startup'].ready = True
+        return None
+    thread = threading.Thread(target=_warm_up_until_ready, args=(app,), name='wnk-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def healthz():
+    return jsonify(status='ok')
+
+
+def readyz():
+    state = current_app.extensions['startup']
+    body = {
+        'ready': state.ready,
+        'ready_after_ms': state.ready_after_ms,
+        'steps_ms': state.steps,
+    }
+    if state.error:
+        body['error'] = state.error
+    return jsonify(body), 200 if state.ready else 503
+
+
+def init_startup(app):
+    app.extensions['startup'] = StartupState()
+    # Liveness answers as soon as the process serves; readiness waits for warm-up
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
+
+
+def _bench_child(warm, started):
+    """Boot one app in this fresh process and time each phase up to the first real request.
+
+    `started` is taken before the app package is imported, so import_ms covers it.
+    """
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    if warm:
+        warm_up(app)
+    warmed = time.perf_counter()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 0
+        sess['user_type'] = 'customer'
+    response = client.get('/marketplace')
+    first = time.perf_counter()
+    response = client.get('/marketplace')
+    second = time.perf_counter()
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'warm_up_ms': (warmed - created) * 1000,
+        'first_request_ms': (first - warmed) * 1000,
+        'second_request_ms': (second - first) * 1000,
+        'boot_to_first_response_ms': (first - started) * 1000,
+        'status': response.status_code,
+    }))
+
+
+@click.command('bench-startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh processes to boot per mode.')
+@with_appcontext
+def bench_startup_command(runs):
+    """Time boot to first marketplace response, with and without warm-up"""
+    for warm in (False, True):
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', 'import time; started = time.perf_counter(); '
+                 f'from app.startup import _bench_child; _bench_child({warm}, started)'],
+                check=True, capture_output=True, text=True
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+        click.echo(f"{'warm' if warm else 'cold'} boot (median of {runs}):")
+        for metric in ('import_ms', 'create_app_ms', 'warm_up_ms', 'first_request_ms',
+                       'second_request_ms', 'boot_to_first_response_ms'):
+            click.echo(f'  {metric:<28}{statistics.median(s[metric] for s in samples):9.1f}')
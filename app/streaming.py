@@ -0,0 +1,49 @@
+import zlib
+
+from flask import Response, current_app, render_template, request, stream_template
+
+
+def _chunked(parts, min_bytes, compressor=None):
+    """Coalesce Jinja's many tiny fragments into network-sized chunks, compressing each one"""
+    buffer = []
+    size = 0
+    for part in parts:
+        data = part.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= min_bytes:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            if compressor is not None:
+                # Sync flush lets the browser decode and paint what has arrived so far
+                chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if chunk:
+                yield chunk
+
+    tail = b''.join(buffer)
+    if compressor is not None:
+        tail = compressor.compress(tail) + compressor.flush(zlib.Z_FINISH)
+    if tail:
+        yield tail
+
+
+def stream_page(template_name, **context):
+    """Render a long page as it is generated instead of after the whole result is read.
+
+    Pair with models.database.stream_query so rows go straight from the cursor into
+    the response. Falls back to render_template when STREAM_PAGES is off.
+    """
+    if not current_app.config['STREAM_PAGES']:
+        return render_template(template_name, **context)
+
+    compressor = None
+    if request.accept_encodings['gzip']:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    body = _chunked(stream_template(template_name, **context),
+                    current_app.config['STREAM_CHUNK_BYTES'], compressor)
+    response = Response(body, mimetype='text/html')
+    if compressor is not None:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,14 @@
+"""Browse server entry point: uvicorn asgi:app --workers 4 --port 8001
+
+Serves only the read-only browse pages (see app/browse.py); the proxy sends
+GET /marketplace, /free-plates, /order-history and /api/* here and
+everything else to the gunicorn WSGI app.
+"""
+from app import create_app
+from app.browse import BrowseApp
+from app.startup import precompile_templates
+
+flask_app = create_app()
+precompile_templates(flask_app)
+
+app = BrowseApp(flask_app)
@@ -6,9 +6,91 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-this'
     
+    # 'mysql' (default) or 'sqlite' for single-box deployments
+    DB_BACKEND = os.environ.get('DB_BACKEND') or 'mysql'
+    SQLITE_PATH = os.environ.get('SQLITE_PATH') or os.path.join('instance', 'wnk.sqlite3')
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5)
+    
+    # Region shards as name=database pairs, e.g. "west=wnk_west,east=wnk_east"
+    # (MySQL: database on MYSQL_HOST or host:port/database; SQLite: file path).
+    # Unset keeps everything on the home database.
+    DB_SHARDS = os.environ.get('DB_SHARDS') or ''
+    # How long a worker trusts its cached shard_map entry for a restaurant, so a
+    # `flask shards assign` reaches running workers without a restart
+    SHARD_MAP_CACHE_SECONDS = float(os.environ.get('SHARD_MAP_CACHE_SECONDS') or 60)
+    
     # MySQL Configuration
     MYSQL_HOST = os.environ.get('MYSQL_HOST') or 'localhost'
     MYSQL_USER = os.environ.get('MYSQL_USER') or 'root'
     MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD') or 'root'
     MYSQL_DB = os.environ.get('MYSQL_DB') or 'wnk_db'
-    MYSQL_PORT = int(os.environ.get('MYSQL_PORT') or 3306)
\ No newline at end of file
+    MYSQL_PORT = int(os.environ.get('MYSQL_PORT') or 3306)
+    
+    # Each worker process holds its own pool; one connection per serving thread
+    # (WEB_THREADS, see gunicorn.conf.py) means a request never waits for another
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or os.environ.get('WEB_THREADS') or 4)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 5)
+    
+    # Long pages (order history, dashboards, admin reports) are streamed to the
+    # browser in gzip chunks while rows are read from an unbuffered cursor
+    STREAM_PAGES = (os.environ.get('STREAM_PAGES') or '1') == '1'
+    STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS') or 500)
+    STREAM_CHUNK_BYTES = int(os.environ.get('STREAM_CHUNK_BYTES') or 16384)
+    
+    # Admission control for checkout and claim routes (per worker process):
+    # requests allowed to work on one plate at once, how many may queue behind
+    # them, and how long a queued request waits before being turned away
+    ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT') or 2)
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE') or 16)
+    ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS') or 3)
+    
+    # 'instant' lets needy users claim donated plates directly; 'batch' collects
+    # requests and hands plates out fairly every ALLOCATION_INTERVAL_SECONDS
+    FREE_PLATE_ALLOCATION = os.environ.get('FREE_PLATE_ALLOCATION') or 'instant'
+    ALLOCATION_INTERVAL_SECONDS = float(os.environ.get('ALLOCATION_INTERVAL_SECONDS') or 5)
+    
+    # Change feed readers hold back events younger than FEED_SETTLE_SECONDS so a
+    # slow-committing lower seq is never skipped; compaction keeps FEED_RETAIN_DAYS
+    FEED_SETTLE_SECONDS = float(os.environ.get('FEED_SETTLE_SECONDS') or 2)
+    FEED_RETAIN_DAYS = int(os.environ.get('FEED_RETAIN_DAYS') or 7)
+    
+    # Finished reservations and transactions older than this move to the archive tables
+    ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS') or 90)
+    ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE') or 5000)
+    
+    # Duplicate checkout/claim submissions wait this long for the original, then
+    # replay its result; keys are kept for IDEMPOTENCY_TTL_HOURS
+    IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS') or 10)
+    IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS') or 24)
+    
+    # Rendered plate-card cache per worker; Jinja bytecode cache defaults to instance/jinja-cache
+    FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES') or 8 * 1024 * 1024)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    
+    # Marketplace search: results per page, and how often a worker's in-memory
+    # index polls the change feed for new listings and stock changes
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE') or 24)
+    SEARCH_REFRESH_SECONDS = float(os.environ.get('SEARCH_REFRESH_SECONDS') or 1)
+    
+    # "Near me" marketplace: search radius (km) when the customer hasn't picked one
+    GEO_DEFAULT_RADIUS_KM = int(os.environ.get('GEO_DEFAULT_RADIUS_KM') or 10)
+    
+    # Asyncio browse server (asgi.py): threads running requests per process, sized
+    # like DB_POOL_SIZE, and how many requests may wait for one before getting a 503
+    BROWSE_THREADS = int(os.environ.get('BROWSE_THREADS') or os.environ.get('DB_POOL_SIZE') or 4)
+    BROWSE_MAX_QUEUE = int(os.environ.get('BROWSE_MAX_QUEUE') or 1000)
+    
+    # How often every worker process picks up profiler start/stop from the database
+    # and flushes its samples there; 0 turns the profiler off
+    PROFILER_POLL_SECONDS = float(os.environ.get('PROFILER_POLL_SECONDS') or 2)
+    
+    # Open connections, compile templates and prime caches before /readyz reports ready
+    WARM_UP = (os.environ.get('WARM_UP') or '1') == '1'
+    
+    # Background job queue (`flask worker`)
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS') or 4)
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL') or 1)
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS') or 5)
+    JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS') or 5)
+    # RUNNING jobs locked longer than this are assumed orphaned by a dead worker
+    JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('JOB_LOCK_TIMEOUT_SECONDS') or 300)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+
+from app.startup import start_warm_up
+from models.database import reset_pool
+
+bind = os.environ.get('WEB_BIND') or '0.0.0.0:8000'
+
+# One process per core, each with a small thread pool for requests blocked on MySQL.
+# Config.DB_POOL_SIZE defaults to WEB_THREADS so every thread can hold a connection.
+workers = int(os.environ.get('WEB_WORKERS') or multiprocessing.cpu_count())
+threads = int(os.environ.get('WEB_THREADS') or 4)
+worker_class = 'gthread'
+
+# Load the app once in the master and fork it; no connections exist yet at that point
+preload_app = True
+
+# On SIGTERM/SIGHUP workers stop accepting and finish in-flight requests
+# (checkouts included) for up to graceful_timeout seconds before exiting
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT') or 30)
+timeout = int(os.environ.get('WEB_TIMEOUT') or 60)
+keepalive = 5
+
+# Recycle workers periodically, staggered so they don't all restart at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS') or 5000)
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    # Make sure the child never touches a pool object created before the fork
+    app = worker.app.wsgi()
+    reset_pool(app)
+    # Open this worker's connections and prime its caches; /readyz flips when done
+    start_warm_up(app)
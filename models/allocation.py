@@ -0,0 +1,211 @@
+import secrets
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models.database import get_db
+from models.change_feed import record_events, RESERVATION_CLAIMED, RESERVATION_UPDATED
+from models.jobs import job
+from models.read_models import sync_reservations
+
+# Same daily cap the instant claim routes enforce
+DAILY_LIMIT = 2
+
+
+def claimed_today(cursor, user_ids):
+    """Return {user_id: plates claimed since midnight on the database clock}"""
+    if not user_ids:
+        return {}
+    placeholders = ','.join(['%s'] * len(user_ids))
+    cursor.execute(f'''
+        SELECT user_id, COALESCE(SUM(qty), 0) FROM reservations
+        WHERE user_id IN ({placeholders}) AND status IN ('CLAIMED', 'PICKED_UP')
+          AND claimed_at >= CURDATE()
+        GROUP BY user_id
+    ''', user_ids)
+    return {user_id: int(total) for user_id, total in cursor.fetchall()}
+
+
+def allocate(requests, inventory, claimed):
+    """Fairly match pending requests against donated inventory.
+
+    requests  -- [(request_id, user_id, qty_outstanding)] oldest first
+    inventory -- [(reservation_id, qty)] in the order it should be handed out
+    claimed   -- {user_id: plates already claimed today}
+
+    Users are served one plate per round, those with the fewest plates today and
+    the oldest request first, so nobody takes a second plate while someone else
+    with an open request has none. Returns [(user_id, reservation_id, qty)].
+    """
+    demand = defaultdict(int)
+    first_seen = {}
+    for position, (_, user_id, qty) in enumerate(requests):
+        demand[user_id] += qty
+        first_seen.setdefault(user_id, position)
+
+    for user_id in demand:
+        demand[user_id] = min(demand[user_id], max(0, DAILY_LIMIT - claimed.get(user_id, 0)))
+
+    order = sorted((u for u in demand if demand[u] > 0),
+                   key=lambda u: (claimed.get(u, 0), first_seen[u]))
+    queue = deque(order)
+    stock = deque([reservation_id, qty] for reservation_id, qty in inventory if qty > 0)
+
+    grants = defaultdict(int)
+    while queue and stock:
+        user_id = queue.popleft()
+        entry = stock[0]
+        grants[(user_id, entry[0])] += 1
+        entry[1] -= 1
+        if entry[1] == 0:
+            stock.popleft()
+        demand[user_id] -= 1
+        if demand[user_id] > 0:
+            queue.append(user_id)
+
+    return [(user_id, reservation_id, qty) for (user_id, reservation_id), qty in grants.items()]
+
+
+def run_allocation_batch(now=None):
+    """Allocate donated plates to every pending request in a single transaction.
+
+    Returns the number of plates allocated.
+    """
+    now = now or datetime.now()
+    db = get_db()
+    cursor = db.cursor()
+
+    try:
+        # Requests are good for the day they were made. created_at is stamped by the
+        # database, so "today" comes from its clock too
+        cursor.execute('''
+            UPDATE claim_requests SET status = 'EXPIRED', processed_at = NOW()
+            WHERE status = 'PENDING' AND created_at < CURDATE()
+        ''')
+
+        cursor.execute('''
+            SELECT request_id, user_id, qty - qty_allocated FROM claim_requests
+            WHERE status = 'PENDING'
+            ORDER BY created_at ASC, request_id ASC
+            FOR UPDATE
+        ''')
+        requests = cursor.fetchall()
+        if not requests:
+            db.commit()
+            return 0
+
+        claimed = claimed_today(cursor, sorted({user_id for _, user_id, _ in requests}))
+
+        # Donations whose pickup window is open, soonest to close first
+        cursor.execute('''
+            SELECT r.reservation_id, r.qty, r.donor_id, r.plate_id
+            FROM reservations r
+            JOIN plates p ON p.plate_id = r.plate_id
+            WHERE r.status = 'DONATED'
+              AND %s BETWEEN p.start_time AND p.end_time
+            ORDER BY p.end_time ASC, r.created_at ASC
+            FOR UPDATE
+        ''', (now,))
+        donated = {row[0]: row for row in cursor.fetchall()}
+
+        grants = allocate(requests, [(rid, row[1]) for rid, row in donated.items()], claimed)
+        if not grants:
+            db.commit()
+            return 0
+
+        by_reservation = defaultdict(list)
+        for user_id, reservation_id, qty in grants:
+            by_reservation[reservation_id].append((user_id, qty))
+
+        inserts = []
+        takeovers = []
+        reductions = []
+        events = []
+        for reservation_id, shares in by_reservation.items():
+            _, available, donor_id, plate_id = donated[reservation_id]
+            if sum(qty for _, qty in shares) == available:
+                # Last grantee takes over the donated row instead of leaving a zero-qty row
+                user_id, qty = shares.pop()
+                takeovers.append((user_id, qty, f"{secrets.randbelow(10**8):08d}", now, now, reservation_id))
+                events.append((RESERVATION_CLAIMED, plate_id, reservation_id))
+            else:
+                reductions.append((sum(qty for _, qty in shares), reservation_id))
+                events.append((RESERVATION_UPDATED, plate_id, reservation_id))
+            for user_id, qty in shares:
+                inserts.append((user_id, donor_id, plate_id, qty, f"{secrets.randbelow(10**8):08d}", now, now))
+                # Rows from the multi-row insert are reported per plate
+                events.append((RESERVATION_CLAIMED, plate_id, None))
+
+        if takeovers:
+            cursor.executemany('''
+                UPDATE reservations
+                SET user_id = %s, qty = %s, status = 'CLAIMED', pickup_code = %s,
+                    claimed_at = %s, confirmed_at = %s
+                WHERE reservation_id = %s
+            ''', takeovers)
+        if reductions:
+            cursor.executemany('''
+                UPDATE reservations SET qty = qty - %s WHERE reservation_id = %s
+            ''', reductions)
+        if inserts:
+            cursor.executemany('''
+                INSERT INTO reservations (user_id, donor_id, plate_id, qty, status, pickup_code, claimed_at, confirmed_at)
+                VALUES (%s, %s, %s, %s, 'CLAIMED', %s, %s, %s)
+            ''', inserts)
+        record_events(cursor, events)
+        # New rows came from a multi-row insert, so refresh the read models by plate
+        sync_reservations(cursor, plate_ids=[plate_id for _, plate_id, _ in events])
+
+        # Credit allocations to each user's requests, oldest first
+        granted = defaultdict(int)
+        for user_id, _, qty in grants:
+            granted[user_id] += qty
+        request_updates = []
+        for request_id, user_id, outstanding in requests:
+            credit = min(outstanding, granted[user_id])
+            if credit == 0:
+                continue
+            granted[user_id] -= credit
+            status = 'FILLED' if credit == outstanding else 'PENDING'
+            request_updates.append((credit, status, now, request_id))
+        cursor.executemany('''
+            UPDATE claim_requests
+            SET qty_allocated = qty_allocated + %s, status = %s, processed_at = %s
+            WHERE request_id = %s
+        ''', request_updates)
+
+        db.commit()
+        return sum(qty for _, _, qty in grants)
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@job('allocation.run')
+def _allocation_job(payload):
+    run_allocation_batch()
+
+
+@click.command('allocate')
+@click.option('--interval', type=float, default=None,
+              help='Seconds between batches; 0 runs a single batch.')
+@with_appcontext
+def allocate_command(interval):
+    """Run the donated-plate batch allocator"""
+    if interval is None:
+        interval = current_app.config['ALLOCATION_INTERVAL_SECONDS']
+
+    while True:
+        allocated = run_allocation_batch()
+        if allocated:
+            click.echo(f'{datetime.now():%H:%M:%S} allocated {allocated} plate(s)')
+        if not interval:
+            break
+        time.sleep(interval)
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models.database import get_db, shard_targets
+from models.jobs import job
+
+RESERVATION_COLUMNS = ('reservation_id, user_id, donor_id, plate_id, qty, status, pickup_code, '
+                       'created_at, confirmed_at, claimed_at')
+TRANSACTION_COLUMNS = 'transaction_id, payer_user_id, payee_restaurant_id, amount, type, created_at'
+
+# Reservations in these states never change again
+FINISHED_STATUSES = ('PICKED_UP', 'CLAIMED', 'CANCELLED')
+
+
+def _move_chunk(db, cursor, table, id_column, columns, where, params, chunk_size):
+    """Move up to chunk_size matching rows into <table>_archive in one short transaction"""
+    cursor.execute(f'''
+        SELECT {id_column} FROM {table}
+        WHERE {where}
+        ORDER BY {id_column}
+        LIMIT %s
+        FOR UPDATE
+    ''', (*params, chunk_size))
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        db.rollback()
+        return 0
+
+    placeholders = ','.join(['%s'] * len(ids))
+    cursor.execute(f'''
+        INSERT INTO {table}_archive ({columns})
+        SELECT {columns} FROM {table}
+        WHERE {id_column} IN ({placeholders})
+    ''', ids)
+    cursor.execute(f'DELETE FROM {table} WHERE {id_column} IN ({placeholders})', ids)
+    db.commit()
+    return len(ids)
+
+
+def archive_closed(horizon_days=None, chunk_size=None):
+    """Move finished reservations and old transactions out of the hot tables.
+
+    Works in chunks so row locks are held briefly and checkout keeps running while
+    a large backlog drains. Returns (reservations_moved, transactions_moved).
+    """
+    if horizon_days is None:
+        horizon_days = current_app.config['ARCHIVE_HORIZON_DAYS']
+    if chunk_size is None:
+        chunk_size = current_app.config['ARCHIVE_CHUNK_SIZE']
+    # Today's claims feed the daily free-plate limit and must stay in the hot table
+    horizon_days = max(1, horizon_days)
+    cutoff = datetime.now() - timedelta(days=horizon_days)
+
+    reservations_moved = transactions_moved = 0
+    for shard in shard_targets():
+        moved = _archive_shard(shard, cutoff, chunk_size)
+        reservations_moved += moved[0]
+        transactions_moved += moved[1]
+    return reservations_moved, transactions_moved
+
+
+def _archive_shard(shard, cutoff, chunk_size):
+    db = get_db(shard=shard)
+    cursor = db.cursor()
+
+    status_placeholders = ','.join(['%s'] * len(FINISHED_STATUSES))
+    reservations_where = (f'status IN ({status_placeholders}) '
+                          'AND COALESCE(claimed_at, confirmed_at, created_at) < %s')
+    reservations_moved = 0
+    while True:
+        moved = _move_chunk(db, cursor, 'reservations', 'reservation_id', RESERVATION_COLUMNS,
+                            reservations_where, (*FINISHED_STATUSES, cutoff), chunk_size)
+        reservations_moved += moved
+        if moved < chunk_size:
+            break
+
+    transactions_moved = 0
+    while True:
+        moved = _move_chunk(db, cursor, 'transactions', 'transaction_id', TRANSACTION_COLUMNS,
+                            'created_at < %s', (cutoff,), chunk_size)
+        transactions_moved += moved
+        if moved < chunk_size:
+            break
+
+    cursor.close()
+    return reservations_moved, transactions_moved
+
+
+@job('archive.closed')
+def _archive_job(payload):
+    archive_closed(payload.get('horizon_days'), payload.get('chunk_size'))
+
+
+@click.command('archive')
+@click.option('--horizon-days', type=int, default=None, help='Archive finished rows older than this many days.')
+@click.option('--chunk-size', type=int, default=None, help='Rows moved per transaction.')
+@with_appcontext
+def archive_command(horizon_days, chunk_size):
+    """Move finished reservations and old transactions to the archive tables"""
+    reservations_moved, transactions_moved = archive_closed(horizon_days, chunk_size)
+    click.echo(f'Archived {reservations_moved} reservations and {transactions_moved} transactions')
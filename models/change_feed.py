@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models.database import get_db, shard_targets
+from models.jobs import job
+
+PLATE_CREATED = 'plate.created'
+PLATE_STOCK_CHANGED = 'plate.stock_changed'
+# Something shown with the plate changed (e.g. the restaurant's location)
+PLATE_UPDATED = 'plate.updated'
+RESERVATION_CREATED = 'reservation.created'
+RESERVATION_UPDATED = 'reservation.updated'
+RESERVATION_CLAIMED = 'reservation.claimed'
+
+
+def record_events(cursor, events):
+    """Append (event_type, plate_id, reservation_id) tuples to the change feed.
+
+    Call with the same cursor, inside the same transaction, as the state change
+    so the feed and the tables it describes always commit together.
+    """
+    if events:
+        cursor.executemany('''
+            INSERT INTO change_feed (event_type, plate_id, reservation_id)
+            VALUES (%s, %s, %s)
+        ''', events)
+
+
+def read_events(after_seq, limit=500, shard=None):
+    """Return events with seq > after_seq on one shard, oldest first.
+
+    Each shard keeps its own feed and seq numbering; consumers track an offset
+    per shard.
+
+    AUTO_INCREMENT values are handed out at insert time, not commit time, so a
+    transaction can commit a lower seq after a higher one is already visible.
+    Events younger than FEED_SETTLE_SECONDS are held back so a tailing reader
+    does not step past a seq that is about to appear.
+    """
+    cursor = get_db(shard=shard).cursor(dictionary=True)
+    # The cutoff uses the database clock, the same one that stamped created_at
+    cursor.execute('''
+        SELECT seq, event_type, plate_id, reservation_id, created_at
+        FROM change_feed
+        WHERE seq > %s AND created_at <= DATE_SUB(NOW(), INTERVAL %s SECOND)
+        ORDER BY seq ASC
+        LIMIT %s
+    ''', (after_seq, current_app.config['FEED_SETTLE_SECONDS'], limit))
+    events = cursor.fetchall()
+    cursor.close()
+    return events
+
+
+def head_seq(shard=None):
+    """Offset a new in-memory reader can start from after loading current state.
+
+    Events that are still settling are left after it, so they are replayed
+    rather than skipped; replaying an event must therefore be harmless.
+    """
+    cursor = get_db(shard=shard).cursor()
+    cursor.execute('''
+        SELECT COALESCE(MAX(seq), 0) FROM change_feed
+        WHERE created_at <= DATE_SUB(NOW(), INTERVAL %s SECOND)
+    ''', (current_app.config['FEED_SETTLE_SECONDS'],))
+    seq = cursor.fetchone()[0]
+    cursor.close()
+    return seq
+
+
+def get_offset(consumer, shard=None):
+    cursor = get_db(shard=shard).cursor()
+    cursor.execute('SELECT last_seq FROM change_feed_offsets WHERE consumer = %s', (consumer,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else 0
+
+
+def set_offset(consumer, last_seq, shard=None):
+    db = get_db(shard=shard)
+    cursor = db.cursor()
+    cursor.execute('''
+        INSERT INTO change_feed_offsets (consumer, last_seq)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE last_seq = VALUES(last_seq)
+    ''', (consumer, last_seq))
+    db.commit()
+    cursor.close()
+
+
+def consume(consumer, handler, limit=500, shard=None):
+    """Deliver the next batch of events after the consumer's stored offset on a shard.
+
+    The offset only advances after handler(events) returns, so delivery is
+    at-least-once. Returns the number of events handled.
+    """
+    events = read_events(get_offset(consumer, shard), limit, shard)
+    if events:
+        handler(events)
+        set_offset(consumer, events[-1]['seq'], shard)
+    return len(events)
+
+
+def compact(retain_days=None, chunk_size=5000):
+    """Delete events older than retain_days that every registered consumer has passed, on every shard"""
+    if retain_days is None:
+        retain_days = current_app.config['FEED_RETAIN_DAYS']
+    cutoff = datetime.now() - timedelta(days=retain_days)
+    return sum(_compact_shard(shard, cutoff, chunk_size) for shard in shard_targets())
+
+
+def _compact_shard(shard, cutoff, chunk_size):
+    db = get_db(shard=shard)
+    cursor = db.cursor()
+    cursor.execute('SELECT MIN(seq), MAX(seq) FROM change_feed WHERE created_at < %s', (cutoff,))
+    low, high = cursor.fetchone()
+    cursor.execute('SELECT MIN(last_seq) FROM change_feed_offsets')
+    slowest = cursor.fetchone()[0]
+    if slowest is not None and high is not None:
+        high = min(high, slowest)
+
+    deleted = 0
+    if low is not None and high is not None:
+        # Walk the primary key in ranges so each delete is a short transaction
+        start = low - 1
+        while start < high:
+            end = min(start + chunk_size, high)
+            cursor.execute('DELETE FROM change_feed WHERE seq > %s AND seq <= %s', (start, end))
+            db.commit()
+            deleted += cursor.rowcount
+            start = end
+    cursor.close()
+    return deleted
+
+
+@job('feed.compact')
+def _compact_job(payload):
+    compact(payload.get('retain_days'))
+
+
+feed_cli = AppGroup('feed', help='Inventory and reservation change feed')
+
+
+@feed_cli.command('tail')
+@click.option('--consumer', default=None, help='Resume from (and advance) this consumer\'s offset.')
+@click.option('--after', type=int, default=0, help='Start after this seq when no consumer is given.')
+@click.option('--limit', type=int, default=100)
+@click.option('--shard', default=None, help='Shard whose feed to read (default: the first).')
+def tail_command(consumer, after, limit, shard):
+    """Print events from the feed"""
+    def show(events):
+        for event in events:
+            click.echo(f"{event['seq']}\t{event['created_at']}\t{event['event_type']}\t"
+                       f"plate={event['plate_id']}\treservation={event['reservation_id']}")
+
+    shard = shard or next(iter(shard_targets()))
+    if consumer:
+        consume(consumer, show, limit, shard)
+    else:
+        show(read_events(after, limit, shard))
+
+
+@feed_cli.command('compact')
+@click.option('--retain-days', type=int, default=None)
+def compact_command(retain_days):
+    """Delete old events that all consumers have processed"""
+    click.echo(f'Deleted {compact(retain_days)} events')
@@ -1,27 +1,243 @@
+import os
+import sqlite3
+import time
+from functools import lru_cache
+
+import click
 import mysql.connector
+from mysql.connector import errors, pooling
 from flask import current_app, g
+from flask.cli import with_appcontext
+from models.query_log import RecordingConnection, active_log
+from models import sqlite_backend
+
+# Catch this instead of a driver-specific error so routes work on either backend
+DatabaseError = (mysql.connector.Error, sqlite3.Error)
+
+# Bump whenever init_db's DDL changes so ensure_schema() re-runs it on next boot
+SCHEMA_VERSION = 6
+
+# Rows created on shard i get ids from i * SHARD_ID_SPAN + 1 up, so a plate or
+# reservation id alone names the shard that owns it
+SHARD_ID_SPAN = 100_000_000
+
+def home_target():
+    """Database holding global data: users, payments, shard map, jobs"""
+    config = current_app.config
+    return config['SQLITE_PATH'] if config['DB_BACKEND'] == 'sqlite' else config['MYSQL_DB']
+
+def shard_targets():
+    """Ordered {shard name: database} from DB_SHARDS.
+
+    Unsharded deployments have a single 'default' shard that is the home database.
+    For MySQL a target is a database name on MYSQL_HOST or host:port/database;
+    for SQLite it is a file path.
+    """
+    spec = current_app.config['DB_SHARDS']
+    if not spec:
+        return {'default': home_target()}
+    return _parse_shards(spec)
+
+@lru_cache(maxsize=8)
+def _parse_shards(spec):
+    targets = {}
+    for entry in spec.split(','):
+        name, _, target = entry.strip().partition('=')
+        targets[name.strip()] = target.strip()
+    return targets
+
+def is_sharded():
+    return bool(current_app.config['DB_SHARDS'])
+
+def shard_of_id(entity_id):
+    """Shard that created a plate, reservation or transaction id"""
+    names = list(shard_targets())
+    index = (int(entity_id) - 1) // SHARD_ID_SPAN
+    if not is_sharded() or index < 0:
+        return names[0]
+    if index >= len(names):
+        raise LookupError(f'id {entity_id} does not belong to any configured shard')
+    return names[index]
+
+def cache_shard(restaurant_id, shard):
+    """Remember a restaurant's shard in this process for SHARD_MAP_CACHE_SECONDS"""
+    expires = time.monotonic() + current_app.config['SHARD_MAP_CACHE_SECONDS']
+    current_app.extensions.setdefault('shard_map', {})[restaurant_id] = (shard, expires)
 
-def get_db():
-    """Create database connection"""
-    if 'db' not in g:
-        g.db = mysql.connector.connect(
-            host=current_app.config['MYSQL_HOST'],
-            user=current_app.config['MYSQL_USER'],
-            password=current_app.config['MYSQL_PASSWORD'],
-            database=current_app.config['MYSQL_DB'],
-            port=current_app.config['MYSQL_PORT']
+def shard_for_restaurant(restaurant_id):
+    """Shard that owns a restaurant's plates; restaurants missing from the map stay on the first shard"""
+    names = list(shard_targets())
+    if not is_sharded():
+        return names[0]
+    # Entries expire so a reassignment from another process is picked up
+    cached = current_app.extensions.setdefault('shard_map', {}).get(restaurant_id)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    cursor = get_db().cursor()
+    cursor.execute('SELECT shard FROM shard_map WHERE restaurant_id = %s', (restaurant_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        # Not assigned yet: look again next time rather than pinning the default
+        return names[0]
+    cache_shard(restaurant_id, row[0])
+    return row[0]
+
+def _mysql_params(target):
+    """Connection settings for a MySQL target: 'database' or 'host:port/database'"""
+    config = current_app.config
+    params = {
+        'host': config['MYSQL_HOST'],
+        'user': config['MYSQL_USER'],
+        'password': config['MYSQL_PASSWORD'],
+        'database': target,
+        'port': config['MYSQL_PORT'],
+    }
+    if '/' in target:
+        address, params['database'] = target.split('/', 1)
+        host, _, port = address.partition(':')
+        params['host'] = host
+        if port:
+            params['port'] = int(port)
+    return params
+
+def _get_pool(target):
+    """Return this process's connection pool for a database, creating it on first use.
+
+    Pools are keyed by PID so a pre-forked worker never reuses sockets opened by
+    its parent; each worker lazily opens its own connections after fork.
+    """
+    pid = os.getpid()
+    entry = current_app.extensions.get('db_pools')
+    if entry is None or entry[0] != pid:
+        entry = current_app.extensions['db_pools'] = (pid, {})
+    pools = entry[1]
+    if target not in pools:
+        pools[target] = pooling.MySQLConnectionPool(
+            pool_name=f'wnk-{pid}-{len(pools)}',
+            pool_size=current_app.config['DB_POOL_SIZE'],
+            # A streamed page abandoned mid-result must not poison the pooled connection
+            consume_results=True,
+            **_mysql_params(target)
         )
-    return g.db
+    return pools[target]
+
+def reset_pool(app):
+    """Forget the pools inherited from a parent process (called after fork)"""
+    app.extensions.pop('db_pools', None)
+
+def _checkout_connection(target):
+    if current_app.config['DB_BACKEND'] == 'sqlite':
+        return sqlite_backend.connect(current_app.config, target)
+    
+    pool = _get_pool(target)
+    deadline = time.monotonic() + current_app.config['DB_POOL_TIMEOUT']
+    while True:
+        try:
+            return pool.get_connection()
+        except errors.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+
+def get_db(restaurant_id=None, plate_id=None, reservation_id=None, shard=None):
+    """Get a pooled database connection for this request.
+
+    With no arguments this is the home database (users, payments, jobs). Pass a
+    restaurant, plate or reservation id, or a shard name, to get the shard that
+    owns it. Unsharded, every call returns the same connection.
+    """
+    if shard is None:
+        if restaurant_id is not None:
+            shard = shard_for_restaurant(restaurant_id)
+        elif plate_id is not None:
+            shard = shard_of_id(plate_id)
+        elif reservation_id is not None:
+            shard = shard_of_id(reservation_id)
+    target = home_target() if shard is None else shard_targets()[shard]
+    
+    if target == home_target():
+        if 'db' not in g:
+            g.db = _connect(target)
+        return g.db
+    
+    connections = g.setdefault('db_shards', {})
+    if target not in connections:
+        connections[target] = _connect(target)
+    return connections[target]
+
+def _connect(target):
+    db = _checkout_connection(target)
+    # Tests can capture every statement to enforce query budgets
+    log = active_log(current_app)
+    if log is not None:
+        db = RecordingConnection(db, log)
+    return db
+
+class RowStream:
+    """Run a query lazily on an unbuffered cursor and yield compact namedtuple rows.
+
+    Nothing is executed until the stream is first tested or iterated, typically
+    while a streamed template is being sent, so the page header goes out before
+    the query runs and only chunk_size rows are held in memory at a time. Call
+    prefetch() in the view instead when a failing query must still be handled
+    there. Only one stream can be open per connection; run any other queries first.
+    """
+
+    def __init__(self, sql, params=(), chunk_size=None, shard=None):
+        self._sql = sql
+        self._params = params
+        self._shard = shard
+        self._chunk_size = chunk_size or current_app.config['STREAM_CHUNK_ROWS']
+        self._cursor = None
+        self._pending = []
+        self._done = False
+
+    def _start(self):
+        if self._cursor is None and not self._done:
+            self._cursor = get_db(shard=self._shard).cursor(named_tuple=True)
+            self._cursor.execute(self._sql, self._params)
+            self._pending = self._cursor.fetchmany(self._chunk_size)
+
+    def prefetch(self):
+        """Run the query and read the first chunk now, before the response starts"""
+        self._start()
+        return self
+
+    def __bool__(self):
+        self._start()
+        return bool(self._pending)
+
+    def __iter__(self):
+        self._start()
+        try:
+            while self._pending:
+                rows, self._pending = self._pending, []
+                yield from rows
+                self._pending = self._cursor.fetchmany(self._chunk_size)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        self._done = True
+
+def stream_query(sql, params=(), shard=None):
+    """Return a RowStream for a large result that a template will iterate once"""
+    return RowStream(sql, params, shard=shard)
 
 def close_db(e=None):
-    """Close database connection"""
+    """Return the connections to their pools"""
     db = g.pop('db', None)
     if db is not None:
         db.close()
+    for db in g.pop('db_shards', {}).values():
+        db.close()
 
-def init_db():
-    """Initialize database with schema"""
-    db = get_db()
+def _create_schema(db):
+    """Create every table and view on one database"""
     cursor = db.cursor()
     
     # Create users table
@@ -103,6 +319,353 @@ def init_db():
         )
     ''')
     
+    # Needy users' requests for donated plates, filled by the batch allocator
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS claim_requests (
+            request_id INT PRIMARY KEY AUTO_INCREMENT,
+            user_id INT NOT NULL,
+            qty INT NOT NULL,
+            qty_allocated INT NOT NULL DEFAULT 0,
+            status ENUM('PENDING', 'FILLED', 'EXPIRED', 'CANCELLED') DEFAULT 'PENDING',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP NULL,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            INDEX idx_claim_requests_status (status, created_at)
+        )
+    ''')
+    
+    # Change feed: one row per inventory/reservation change, written in the same
+    # transaction as the change itself
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_feed (
+            seq BIGINT PRIMARY KEY AUTO_INCREMENT,
+            event_type VARCHAR(40) NOT NULL,
+            plate_id INT NULL,
+            reservation_id INT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_change_feed_created (created_at)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_feed_offsets (
+            consumer VARCHAR(64) PRIMARY KEY,
+            last_seq BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Ledger: running balance per restaurant, period-close snapshots and payouts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS restaurant_balances (
+            restaurant_id INT PRIMARY KEY,
+            balance DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            lifetime_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (restaurant_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            snapshot_id INT PRIMARY KEY AUTO_INCREMENT,
+            period_end DATETIME NOT NULL,
+            restaurant_id INT NOT NULL,
+            balance DECIMAL(12, 2) NOT NULL,
+            lifetime_total DECIMAL(14, 2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (restaurant_id) REFERENCES users(user_id),
+            UNIQUE KEY uq_balance_snapshots_period (period_end, restaurant_id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payouts (
+            payout_id INT PRIMARY KEY AUTO_INCREMENT,
+            restaurant_id INT NOT NULL,
+            amount DECIMAL(12, 2) NOT NULL,
+            period_end DATETIME NOT NULL,
+            status ENUM('PENDING', 'PAID') DEFAULT 'PENDING',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (restaurant_id) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # First result of each checkout/claim attempt, replayed to duplicate submissions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INT NOT NULL,
+            idem_key VARCHAR(64) NOT NULL,
+            endpoint VARCHAR(64) NOT NULL,
+            status ENUM('PENDING', 'DONE') NOT NULL DEFAULT 'PENDING',
+            location VARCHAR(255),
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, idem_key),
+            INDEX idx_idempotency_created (created_at)
+        )
+    ''')
+    
+    # Background jobs claimed by `flask worker` with SELECT ... FOR UPDATE SKIP LOCKED
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            kind VARCHAR(64) NOT NULL,
+            payload TEXT,
+            priority INT NOT NULL DEFAULT 0,
+            status ENUM('QUEUED', 'RUNNING', 'DONE', 'FAILED') NOT NULL DEFAULT 'QUEUED',
+            attempts INT NOT NULL DEFAULT 0,
+            max_attempts INT NOT NULL DEFAULT 5,
+            run_after DATETIME NOT NULL,
+            locked_by VARCHAR(128),
+            locked_at DATETIME,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            INDEX idx_jobs_due (status, priority, run_after),
+            INDEX idx_jobs_kind (kind, status)
+        )
+    ''')
+    
+    # Archive tables hold finished history moved out of the hot tables
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reservations_archive (
+            reservation_id INT PRIMARY KEY,
+            user_id INT NULL,
+            donor_id INT NULL,
+            plate_id INT NOT NULL,
+            qty INT NOT NULL,
+            status ENUM('HELD', 'CONFIRMED', 'CANCELLED', 'PICKED_UP', 'DONATED', 'CLAIMED'),
+            pickup_code VARCHAR(8),
+            created_at TIMESTAMP NULL,
+            confirmed_at TIMESTAMP NULL,
+            claimed_at TIMESTAMP NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_reservations_archive_user (user_id, status),
+            INDEX idx_reservations_archive_donor (donor_id),
+            INDEX idx_reservations_archive_created (created_at)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transactions_archive (
+            transaction_id INT PRIMARY KEY,
+            payer_user_id INT NOT NULL,
+            payee_restaurant_id INT NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            type ENUM('CUSTOMER_PURCHASE', 'DONATION_PURCHASE') NOT NULL,
+            created_at TIMESTAMP NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_transactions_archive_payer (payer_user_id),
+            INDEX idx_transactions_archive_created (created_at)
+        )
+    ''')
+    
+    # Unified views so history pages and reports see hot and archived rows
+    cursor.execute('''
+        CREATE OR REPLACE VIEW reservations_all AS
+        SELECT reservation_id, user_id, donor_id, plate_id, qty, status, pickup_code,
+               created_at, confirmed_at, claimed_at
+        FROM reservations
+        UNION ALL
+        SELECT reservation_id, user_id, donor_id, plate_id, qty, status, pickup_code,
+               created_at, confirmed_at, claimed_at
+        FROM reservations_archive
+    ''')
+    
+    cursor.execute('''
+        CREATE OR REPLACE VIEW transactions_all AS
+        SELECT transaction_id, payer_user_id, payee_restaurant_id, amount, type, created_at
+        FROM transactions
+        UNION ALL
+        SELECT transaction_id, payer_user_id, payee_restaurant_id, amount, type, created_at
+        FROM transactions_archive
+    ''')
+    
+    # Read models: display-ready copies maintained by models/read_models.py so the
+    # history and free-plates pages read one table through one index
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_history_rows (
+            reservation_id INT PRIMARY KEY,
+            user_id INT NOT NULL,
+            restaurant_id INT NOT NULL,
+            donor_id INT NULL,
+            status VARCHAR(16) NOT NULL,
+            qty INT NOT NULL,
+            pickup_code VARCHAR(8),
+            title VARCHAR(255),
+            description TEXT,
+            price DECIMAL(10, 2) NOT NULL,
+            total_price DECIMAL(12, 2) NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            restaurant_name VARCHAR(255),
+            donated_by VARCHAR(255),
+            created_at TIMESTAMP NULL,
+            confirmed_at TIMESTAMP NULL,
+            claimed_at TIMESTAMP NULL,
+            ordered_at TIMESTAMP NULL,
+            INDEX idx_order_history_user (user_id, ordered_at),
+            INDEX idx_order_history_restaurant (restaurant_id),
+            INDEX idx_order_history_donor (donor_id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS open_donation_rows (
+            reservation_id INT PRIMARY KEY,
+            plate_id INT NOT NULL,
+            restaurant_id INT NOT NULL,
+            available_qty INT NOT NULL,
+            title VARCHAR(255),
+            description TEXT,
+            price DECIMAL(10, 2) NOT NULL,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME NOT NULL,
+            restaurant_name VARCHAR(255),
+            created_at TIMESTAMP NULL,
+            INDEX idx_open_donations_end (end_time),
+            INDEX idx_open_donations_restaurant (restaurant_id)
+        )
+    ''')
+    
+    # Restaurant coordinates (models/geo.py), mirrored to every shard like users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS restaurant_locations (
+            restaurant_id INT PRIMARY KEY,
+            latitude DOUBLE NOT NULL,
+            longitude DOUBLE NOT NULL,
+            geohash CHAR(9) NOT NULL,
+            source VARCHAR(16) NOT NULL,
+            address_key VARCHAR(255),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_restaurant_locations_geohash (geohash)
+        )
+    ''')
+    
+    # Offline geocoder's address -> coordinates table (read on the home database only)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_lookup (
+            address_key VARCHAR(255) PRIMARY KEY,
+            latitude DOUBLE NOT NULL,
+            longitude DOUBLE NOT NULL
+        )
+    ''')
+    
+    # Profiling sessions every worker polls, and the samples they flush (home database only)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profiler_sessions (
+            session_id INT PRIMARY KEY AUTO_INCREMENT,
+            endpoint VARCHAR(255) NULL,
+            percent DOUBLE NOT NULL,
+            interval_ms DOUBLE NOT NULL,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ends_at DATETIME NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profiler_stacks (
+            session_id INT NOT NULL,
+            pid INT NOT NULL,
+            stack_hash CHAR(40) NOT NULL,
+            stack TEXT NOT NULL,
+            samples INT NOT NULL,
+            PRIMARY KEY (session_id, pid, stack_hash)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profiler_requests (
+            request_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            session_id INT NOT NULL,
+            pid INT NOT NULL,
+            record TEXT NOT NULL,
+            INDEX idx_profiler_requests_session (session_id, request_id)
+        )
+    ''')
+    
+    # Restaurant -> shard assignments (read on the home database only)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_map (
+            restaurant_id INT PRIMARY KEY,
+            shard VARCHAR(32) NOT NULL,
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Record the version last so a failed init is retried on the next boot
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            id INT PRIMARY KEY,
+            version INT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO schema_version (id, version) VALUES (1, %s)
+        ON DUPLICATE KEY UPDATE version = VALUES(version)
+    ''', (SCHEMA_VERSION,))
+    
     db.commit()
     cursor.close()
-    print("Database initialized successfully!")
\ No newline at end of file
+
+# Tables whose ids route to a shard; each shard starts them in its own id range
+SHARDED_ID_TABLES = ('plates', 'reservations', 'transactions')
+
+def init_db():
+    """Initialize the home database and every shard with the schema"""
+    backend = current_app.config['DB_BACKEND']
+    if backend == 'mysql':
+        # Shards on the home server are created on demand so local multi-database setups just work
+        cursor = get_db().cursor()
+        for target in shard_targets().values():
+            if '/' not in target and target != home_target():
+                cursor.execute(f'CREATE DATABASE IF NOT EXISTS `{target}`')
+        cursor.close()
+    
+    _create_schema(get_db())
+    
+    if is_sharded():
+        for index, shard in enumerate(shard_targets()):
+            db = get_db(shard=shard)
+            if db is not get_db():
+                _create_schema(db)
+            cursor = db.cursor()
+            for table in SHARDED_ID_TABLES:
+                # Never lowers an existing counter on either backend
+                cursor.execute(f'ALTER TABLE {table} AUTO_INCREMENT = {index * SHARD_ID_SPAN + 1}')
+            db.commit()
+            cursor.close()
+    
+    # Backfill read models added by a schema upgrade (a no-op on an empty database)
+    from models.read_models import rebuild_read_models
+    rebuild_read_models()
+    
+    print("Database initialized successfully!")
+
+def schema_is_current():
+    """One cheap query instead of replaying every CREATE TABLE on boot"""
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute('SELECT version FROM schema_version WHERE id = 1')
+        row = cursor.fetchone()
+    except DatabaseError:
+        # No schema_version table yet
+        db.rollback()
+        return False
+    finally:
+        cursor.close()
+    return row is not None and row[0] >= SCHEMA_VERSION
+
+def ensure_schema():
+    """Run init_db only when the stored schema version is missing or older"""
+    if schema_is_current():
+        return False
+    init_db()
+    return True
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database schema"""
+    init_db()
@@ -0,0 +1,328 @@
+"""Restaurant coordinates and the offline geocoder.
+
+users.address is free text, so each restaurant's position is kept in
+restaurant_locations: typed in at registration or on the profile page
+(source 'manual'), or resolved from the address against the local
+geocode_lookup table (source 'geocoded'). Like users, the rows live on the
+home database and are mirrored to every shard so plate queries can join
+them. Nothing here calls out to a geocoding service; load the lookup table
+from a CSV with `flask geo load-lookup`.
+
+The geohash helpers are what the marketplace search index uses for its
+radius queries (app/search.py).
+"""
+import csv
+import math
+import re
+
+import click
+from flask.cli import AppGroup
+
+from models.change_feed import record_events, PLATE_UPDATED
+from models.database import get_db, shard_targets, home_target
+from models.jobs import job
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# 9 characters is a cell of a few metres; prefixes of it give every coarser cell
+GEOHASH_PRECISION = 9
+
+# Most cells a radius query scans; finer cells mean fewer distance checks per hit
+MAX_COVERING_CELLS = 16
+
+EARTH_RADIUS_KM = 6371.0088
+
+_WORD_RE = re.compile(r'\w+')
+
+# Rows per IN (...) list when resolving many addresses at once
+_LOOKUP_CHUNK = 500
+
+
+# --- Geohash ----------------------------------------------------------------
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Base-32 geohash: nearby points share a prefix, and a prefix is a rectangular cell"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = bit_count = 0
+    even = True
+    while len(chars) < precision:
+        # Bits alternate longitude, latitude, starting with longitude
+        value, bounds = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits = bits * 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(degrees of latitude, degrees of longitude) spanned by one cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(half height, half width) in degrees of the box around a circle"""
+    lat_span = radius_km / 111.32
+    lng_span = min(180.0, radius_km / (111.32 * max(math.cos(math.radians(latitude)), 0.01)))
+    return lat_span, lng_span
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together cover a circle's bounding box.
+
+    Uses the finest precision at which the box touches no more than
+    MAX_COVERING_CELLS cells, so little outside the circle is scanned.
+    """
+    lat_span, lng_span = bounding_box(latitude, longitude, radius_km)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(candidate)
+        if (math.ceil(2 * lat_span / height) + 1) * (math.ceil(2 * lng_span / width) + 1) <= MAX_COVERING_CELLS:
+            precision = candidate
+            break
+
+    # Sampling every half cell across the box lands in every cell it touches
+    height, width = cell_size(precision)
+    cells = set()
+    lat = latitude - lat_span
+    while True:
+        lng = longitude - lng_span
+        while True:
+            wrapped = (lng + 180.0) % 360.0 - 180.0
+            cells.add(geohash(min(max(lat, -90.0), 90.0 - 1e-9), wrapped, precision))
+            if lng >= longitude + lng_span:
+                break
+            lng = min(lng + width / 2, longitude + lng_span)
+        if lat >= latitude + lat_span:
+            break
+        lat = min(lat + height / 2, latitude + lat_span)
+    return cells
+
+
+def parse_coordinates(latitude, longitude):
+    """(lat, lng) floats from form or query-string values; None when both are blank.
+
+    Raises ValueError for a half-filled pair or values out of range.
+    """
+    latitude = (latitude or '').strip() if isinstance(latitude, str) else latitude
+    longitude = (longitude or '').strip() if isinstance(longitude, str) else longitude
+    if latitude in (None, '') and longitude in (None, ''):
+        return None
+    try:
+        lat, lng = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('Latitude and longitude must both be given as decimal degrees')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Latitude must be within -90..90 and longitude within -180..180')
+    return lat, lng
+
+
+# --- Addresses and the lookup table -------------------------------------------
+
+def normalize_address(address):
+    """Lower-case words, one comma between address parts: '12 main st, springfield, il 62701'"""
+    parts = (address or '').replace('\n', ',').split(',')
+    parts = [' '.join(_WORD_RE.findall(part.lower())) for part in parts]
+    return ', '.join(part for part in parts if part)
+
+
+def lookup_keys(address):
+    """Lookup keys from most to least specific: the whole address, then without the street, ...,
+    and finally its last word on its own (usually the postal code)"""
+    parts = normalize_address(address).split(', ')
+    keys = [', '.join(parts[index:]) for index in range(len(parts)) if parts[index]]
+    if keys and ' ' in keys[-1]:
+        keys.append(keys[-1].rsplit(' ', 1)[1])
+    return keys
+
+
+def geocode_many(addresses):
+    """{address: (lat, lng)} for every address whose key (or a less specific one) is in geocode_lookup"""
+    wanted = {address: lookup_keys(address) for address in dict.fromkeys(addresses)}
+    keys = list(dict.fromkeys(key for address_keys in wanted.values() for key in address_keys))
+    found = {}
+    cursor = get_db().cursor()
+    for start in range(0, len(keys), _LOOKUP_CHUNK):
+        chunk = keys[start:start + _LOOKUP_CHUNK]
+        cursor.execute(f'''
+            SELECT address_key, latitude, longitude FROM geocode_lookup
+            WHERE address_key IN ({','.join(['%s'] * len(chunk))})
+        ''', chunk)
+        for key, lat, lng in cursor.fetchall():
+            found[key] = (float(lat), float(lng))
+    cursor.close()
+
+    located = {}
+    for address, address_keys in wanted.items():
+        for key in address_keys:
+            if key in found:
+                located[address] = found[key]
+                break
+    return located
+
+
+def load_lookup(rows):
+    """Upsert (address, latitude, longitude) rows into geocode_lookup; returns the count"""
+    entries = {}
+    for address, latitude, longitude in rows:
+        key = normalize_address(address)
+        if key:
+            entries[key] = (key, float(latitude), float(longitude))
+    db = get_db()
+    cursor = db.cursor()
+    values = list(entries.values())
+    for start in range(0, len(values), _LOOKUP_CHUNK):
+        cursor.executemany('''
+            INSERT INTO geocode_lookup (address_key, latitude, longitude) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE latitude = VALUES(latitude), longitude = VALUES(longitude)
+        ''', values[start:start + _LOOKUP_CHUNK])
+    db.commit()
+    cursor.close()
+    return len(values)
+
+
+# --- Restaurant locations -----------------------------------------------------
+
+def save_location(restaurant_id, coordinates, source=None, address=None):
+    """Set (or with coordinates=None, clear) a restaurant's location on home and every shard.
+
+    On the restaurant's own shard its current plates get a plate.updated event
+    in the same transaction, so search indexes re-read them with the new position.
+    """
+    targets = [None] + [shard for shard, target in shard_targets().items() if target != home_target()]
+    for shard in targets:
+        db = get_db(shard=shard)
+        cursor = db.cursor()
+        try:
+            if coordinates is None:
+                cursor.execute('DELETE FROM restaurant_locations WHERE restaurant_id = %s', (restaurant_id,))
+            else:
+                lat, lng = coordinates
+                cursor.execute('''
+                    INSERT INTO restaurant_locations
+                    (restaurant_id, latitude, longitude, geohash, source, address_key)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE latitude = VALUES(latitude), longitude = VALUES(longitude),
+                        geohash = VALUES(geohash), source = VALUES(source), address_key = VALUES(address_key)
+                ''', (restaurant_id, lat, lng, geohash(lat, lng), source, normalize_address(address)))
+            if db is get_db(restaurant_id=restaurant_id):
+                cursor.execute('''
+                    SELECT plate_id FROM plates
+                    WHERE restaurant_id = %s AND is_active = 1 AND end_time > NOW()
+                ''', (restaurant_id,))
+                record_events(cursor, [(PLATE_UPDATED, plate_id, None) for (plate_id,) in cursor.fetchall()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def locate_restaurant(restaurant_id, address, coordinates=None):
+    """Position a restaurant after registration or a profile update.
+
+    Typed-in coordinates win; otherwise the address is geocoded from the lookup
+    table. An address the table doesn't know clears any old position, and the
+    batch geocoder retries it after the table grows. Returns the coordinates used.
+    """
+    if coordinates is not None:
+        save_location(restaurant_id, coordinates, 'manual', address)
+        return coordinates
+    coordinates = geocode_many([address]).get(address)
+    save_location(restaurant_id, coordinates, 'geocoded', address)
+    return coordinates
+
+
+def geocode_restaurants(refresh_all=False):
+    """Batch-geocode restaurants with no position or whose address changed since.
+
+    Manually placed restaurants are left alone. Returns (located, unresolved).
+    """
+    cursor = get_db().cursor(dictionary=True)
+    cursor.execute('''
+        SELECT u.user_id, u.address, loc.source, loc.address_key
+        FROM users u
+        LEFT JOIN restaurant_locations loc ON loc.restaurant_id = u.user_id
+        WHERE u.user_type = 'restaurant'
+    ''')
+    pending = [row for row in cursor.fetchall()
+               if row['source'] != 'manual'
+               and (refresh_all or row['address_key'] != normalize_address(row['address']))]
+    cursor.close()
+
+    located = geocode_many(row['address'] for row in pending)
+    for row in pending:
+        coordinates = located.get(row['address'])
+        if coordinates is not None or row['source'] is not None:
+            save_location(row['user_id'], coordinates, 'geocoded', row['address'])
+    return (sum(1 for row in pending if row['address'] in located),
+            sum(1 for row in pending if row['address'] not in located))
+
+
+@job('geo.geocode')
+def _geocode_job(payload):
+    geocode_restaurants(refresh_all=bool((payload or {}).get('all')))
+
+
+geo_cli = AppGroup('geo', help='Restaurant coordinates and the offline geocoder')
+
+
+@geo_cli.command('load-lookup')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8'))
+def load_lookup_command(csv_file):
+    """Load address,latitude,longitude rows (with a header line) into the lookup table.
+
+    Keys can be whole addresses or just their tail ("springfield, il 62701",
+    "62701"): an address falls back to shorter tails until one matches.
+    """
+    reader = csv.DictReader(csv_file)
+    count = load_lookup((row['address'], row['latitude'], row['longitude']) for row in reader)
+    click.echo(f'Loaded {count} lookup entries')
+
+
+@geo_cli.command('geocode')
+@click.option('--all', 'refresh_all', is_flag=True, help='Re-geocode every restaurant not placed by hand')
+def geocode_command(refresh_all):
+    """Resolve restaurant addresses against the lookup table"""
+    located, unresolved = geocode_restaurants(refresh_all)
+    click.echo(f'Located {located} restaurants; {unresolved} addresses not in the lookup table')
+
+
+@geo_cli.command('locate')
+@click.argument('restaurant_id', type=int)
+@click.argument('latitude', type=float)
+@click.argument('longitude', type=float)
+def locate_command(restaurant_id, latitude, longitude):
+    """Place a restaurant by hand (the geocoder won't move it again)"""
+    try:
+        coordinates = parse_coordinates(latitude, longitude)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    cursor = get_db().cursor()
+    cursor.execute('SELECT address FROM users WHERE user_id = %s AND user_type = %s', (restaurant_id, 'restaurant'))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        raise click.ClickException(f'no restaurant with id {restaurant_id}')
+    save_location(restaurant_id, coordinates, 'manual', row[0])
+    click.echo(f'Restaurant {restaurant_id} -> {coordinates[0]}, {coordinates[1]}')
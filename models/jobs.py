@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from models.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# kind -> handler(payload); filled by the @job decorator in the modules that own the work
+HANDLERS = {}
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+
+def job(kind):
+    """Register a function as the handler for jobs of this kind"""
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def enqueue(cursor, kind, payload=None, priority=PRIORITY_NORMAL, delay_seconds=0, max_attempts=None,
+            coalesce=False):
+    """Queue a job using the caller's cursor.
+
+    Call it inside the same transaction as the change that needs the follow-up
+    work, so the job exists if and only if that change commits. With coalesce=True
+    nothing is queued when a job of this kind is already waiting; use it for
+    "run soon" triggers where one run covers every request. Returns the job id,
+    or None when coalesced.
+    """
+    if max_attempts is None:
+        max_attempts = current_app.config['JOB_MAX_ATTEMPTS']
+    if coalesce:
+        cursor.execute("SELECT 1 FROM jobs WHERE kind = %s AND status = 'QUEUED' LIMIT 1", (kind,))
+        if cursor.fetchone():
+            return None
+    cursor.execute('''
+        INSERT INTO jobs (kind, payload, priority, run_after, max_attempts)
+        VALUES (%s, %s, %s, %s, %s)
+    ''', (kind, json.dumps(payload or {}), priority,
+          datetime.now() + timedelta(seconds=delay_seconds), max_attempts))
+    return cursor.lastrowid
+
+
+def claim(worker_id, limit=1):
+    """Lock and mark RUNNING up to `limit` due jobs, highest priority first.
+
+    SKIP LOCKED lets any number of workers claim concurrently without blocking on
+    (or double-claiming) each other's rows.
+    """
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute('''
+            SELECT job_id, kind, payload, attempts, max_attempts FROM jobs
+            WHERE status = 'QUEUED' AND run_after <= %s
+            ORDER BY priority DESC, run_after ASC, job_id ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (datetime.now(), limit))
+        jobs = cursor.fetchall()
+        if jobs:
+            cursor.executemany('''
+                UPDATE jobs
+                SET status = 'RUNNING', attempts = attempts + 1, locked_by = %s, locked_at = %s
+                WHERE job_id = %s
+            ''', [(worker_id, datetime.now(), j['job_id']) for j in jobs])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    for j in jobs:
+        j['attempts'] += 1
+    return jobs
+
+
+def _backoff_seconds(attempts):
+    base = current_app.config['JOB_RETRY_BASE_SECONDS']
+    # Exponential with jitter so a failing batch does not retry in lockstep
+    return min(base * 2 ** (attempts - 1), 3600) * random.uniform(0.5, 1.5)
+
+
+def run(job_row):
+    """Run one claimed job and record the outcome. Returns True on success."""
+    db = get_db()
+    try:
+        handler = HANDLERS[job_row['kind']]
+        handler(json.loads(job_row['payload'] or '{}'))
+    except Exception as e:
+        db.rollback()
+        cursor = db.cursor()
+        if job_row['attempts'] >= job_row['max_attempts']:
+            cursor.execute('''
+                UPDATE jobs SET status = 'FAILED', last_error = %s, finished_at = %s, locked_by = NULL
+                WHERE job_id = %s
+            ''', (repr(e)[:2000], datetime.now(), job_row['job_id']))
+        else:
+            cursor.execute('''
+                UPDATE jobs SET status = 'QUEUED', last_error = %s, run_after = %s, locked_by = NULL
+                WHERE job_id = %s
+            ''', (repr(e)[:2000], datetime.now() + timedelta(seconds=_backoff_seconds(job_row['attempts'])),
+                  job_row['job_id']))
+        db.commit()
+        cursor.close()
+        logger.warning('Job %s (%s) failed on attempt %s: %r',
+                       job_row['job_id'], job_row['kind'], job_row['attempts'], e)
+        return False
+
+    cursor = db.cursor()
+    cursor.execute('''
+        UPDATE jobs SET status = 'DONE', finished_at = %s, locked_by = NULL WHERE job_id = %s
+    ''', (datetime.now(), job_row['job_id']))
+    db.commit()
+    cursor.close()
+    return True
+
+
+def requeue_stale(lock_timeout=None):
+    """Put RUNNING jobs whose worker died back in the queue. Returns how many."""
+    if lock_timeout is None:
+        lock_timeout = current_app.config['JOB_LOCK_TIMEOUT_SECONDS']
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        UPDATE jobs SET status = 'QUEUED', locked_by = NULL
+        WHERE status = 'RUNNING' AND locked_at < %s
+    ''', (datetime.now() - timedelta(seconds=lock_timeout),))
+    requeued = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return requeued
+
+
+def purge_finished(retain_days=7):
+    """Delete DONE jobs older than retain_days; FAILED jobs are kept for inspection"""
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('''
+        DELETE FROM jobs WHERE status = 'DONE' AND finished_at < %s
+    ''', (datetime.now() - timedelta(days=retain_days),))
+    deleted = cursor.rowcount
+    db.commit()
+    cursor.close()
+    return deleted
+
+
+def _work(app, worker_id, stop, poll_interval):
+    """One worker thread: claim a job, run it, repeat until stopped"""
+    while not stop.is_set():
+        try:
+            with app.app_context():
+                jobs = claim(worker_id)
+                for job_row in jobs:
+                    run(job_row)
+        except Exception:
+            logger.exception('Job worker %s hit an error', worker_id)
+            jobs = []
+        if not jobs:
+            stop.wait(poll_interval)
+
+
+@job('jobs.purge')
+def _purge_job(payload):
+    purge_finished(payload.get('retain_days', 7))
+
+
+@click.command('worker')
+@click.option('--threads', type=int, default=None, help='Concurrent jobs in this process.')
+@click.option('--poll-interval', type=float, default=None, help='Seconds an idle thread waits before polling again.')
+@with_appcontext
+def worker_command(threads, poll_interval):
+    """Run queued background jobs until interrupted"""
+    app = current_app._get_current_object()
+    threads = threads or app.config['JOB_WORKER_THREADS']
+    poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+
+    stop = threading.Event()
+    workers = [threading.Thread(target=_work, args=(app, f'{prefix}:{n}', stop, poll_interval),
+                                name=f'wnk-job-{n}', daemon=True)
+               for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    click.echo(f'Worker {prefix} running {threads} thread(s); kinds: {", ".join(sorted(HANDLERS))}')
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.is_set():
+            requeued = requeue_stale()
+            if requeued:
+                click.echo(f'Requeued {requeued} stale job(s)')
+            stop.wait(app.config['JOB_LOCK_TIMEOUT_SECONDS'] / 4)
+    except KeyboardInterrupt:
+        pass
+    # Let in-flight jobs finish; anything cut off is requeued after the lock timeout
+    stop.set()
+    for thread in workers:
+        thread.join()
+
+
+jobs_cli = AppGroup('jobs', help='Background job queue')
+
+
+@jobs_cli.command('enqueue')
+@click.argument('kind')
+@click.option('--payload', default='{}', help='JSON payload.')
+@click.option('--priority', type=int, default=PRIORITY_NORMAL)
+@click.option('--delay', type=float, default=0, help='Seconds before the job becomes due.')
+def enqueue_command(kind, payload, priority, delay):
+    """Queue a job by kind"""
+    if kind not in HANDLERS:
+        raise click.BadParameter(f'unknown kind; known: {", ".join(sorted(HANDLERS))}', param_hint='KIND')
+    db = get_db()
+    cursor = db.cursor()
+    job_id = enqueue(cursor, kind, json.loads(payload), priority, delay)
+    db.commit()
+    cursor.close()
+    click.echo(f'Queued job {job_id}')
+
+
+@jobs_cli.command('stats')
+def stats_command():
+    """Show job counts by kind and status"""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT kind, status, COUNT(*), MIN(run_after) FROM jobs
+        GROUP BY kind, status ORDER BY kind, status
+    ''')
+    for kind, status, count, oldest in cursor.fetchall():
+        click.echo(f'{kind:<24}{status:<10}{count:>8}  oldest due {oldest}')
+    cursor.close()
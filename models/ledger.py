@@ -0,0 +1,139 @@
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from models.database import get_db, shard_targets
+
+
+def credit_restaurants(cursor, amounts):
+    """Add {restaurant_id: amount} to running balances inside the caller's transaction.
+
+    Restaurants are credited in id order so two checkouts touching the same
+    restaurants always lock their balance rows in the same order.
+    """
+    rows = [(restaurant_id, amount, amount) for restaurant_id, amount in sorted(amounts.items())]
+    if rows:
+        cursor.executemany('''
+            INSERT INTO restaurant_balances (restaurant_id, balance, lifetime_total)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE balance = balance + VALUES(balance),
+                                    lifetime_total = lifetime_total + VALUES(lifetime_total)
+        ''', rows)
+
+
+def get_balance(restaurant_id):
+    """Return (balance owed, lifetime total) for one restaurant from its balance row"""
+    cursor = get_db(restaurant_id=restaurant_id).cursor()
+    cursor.execute('''
+        SELECT balance, lifetime_total FROM restaurant_balances WHERE restaurant_id = %s
+    ''', (restaurant_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row if row else (0, 0)
+
+
+def settle(period_end=None):
+    """Close the period on every shard. Returns (payout count, total paid out)."""
+    period_end = period_end or datetime.now().replace(microsecond=0)
+    count, total = 0, 0
+    for shard in shard_targets():
+        shard_count, shard_total = _settle_shard(shard, period_end)
+        count += shard_count
+        total += shard_total
+    return count, total
+
+
+def _settle_shard(shard, period_end):
+    """Snapshot every balance on one shard and create payouts in one transaction.
+
+    Reads only the balance rows, never transaction history.
+    """
+    db = get_db(shard=shard)
+    cursor = db.cursor()
+
+    try:
+        cursor.execute('''
+            SELECT restaurant_id, balance, lifetime_total FROM restaurant_balances
+            ORDER BY restaurant_id
+            FOR UPDATE
+        ''')
+        balances = cursor.fetchall()
+
+        cursor.executemany('''
+            INSERT INTO balance_snapshots (period_end, restaurant_id, balance, lifetime_total)
+            VALUES (%s, %s, %s, %s)
+        ''', [(period_end, restaurant_id, balance, lifetime) for restaurant_id, balance, lifetime in balances])
+
+        owed = [(restaurant_id, balance) for restaurant_id, balance, _ in balances if balance > 0]
+        if owed:
+            cursor.executemany('''
+                INSERT INTO payouts (restaurant_id, amount, period_end)
+                VALUES (%s, %s, %s)
+            ''', [(restaurant_id, amount, period_end) for restaurant_id, amount in owed])
+            cursor.executemany('''
+                UPDATE restaurant_balances SET balance = balance - %s WHERE restaurant_id = %s
+            ''', [(amount, restaurant_id) for restaurant_id, amount in owed])
+
+        db.commit()
+        return len(owed), sum(amount for _, amount in owed)
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def rebuild_balances():
+    """Recompute every balance from full transaction history minus payouts.
+
+    Recovery tool only; normal operation never scans history. Returns the number
+    of restaurants rebuilt.
+    """
+    return sum(_rebuild_shard(shard) for shard in shard_targets())
+
+
+def _rebuild_shard(shard):
+    db = get_db(shard=shard)
+    cursor = db.cursor()
+
+    try:
+        cursor.execute('''
+            SELECT payee_restaurant_id, SUM(amount) FROM transactions_all
+            GROUP BY payee_restaurant_id
+        ''')
+        earned = dict(cursor.fetchall())
+        cursor.execute('SELECT restaurant_id, SUM(amount) FROM payouts GROUP BY restaurant_id')
+        paid = defaultdict(int, cursor.fetchall())
+
+        cursor.execute('DELETE FROM restaurant_balances')
+        cursor.executemany('''
+            INSERT INTO restaurant_balances (restaurant_id, balance, lifetime_total)
+            VALUES (%s, %s, %s)
+        ''', [(restaurant_id, total - paid[restaurant_id], total) for restaurant_id, total in earned.items()])
+        db.commit()
+        return len(earned)
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+ledger_cli = AppGroup('ledger', help='Restaurant balances and payouts')
+
+
+@ledger_cli.command('settle')
+def settle_command():
+    """Generate payouts for every restaurant with a positive balance"""
+    count, total = settle()
+    click.echo(f'Created {count} payouts totaling ${total:.2f}')
+
+
+@ledger_cli.command('rebuild')
+def rebuild_command():
+    """Recompute balances from transaction history"""
+    click.echo(f'Rebuilt balances for {rebuild_balances()} restaurants')
@@ -0,0 +1,183 @@
+import re
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+from flask import g, request, has_app_context, has_request_context
+
+# Literals are stripped so statements that differ only in parameters normalize
+# to the same text
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals with ? so similar statements compare equal"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+class QueryRecord:
+    __slots__ = ('sql', 'normalized', 'params', 'duration', 'endpoint')
+
+    def __init__(self, sql, params, duration, endpoint):
+        self.sql = sql
+        self.normalized = normalize_sql(sql)
+        self.params = params
+        self.duration = duration
+        self.endpoint = endpoint
+
+    def __repr__(self):
+        return f'<QueryRecord {self.normalized[:60]!r} {self.duration * 1000:.2f}ms>'
+
+
+class QueryLog:
+    """Every statement executed through get_db while a capture is active"""
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def add(self, sql, params, duration):
+        endpoint = request.endpoint if has_request_context() else None
+        self.records.append(QueryRecord(sql, params, duration, endpoint))
+
+    def for_endpoint(self, endpoint):
+        return [r for r in self.records if r.endpoint == endpoint]
+
+    def repeated(self, threshold=2):
+        """Return {normalized_sql: count} for statements issued at least `threshold`
+        times with different parameters - the usual signature of an N+1 loop"""
+        params_by_sql = defaultdict(list)
+        for record in self.records:
+            params_by_sql[record.normalized].append(record.params)
+
+        repeated = {}
+        for sql, params in params_by_sql.items():
+            if len(params) >= threshold and len({repr(p) for p in params}) > 1:
+                repeated[sql] = len(params)
+        return repeated
+
+    def total_time(self):
+        return sum(r.duration for r in self.records)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RecordingCursor:
+    """Cursor proxy that times and logs every execute call"""
+
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self._log = log
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._log.add(operation, params, time.perf_counter() - started)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._log.add(operation, seq_params, time.perf_counter() - started)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class RecordingConnection:
+    """Connection proxy whose cursors log into a QueryLog"""
+
+    def __init__(self, connection, log):
+        self._connection = connection
+        self._log = log
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._connection.cursor(*args, **kwargs), self._log)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def active_log(app):
+    """Return the QueryLog get_db should record into, or None.
+
+    A per-request log (set by the profiler) wins over an app-wide test capture.
+    """
+    log = g.get('query_log') if has_app_context() else None
+    if log is None:
+        log = app.extensions.get('query_log')
+    return log
+
+
+@contextmanager
+def capture_queries(app):
+    """Record every statement issued through get_db while the block runs.
+
+    Intended for tests driving the app through app.test_client(); the log is
+    app-wide, so do not use it while serving concurrent requests.
+    """
+    log = QueryLog()
+    previous = app.extensions.get('query_log')
+    app.extensions['query_log'] = log
+    try:
+        yield log
+    finally:
+        app.extensions['query_log'] = previous
+
+
+def assert_query_budget(client, method, path, budget=None, n_plus_one_threshold=None, **kwargs):
+    """Issue a request through a test client and fail if it exceeds its query budget.
+
+    The budget defaults to app.config['QUERY_BUDGETS'][endpoint], which the test
+    config sets (tests/config.py). Statements that repeat with different parameters
+    `n_plus_one_threshold` or more times are reported as N+1 patterns. Returns
+    (response, log).
+    """
+    app = client.application
+    if n_plus_one_threshold is None:
+        n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 3)
+
+    with capture_queries(app) as log:
+        response = client.open(path, method=method, **kwargs)
+
+    endpoints = {r.endpoint for r in log if r.endpoint}
+    if budget is None:
+        budgets = app.config.get('QUERY_BUDGETS', {})
+        known = [budgets[e] for e in endpoints if e in budgets]
+        if not known and len(log):
+            raise QueryBudgetExceeded(f'No query budget declared for {method} {path} (endpoints: {sorted(endpoints)})')
+        budget = max(known, default=0)
+
+    problems = []
+    if len(log) > budget:
+        problems.append(f'{len(log)} queries issued, budget is {budget}')
+    for sql, count in log.repeated(n_plus_one_threshold).items():
+        problems.append(f'N+1 suspected ({count}x): {sql}')
+
+    if problems:
+        statements = '\n'.join(f'  {r.normalized}' for r in log)
+        raise QueryBudgetExceeded(f'{method} {path}: ' + '; '.join(problems) + f'\nStatements:\n{statements}')
+
+    return response, log
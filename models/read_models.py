@@ -0,0 +1,144 @@
+"""Denormalized read models for the order-history and free-plates pages.
+
+order_history_rows holds one display-ready row per purchased or claimed
+reservation, and open_donation_rows holds one per unclaimed donation. Both
+copy plate titles and user names in, so the pages read a single table.
+Write paths call sync_reservations() with the cursor of the transaction
+that changed the reservations, so the copies commit (or roll back) with
+the change. rebuild_read_models() re-derives everything from the base
+tables.
+"""
+import click
+from flask.cli import AppGroup
+
+from models.change_feed import record_events, PLATE_UPDATED
+from models.database import get_db, shard_targets
+from models.jobs import job
+
+_HISTORY_COLUMNS = '''reservation_id, user_id, restaurant_id, donor_id, status, qty, pickup_code,
+    title, description, price, total_price, start_time, end_time, restaurant_name, donated_by,
+    created_at, confirmed_at, claimed_at, ordered_at'''
+
+_HISTORY_SELECT = '''
+    SELECT r.reservation_id, r.user_id, p.restaurant_id, r.donor_id, r.status, r.qty, r.pickup_code,
+           p.title, p.description, p.price, r.qty * p.price, p.start_time, p.end_time,
+           u.name, donor.name,
+           r.created_at, r.confirmed_at, r.claimed_at, COALESCE(r.claimed_at, r.confirmed_at, r.created_at)
+    FROM {source} r
+    JOIN plates p ON p.plate_id = r.plate_id
+    JOIN users u ON u.user_id = p.restaurant_id
+    LEFT JOIN users donor ON donor.user_id = r.donor_id
+    WHERE r.user_id IS NOT NULL AND r.status IN ('CONFIRMED', 'CLAIMED', 'PICKED_UP')
+'''
+
+_DONATION_COLUMNS = '''reservation_id, plate_id, restaurant_id, available_qty, title, description, price,
+    start_time, end_time, restaurant_name, created_at'''
+
+_DONATION_SELECT = '''
+    SELECT r.reservation_id, r.plate_id, p.restaurant_id, r.qty, p.title, p.description, p.price,
+           p.start_time, p.end_time, u.name, r.created_at
+    FROM reservations r
+    JOIN plates p ON p.plate_id = r.plate_id
+    JOIN users u ON u.user_id = p.restaurant_id
+    WHERE r.status = 'DONATED'
+'''
+
+
+def sync_reservations(cursor, reservation_ids=(), plate_ids=()):
+    """Re-derive the read-model rows for some reservations inside the caller's transaction.
+
+    Pass the ids of every reservation the transaction inserted or updated, or the
+    plate ids when the new reservation ids aren't known (multi-row inserts).
+    """
+    for column, ids in (('reservation_id', reservation_ids), ('plate_id', plate_ids)):
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            continue
+        placeholders = ','.join(['%s'] * len(ids))
+        if column == 'reservation_id':
+            owned = placeholders
+        else:
+            owned = f'SELECT reservation_id FROM reservations WHERE plate_id IN ({placeholders})'
+
+        cursor.execute(f'DELETE FROM order_history_rows WHERE reservation_id IN ({owned})', ids)
+        cursor.execute(f'DELETE FROM open_donation_rows WHERE reservation_id IN ({owned})', ids)
+        cursor.execute(f'''
+            INSERT INTO order_history_rows ({_HISTORY_COLUMNS})
+            {_HISTORY_SELECT.format(source='reservations')} AND r.{column} IN ({placeholders})
+        ''', ids)
+        cursor.execute(f'''
+            INSERT INTO open_donation_rows ({_DONATION_COLUMNS})
+            {_DONATION_SELECT} AND r.{column} IN ({placeholders})
+        ''', ids)
+
+
+def rename_user(user_id, name):
+    """Copy a changed display name into the read models on every shard.
+
+    A restaurant's name is also shown and searched with its plates, so the
+    shard that owns them records plate.updated for the ones still listed and
+    every worker's search index re-reads them.
+    """
+    for shard in shard_targets():
+        db = get_db(shard=shard)
+        cursor = db.cursor()
+        cursor.execute('UPDATE order_history_rows SET restaurant_name = %s WHERE restaurant_id = %s',
+                       (name, user_id))
+        cursor.execute('UPDATE order_history_rows SET donated_by = %s WHERE donor_id = %s', (name, user_id))
+        cursor.execute('UPDATE open_donation_rows SET restaurant_name = %s WHERE restaurant_id = %s',
+                       (name, user_id))
+        if db is get_db(restaurant_id=user_id):
+            cursor.execute('''
+                SELECT plate_id FROM plates
+                WHERE restaurant_id = %s AND is_active = 1 AND end_time > NOW()
+            ''', (user_id,))
+            record_events(cursor, [(PLATE_UPDATED, plate_id, None) for (plate_id,) in cursor.fetchall()])
+        db.commit()
+        cursor.close()
+
+
+def rebuild_read_models():
+    """Recreate both read models from the base tables on every shard.
+
+    Returns (history rows, open donation rows). History includes archived
+    reservations; donations whose pickup window has closed are left out.
+    """
+    history = donations = 0
+    for shard in shard_targets():
+        db = get_db(shard=shard)
+        cursor = db.cursor()
+        try:
+            cursor.execute('DELETE FROM order_history_rows')
+            cursor.execute(f'''
+                INSERT INTO order_history_rows ({_HISTORY_COLUMNS})
+                {_HISTORY_SELECT.format(source='reservations_all')}
+            ''')
+            history += cursor.rowcount
+            cursor.execute('DELETE FROM open_donation_rows')
+            cursor.execute(f'''
+                INSERT INTO open_donation_rows ({_DONATION_COLUMNS})
+                {_DONATION_SELECT} AND p.end_time >= NOW()
+            ''')
+            donations += cursor.rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+    return history, donations
+
+
+@job('read_models.rebuild')
+def _rebuild_job(payload):
+    rebuild_read_models()
+
+
+read_models_cli = AppGroup('read-models', help='Denormalized order-history and free-plates tables')
+
+
+@read_models_cli.command('rebuild')
+def rebuild_command():
+    """Recreate the read models from reservations, plates and users"""
+    history, donations = rebuild_read_models()
+    click.echo(f'Rebuilt {history} order history rows and {donations} open donations')
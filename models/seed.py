@@ -0,0 +1,368 @@
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+import mysql.connector
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+from models.database import get_db, init_db
+from models.ledger import rebuild_balances
+from models.read_models import rebuild_read_models
+
+COLUMNS = {
+    'users': ('user_id', 'email', 'password_hash', 'user_type', 'name', 'address', 'phone', 'created_at'),
+    'payment_info': ('user_id', 'card_number', 'card_holder', 'expiry_date', 'cvv'),
+    'plates': ('plate_id', 'restaurant_id', 'title', 'description', 'price', 'quantity_available',
+               'quantity_original', 'start_time', 'end_time', 'status', 'is_active', 'created_at'),
+    'reservations': ('reservation_id', 'user_id', 'donor_id', 'plate_id', 'qty', 'status', 'pickup_code',
+                     'created_at', 'confirmed_at', 'claimed_at'),
+    'transactions': ('transaction_id', 'payer_user_id', 'payee_restaurant_id', 'amount', 'type', 'created_at'),
+}
+
+# Relative weights of reservation statuses in generated data
+STATUS_WEIGHTS = {
+    'CONFIRMED': 20,
+    'PICKED_UP': 45,
+    'CANCELLED': 5,
+    'HELD': 3,
+    'DONATED': 7,
+    'CLAIMED': 20,
+}
+
+DISHES = ['Lasagna', 'Chicken Curry', 'Veggie Bowl', 'Beef Tacos', 'Pad Thai', 'Falafel Wrap',
+          'Mushroom Risotto', 'Bagel Box', 'Sushi Set', 'Lentil Soup', 'Fried Rice', 'Pasta Salad']
+STREETS = ['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr', 'Cedar Ln', 'Elm St', 'Lake Blvd', 'Hill Ct']
+
+
+class InsertLoader:
+    """Buffers rows per table and writes them as multi-row INSERTs"""
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.cursor = db.cursor()
+        self.batch_size = batch_size
+        self.buffers = {table: [] for table in COLUMNS}
+        self.counts = {table: 0 for table in COLUMNS}
+
+    def add(self, table, row):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table):
+        rows = self.buffers[table]
+        if not rows:
+            return
+        columns = COLUMNS[table]
+        placeholders = ', '.join(['%s'] * len(columns))
+        # mysql.connector rewrites executemany INSERTs into one multi-row statement
+        self.cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        self.db.commit()
+        self.counts[table] += len(rows)
+        self.buffers[table] = []
+
+    def finish(self):
+        for table in COLUMNS:
+            self.flush(table)
+        self.cursor.close()
+
+
+class InfileLoader:
+    """Writes rows to CSV files and bulk loads them with LOAD DATA LOCAL INFILE"""
+
+    def __init__(self, db, workdir):
+        self.db = db
+        self.workdir = workdir
+        self.files = {}
+        self.writers = {}
+        self.counts = {table: 0 for table in COLUMNS}
+        for table in COLUMNS:
+            path = os.path.join(workdir, f'{table}.csv')
+            handle = open(path, 'w', newline='', encoding='utf-8')
+            self.files[table] = handle
+            self.writers[table] = csv.writer(handle, lineterminator='\n')
+
+    def add(self, table, row):
+        self.writers[table].writerow(['\\N' if value is None else value for value in row])
+        self.counts[table] += 1
+
+    def finish(self):
+        cursor = self.db.cursor()
+        # Parents first so the data stays consistent if checks are ever left on
+        for table in ('users', 'payment_info', 'plates', 'reservations', 'transactions'):
+            handle = self.files[table]
+            handle.close()
+            cursor.execute(f'''
+                LOAD DATA LOCAL INFILE %s INTO TABLE {table}
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+                LINES TERMINATED BY '\\n'
+                ({', '.join(COLUMNS[table])})
+            ''', (handle.name,))
+            self.db.commit()
+        cursor.close()
+
+
+def scale_for(reservations):
+    """Derive row counts for every table from the number of reservations"""
+    plates = max(20, reservations // 8)
+    customers = max(20, reservations // 40)
+    return {
+        'reservations': reservations,
+        'plates': plates,
+        'restaurant': max(5, plates // 60),
+        'customer': customers,
+        'donner': max(5, customers // 10),
+        'needy': max(10, customers // 4),
+        'admin': 1,
+    }
+
+
+def _max_id(cursor, table, column):
+    cursor.execute(f'SELECT COALESCE(MAX({column}), 0) FROM {table}')
+    return cursor.fetchone()[0]
+
+
+def _pickup_code(rng):
+    return f'{rng.randrange(10**8):08d}'
+
+
+def generate(loader, scale, seed, now, id_base):
+    """Stream a consistent dataset into `loader`.
+
+    The same seed and `now` always produce the same rows. Plates are emitted last
+    because their quantity_available depends on the reservations generated for them.
+    """
+    rng = random.Random(seed)
+    password_hash = generate_password_hash('password')
+    next_user = id_base['users'] + 1
+
+    user_ids = {}
+    for user_type in ('admin', 'restaurant', 'customer', 'donner', 'needy'):
+        ids = []
+        for i in range(scale[user_type]):
+            user_id = next_user
+            next_user += 1
+            ids.append(user_id)
+            created = now - timedelta(days=rng.randint(30, 900), minutes=rng.randint(0, 1439))
+            name = f'{user_type.capitalize()} {user_id}'
+            address = f'{rng.randint(1, 9999)} {rng.choice(STREETS)}'
+            phone = f'555-{rng.randint(0, 9999):04d}'
+            loader.add('users', (user_id, f'{user_type}{user_id}@seed.wnk', password_hash, user_type,
+                                 name, address, phone, created))
+            if user_type in ('customer', 'donner'):
+                card = ''.join(str(rng.randint(0, 9)) for _ in range(16))
+                loader.add('payment_info', (user_id, card, name, f'{rng.randint(1, 12):02d}/{now.year + 3}',
+                                            f'{rng.randint(0, 999):03d}'))
+        user_ids[user_type] = ids
+
+    # Plate windows are fixed up front; quantities are filled in once reservations are known
+    plate_count = scale['plates']
+    first_plate = id_base['plates'] + 1
+    plate_restaurant = []
+    plate_price = []
+    plate_start = []
+    plate_end = []
+    plate_sold = [0] * plate_count
+    restaurants = user_ids['restaurant']
+    for i in range(plate_count):
+        # Mostly past windows, a slice open right now and a few upcoming
+        bucket = rng.random()
+        if bucket < 0.85:
+            start = now - timedelta(days=rng.randint(1, 365), hours=rng.randint(0, 12))
+        elif bucket < 0.95:
+            start = now - timedelta(hours=rng.randint(0, 5))
+        else:
+            start = now + timedelta(hours=rng.randint(1, 72))
+        plate_restaurant.append(rng.choice(restaurants))
+        plate_price.append(round(rng.uniform(0, 25), 2) if rng.random() > 0.05 else 0)
+        plate_start.append(start)
+        plate_end.append(start + timedelta(hours=rng.randint(2, 8)))
+
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    next_reservation = id_base['reservations'] + 1
+    next_transaction = id_base['transactions'] + 1
+    for _ in range(scale['reservations']):
+        index = rng.randrange(plate_count)
+        plate_id = first_plate + index
+        qty = rng.choice((1, 1, 1, 2, 2, 3))
+        status = rng.choices(statuses, weights)[0]
+        start, end = plate_start[index], plate_end[index]
+        created = min(now, start + (end - start) * rng.random())
+
+        user_id = donor_id = pickup_code = confirmed = claimed = None
+        if status in ('DONATED', 'CLAIMED'):
+            donor_id = rng.choice(user_ids['donner'])
+            confirmed = created
+            if status == 'CLAIMED':
+                user_id = rng.choice(user_ids['needy'])
+                pickup_code = _pickup_code(rng)
+                claimed = min(now, created + timedelta(minutes=rng.randint(1, 120)))
+        else:
+            user_id = rng.choice(user_ids['customer'])
+            if status != 'HELD':
+                pickup_code = _pickup_code(rng)
+                confirmed = created
+
+        loader.add('reservations', (next_reservation, user_id, donor_id, plate_id, qty, status,
+                                    pickup_code, created, confirmed, claimed))
+        next_reservation += 1
+
+        if status in ('HELD', 'CANCELLED'):
+            continue
+        plate_sold[index] += qty
+        payer = donor_id if donor_id else user_id
+        kind = 'DONATION_PURCHASE' if donor_id else 'CUSTOMER_PURCHASE'
+        loader.add('transactions', (next_transaction, payer, plate_restaurant[index],
+                                    round(plate_price[index] * qty, 2), kind, created))
+        next_transaction += 1
+
+    for index in range(plate_count):
+        available = rng.randint(0, 20)
+        original = plate_sold[index] + available
+        if plate_end[index] < now:
+            status = 'expired'
+        elif available == 0:
+            status = 'sold_out'
+        else:
+            status = 'active'
+        dish = rng.choice(DISHES)
+        loader.add('plates', (first_plate + index, plate_restaurant[index], dish,
+                              f'{dish} prepared today, packed for pickup', plate_price[index],
+                              available, original, plate_start[index], plate_end[index], status, 1,
+                              plate_start[index] - timedelta(hours=rng.randint(1, 24))))
+
+
+def _bulk_session(cursor, enable):
+    """Toggle per-session checks so the load skips FK lookups and unique-index probes"""
+    value = 1 if enable else 0
+    cursor.execute(f'SET foreign_key_checks = {value}')
+    cursor.execute(f'SET unique_checks = {value}')
+
+
+def _drop_secondary_keys(cursor):
+    """Drop the seeded tables' foreign keys and secondary indexes (MySQL only).
+
+    InnoDB ignores ALTER TABLE ... DISABLE KEYS, so a bulk load would otherwise
+    update every secondary index row by row. Returns the ALTER TABLE statements
+    that put them back, indexes before the foreign keys that need them.
+    """
+    tables = list(COLUMNS)
+    placeholders = ','.join(['%s'] * len(tables))
+    cursor.execute(f'''
+        SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})
+          AND REFERENCED_TABLE_NAME IS NOT NULL
+        ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+    ''', tables)
+    foreign_keys = {}
+    for table, name, column, referenced_table, referenced_column in cursor.fetchall():
+        columns, referenced = foreign_keys.setdefault((table, name), ([], []))
+        columns.append(f'`{column}`')
+        referenced.append((referenced_table, f'`{referenced_column}`'))
+
+    cursor.execute(f'''
+        SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME, SUB_PART
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders}) AND INDEX_NAME <> 'PRIMARY'
+        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+    ''', tables)
+    indexes = {}
+    for table, name, non_unique, column, sub_part in cursor.fetchall():
+        kind, columns = indexes.setdefault((table, name), ('INDEX' if non_unique else 'UNIQUE INDEX', []))
+        columns.append(f'`{column}`({sub_part})' if sub_part else f'`{column}`')
+
+    drops, adds, constraints = {}, {}, {}
+    for (table, name), (columns, referenced) in foreign_keys.items():
+        drops.setdefault(table, []).append(f'DROP FOREIGN KEY `{name}`')
+        constraints.setdefault(table, []).append(
+            f"ADD CONSTRAINT `{name}` FOREIGN KEY ({', '.join(columns)}) "
+            f"REFERENCES `{referenced[0][0]}` ({', '.join(column for _, column in referenced)})")
+    for (table, name), (kind, columns) in indexes.items():
+        drops.setdefault(table, []).append(f'DROP INDEX `{name}`')
+        adds.setdefault(table, []).append(f"ADD {kind} `{name}` ({', '.join(columns)})")
+
+    for table, clauses in drops.items():
+        cursor.execute(f"ALTER TABLE `{table}` {', '.join(clauses)}")
+    # With foreign_key_checks still off the constraints come back without re-validating every row
+    return ([f"ALTER TABLE `{table}` {', '.join(clauses)}" for table, clauses in adds.items()]
+            + [f"ALTER TABLE `{table}` {', '.join(clauses)}" for table, clauses in constraints.items()])
+
+
+@click.command('seed')
+@click.option('--reservations', default=10000, show_default=True, help='Number of reservations to generate.')
+@click.option('--seed', 'seed', default=42, show_default=True, help='Random seed for deterministic output.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per multi-row INSERT.')
+@click.option('--infile', is_flag=True, help='Load through CSV files and LOAD DATA LOCAL INFILE.')
+@with_appcontext
+def seed_command(reservations, seed, batch_size, infile):
+    """Generate a synthetic dataset at the requested scale"""
+    if infile and current_app.config['DB_BACKEND'] != 'mysql':
+        raise click.UsageError('--infile needs the MySQL backend')
+    if current_app.config['DB_SHARDS']:
+        raise click.UsageError('seed writes a single database; unset DB_SHARDS to seed')
+    init_db()
+    scale = scale_for(reservations)
+    # Hour precision keeps reruns with the same seed identical within the hour
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    if infile:
+        config = current_app.config
+        db = mysql.connector.connect(
+            host=config['MYSQL_HOST'],
+            user=config['MYSQL_USER'],
+            password=config['MYSQL_PASSWORD'],
+            database=config['MYSQL_DB'],
+            port=config['MYSQL_PORT'],
+            allow_local_infile=True
+        )
+    else:
+        db = get_db()
+
+    cursor = db.cursor()
+    id_base = {
+        'users': _max_id(cursor, 'users', 'user_id'),
+        'plates': _max_id(cursor, 'plates', 'plate_id'),
+        'reservations': _max_id(cursor, 'reservations', 'reservation_id'),
+        'transactions': _max_id(cursor, 'transactions', 'transaction_id'),
+    }
+    _bulk_session(cursor, enable=False)
+    # Secondary indexes are built once, sorted, after the load instead of row by row during it
+    restore = _drop_secondary_keys(cursor) if current_app.config['DB_BACKEND'] == 'mysql' else []
+
+    started = time.perf_counter()
+    try:
+        if infile:
+            with tempfile.TemporaryDirectory() as workdir:
+                loader = InfileLoader(db, workdir)
+                generate(loader, scale, seed, now, id_base)
+                loader.finish()
+        else:
+            loader = InsertLoader(db, batch_size)
+            generate(loader, scale, seed, now, id_base)
+            loader.finish()
+    finally:
+        for statement in restore:
+            cursor.execute(statement)
+        _bulk_session(cursor, enable=True)
+        cursor.close()
+        if infile:
+            db.close()
+
+    elapsed = time.perf_counter() - started
+    for table, count in loader.counts.items():
+        click.echo(f'{table}: {count} rows')
+    # Bulk loading bypasses the write paths that maintain the read models and balances
+    history, donations = rebuild_read_models()
+    click.echo(f'Read models: {history} order history rows, {donations} open donations')
+    click.echo(f'Balances: {rebuild_balances()} restaurants')
+    click.echo(f'Seeded in {elapsed:.1f}s (all generated users share the password "password")')
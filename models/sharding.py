@@ -0,0 +1,231 @@
+"""Region sharding keyed by restaurant.
+
+Each shard holds the plates of the restaurants assigned to it plus everything
+derived from them: reservations, transactions, balances, the change feed.
+Users live on the home database and are mirrored to every shard, so the
+existing shard-local joins against `users` keep working. Work that spans
+regions (browsing, order history, admin reports) is scatter-gathered.
+"""
+import heapq
+from collections import defaultdict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models.database import (get_db, stream_query, shard_targets, shard_of_id, shard_for_restaurant,
+                             cache_shard, is_sharded, home_target)
+
+USER_COLUMNS = ('user_id', 'email', 'password_hash', 'user_type', 'name', 'address', 'phone', 'created_at')
+
+
+def shard_names():
+    return list(shard_targets())
+
+
+def group_by_shard(ids):
+    """{shard: [ids]} for plate/reservation ids, preserving input order within each shard.
+
+    Ids outside every configured shard's range cannot exist and are dropped.
+    """
+    groups = defaultdict(list)
+    for entity_id in ids:
+        try:
+            groups[shard_of_id(entity_id)].append(entity_id)
+        except LookupError:
+            continue
+    return dict(groups)
+
+
+def fetch_by_id(sql, ids):
+    """Run sql on each shard owning some of the ids and return all rows as dicts.
+
+    `{ids}` in sql is replaced with that shard's placeholder list.
+    """
+    rows = []
+    for shard, shard_ids in group_by_shard(ids).items():
+        cursor = get_db(shard=shard).cursor(dictionary=True)
+        cursor.execute(sql.format(ids=','.join(['%s'] * len(shard_ids))), shard_ids)
+        rows.extend(cursor.fetchall())
+        cursor.close()
+    return rows
+
+
+def assign_restaurant(cursor, restaurant_id, shard=None):
+    """Record a new restaurant's shard using the caller's home-database cursor.
+
+    Without an explicit region, restaurants are spread round-robin by id.
+    """
+    names = shard_names()
+    if shard not in names:
+        shard = names[restaurant_id % len(names)]
+    cursor.execute('''
+        INSERT INTO shard_map (restaurant_id, shard) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE shard = VALUES(shard)
+    ''', (restaurant_id, shard))
+    cache_shard(restaurant_id, shard)
+    return shard
+
+
+def mirror_users(user_ids=None):
+    """Copy users rows from the home database to every shard (all users when user_ids is None).
+
+    Runs after the home transaction commits; `flask shards sync-users` repairs a
+    shard that missed an update.
+    """
+    if not is_sharded():
+        return 0
+    columns = ', '.join(USER_COLUMNS)
+    cursor = get_db().cursor()
+    if user_ids is None:
+        cursor.execute(f'SELECT {columns} FROM users')
+    else:
+        placeholders = ','.join(['%s'] * len(user_ids))
+        cursor.execute(f'SELECT {columns} FROM users WHERE user_id IN ({placeholders})', list(user_ids))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return 0
+
+    updates = ', '.join(f'{c} = VALUES({c})' for c in USER_COLUMNS[1:])
+    for shard, target in shard_targets().items():
+        if target == home_target():
+            continue
+        db = get_db(shard=shard)
+        cursor = db.cursor()
+        cursor.executemany(f'''
+            INSERT INTO users ({columns}) VALUES ({','.join(['%s'] * len(USER_COLUMNS))})
+            ON DUPLICATE KEY UPDATE {updates}
+        ''', rows)
+        db.commit()
+        cursor.close()
+    return len(rows)
+
+
+def scatter(sql, params=(), order_by=None, reverse=False):
+    """Run a read on every shard and return all rows as dicts, optionally re-sorted"""
+    rows = []
+    for shard in shard_names():
+        cursor = get_db(shard=shard).cursor(dictionary=True)
+        cursor.execute(sql, params)
+        rows.extend(cursor.fetchall())
+        cursor.close()
+    if order_by and is_sharded():
+        rows.sort(key=lambda row: _sort_key(row[order_by]), reverse=reverse)
+    return rows
+
+
+def _sort_key(value):
+    # NULLs sort first ascending and last descending, as in MySQL
+    return (value is not None, value)
+
+
+class MergedStream:
+    """Several per-shard RowStreams, each already ordered, merged into one ordered stream"""
+
+    def __init__(self, streams, order_by, reverse=False):
+        self._streams = streams
+        self._order_by = order_by
+        self._reverse = reverse
+
+    def prefetch(self):
+        for stream in self._streams:
+            stream.prefetch()
+        return self
+
+    def __bool__(self):
+        return any(bool(stream) for stream in self._streams)
+
+    def __iter__(self):
+        key = lambda row: _sort_key(getattr(row, self._order_by))
+        return heapq.merge(*self._streams, key=key, reverse=self._reverse)
+
+
+def scatter_stream(sql, params=(), order_by=None, reverse=False):
+    """stream_query across every shard; the query's ORDER BY must match order_by/reverse"""
+    if not is_sharded():
+        return stream_query(sql, params)
+    return MergedStream([stream_query(sql, params, shard=shard) for shard in shard_names()],
+                        order_by, reverse)
+
+
+def gather(sql, params=(), group_by=None, sums=(), maxes=()):
+    """Scatter-gather an aggregate report, re-aggregating per-shard groups.
+
+    Rows with the same group_by value are combined by adding the `sums` columns and
+    taking the largest `maxes` columns. Unsharded, the query simply streams.
+    """
+    if not is_sharded():
+        return stream_query(sql, params)
+    merged = {}
+    for row in scatter(sql, params):
+        key = row[group_by]
+        if key not in merged:
+            merged[key] = row
+            continue
+        total = merged[key]
+        for column in sums:
+            total[column] = (total[column] or 0) + (row[column] or 0)
+        for column in maxes:
+            if row[column] is not None and (total[column] is None or row[column] > total[column]):
+                total[column] = row[column]
+    return list(merged.values())
+
+
+def init_sharding(app):
+    if not app.config['DB_SHARDS']:
+        return
+    with app.app_context():
+        names = shard_names()
+    if len(names) != len(set(names)) or not all(names):
+        raise RuntimeError('DB_SHARDS needs unique name=database pairs')
+    if app.config['FREE_PLATE_ALLOCATION'] == 'batch':
+        # The allocator matches requests against all donations in one transaction
+        raise RuntimeError('FREE_PLATE_ALLOCATION=batch requires an unsharded deployment')
+
+
+shards_cli = AppGroup('shards', help='Region shards')
+
+
+@shards_cli.command('list')
+def list_command():
+    """Show each shard with its restaurant and plate counts"""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT shard, COUNT(*) FROM shard_map GROUP BY shard')
+    restaurants = dict(cursor.fetchall())
+    cursor.close()
+    for shard, target in shard_targets().items():
+        cursor = get_db(shard=shard).cursor()
+        cursor.execute('SELECT COUNT(*) FROM plates')
+        plates = cursor.fetchone()[0]
+        cursor.close()
+        click.echo(f'{shard:<16}{target:<32}restaurants={restaurants.get(shard, 0)}\tplates={plates}')
+
+
+@shards_cli.command('sync-users')
+def sync_users_command():
+    """Copy every user from the home database to all shards"""
+    click.echo(f'Mirrored {mirror_users()} users')
+
+
+@shards_cli.command('assign')
+@click.argument('restaurant_id', type=int)
+@click.argument('shard')
+def assign_command(restaurant_id, shard):
+    """Move a restaurant that has no plates yet to another shard"""
+    if shard not in shard_names():
+        raise click.BadParameter(f'unknown shard; known: {", ".join(shard_names())}', param_hint='SHARD')
+    cursor = get_db(restaurant_id=restaurant_id).cursor()
+    cursor.execute('SELECT COUNT(*) FROM plates WHERE restaurant_id = %s', (restaurant_id,))
+    if cursor.fetchone()[0]:
+        raise click.ClickException('restaurant already has plates on '
+                                   f'{shard_for_restaurant(restaurant_id)}; moving data between shards is not supported')
+    cursor.close()
+    db = get_db()
+    cursor = db.cursor()
+    assign_restaurant(cursor, restaurant_id, shard)
+    db.commit()
+    cursor.close()
+    click.echo(f'Restaurant {restaurant_id} -> {shard}')
+    click.echo('Running workers pick this up within '
+               f"{current_app.config['SHARD_MAP_CACHE_SECONDS']:g}s, when their cached entry expires")
@@ -0,0 +1,313 @@
+"""Embedded SQLite backend for single-node deployments.
+
+Connections look like mysql.connector connections to the rest of the app:
+cursor(dictionary=True) / cursor(named_tuple=True), %s placeholders, commit and
+rollback. MySQL-only SQL is rewritten on the fly by translate(), so blueprints
+and init_db keep a single dialect.
+"""
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+# Connection-level tuning; journal_mode=WAL is persistent and set once per file
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA mmap_size = 268435456',
+)
+
+_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?')
+
+# --- SQL translation -----------------------------------------------------
+
+_STRING_OR_PLACEHOLDER = re.compile(r"'(?:[^'\\]|\\.)*'|%s")
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE(?:\s+SKIP\s+LOCKED|\s+NOWAIT)?', re.IGNORECASE)
+_INSERT_IGNORE = re.compile(r'\bINSERT\s+IGNORE\b', re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE)
+_VALUES_FN = re.compile(r'\bVALUES\((\w+)\)', re.IGNORECASE)
+_DATE_ARITH = re.compile(
+    r'\bDATE_(SUB|ADD)\(\s*([\w.]+(?:\(\))?)\s*,\s*INTERVAL\s+(\d+|\?)\s+(DAY|HOUR|MINUTE|SECOND)\s*\)',
+    re.IGNORECASE)
+_REPLACE_VIEW = re.compile(r'^\s*CREATE\s+OR\s+REPLACE\s+VIEW\s+(\w+)', re.IGNORECASE)
+_CREATE_TABLE = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+_AUTO_PK = re.compile(r'\b(?:BIG)?INT\s+PRIMARY\s+KEY\s+AUTO_INCREMENT\b', re.IGNORECASE)
+_ENUM = re.compile(r'\bENUM\s*\([^)]*\)', re.IGNORECASE)
+_ON_UPDATE_TS = re.compile(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP\b', re.IGNORECASE)
+_DEFAULT_TS = re.compile(r'\bDEFAULT\s+CURRENT_TIMESTAMP\b', re.IGNORECASE)
+_INLINE_INDEX = re.compile(
+    r',\s*(FULLTEXT\s+(?:INDEX|KEY)|SPATIAL\s+(?:INDEX|KEY)|UNIQUE\s+(?:INDEX|KEY)|INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)',
+    re.IGNORECASE)
+_SET_FK_CHECKS = re.compile(r'^\s*SET\s+foreign_key_checks\s*=\s*(\d)', re.IGNORECASE)
+_NO_OP = re.compile(r'^\s*SET\s', re.IGNORECASE)
+_TRUNCATE = re.compile(r'^\s*TRUNCATE\s+(?:TABLE\s+)?(\w+)', re.IGNORECASE)
+_AUTO_INCREMENT_START = re.compile(r'^\s*ALTER\s+TABLE\s+(\w+)\s+AUTO_INCREMENT\s*=\s*(\d+)\s*$', re.IGNORECASE)
+_READ_ONLY = ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN')
+
+_UNITS = {'DAY': 'days', 'HOUR': 'hours', 'MINUTE': 'minutes', 'SECOND': 'seconds'}
+
+
+def _placeholders(sql):
+    return _STRING_OR_PLACEHOLDER.sub(lambda m: '?' if m.group(0) == '%s' else m.group(0), sql)
+
+
+def _date_arith(match):
+    op, base, amount, unit = match.groups()
+    base = "'now', 'localtime'" if base.upper() == 'NOW()' else base
+    sign = '-' if op.upper() == 'SUB' else '+'
+    if amount == '?':
+        # A bound amount: build the modifier string at run time
+        return f"datetime({base}, '{sign}' || ? || ' {_UNITS[unit.upper()]}')"
+    return f"datetime({base}, '{sign}{amount} {_UNITS[unit.upper()]}')"
+
+
+def _create_table(sql, table):
+    """Rewrite MySQL column types and pull inline indexes out into CREATE INDEX statements"""
+    sql = _AUTO_PK.sub('INTEGER PRIMARY KEY AUTOINCREMENT', sql)
+    sql = _ENUM.sub('TEXT', sql)
+    sql = _ON_UPDATE_TS.sub('', sql)
+    indexes = []
+    for kind, name, columns in _INLINE_INDEX.findall(sql):
+        kind = kind.upper()
+        if kind.startswith(('FULLTEXT', 'SPATIAL')):
+            # No SQLite equivalent; search and geo code fall back to plain indexes/scans
+            continue
+        unique = 'UNIQUE ' if kind.startswith('UNIQUE') else ''
+        indexes.append(f'CREATE {unique}INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+    sql = _INLINE_INDEX.sub('', sql)
+    return (sql, *indexes)
+
+
+@lru_cache(maxsize=2048)
+def translate(sql):
+    """Rewrite one MySQL statement for SQLite.
+
+    Returns (statements, takes_write_lock). A statement may expand to several
+    (CREATE TABLE with inline indexes) or to none (session SETs).
+    """
+    fk = _SET_FK_CHECKS.match(sql)
+    if fk:
+        return (f"PRAGMA foreign_keys = {'ON' if fk.group(1) == '1' else 'OFF'}",), False
+    if _NO_OP.match(sql):
+        return (), False
+    if re.match(r'^\s*LOAD\s+DATA', sql, re.IGNORECASE):
+        # A DatabaseError like any other failed statement; seed --infile refuses SQLite up front
+        raise sqlite3.NotSupportedError('LOAD DATA is not available on the SQLite backend')
+
+    start = _AUTO_INCREMENT_START.match(sql)
+    if start:
+        # Like MySQL, only ever raise the counter
+        table, seq = start.group(1), int(start.group(2)) - 1
+        return (f"UPDATE sqlite_sequence SET seq = MAX(seq, {seq}) WHERE name = '{table}'",
+                f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}', {seq} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}')"), True
+
+    locking = bool(_FOR_UPDATE.search(sql))
+    sql = _FOR_UPDATE.sub('', sql)
+    sql = _placeholders(sql)
+    sql = _INSERT_IGNORE.sub('INSERT OR IGNORE', sql)
+    sql = _DATE_ARITH.sub(_date_arith, sql)
+    sql = _DEFAULT_TS.sub("DEFAULT (datetime('now', 'localtime'))", sql)
+
+    duplicate = _ON_DUPLICATE.search(sql)
+    if duplicate:
+        head, tail = sql[:duplicate.start()], sql[duplicate.end():]
+        sql = head + 'ON CONFLICT DO UPDATE SET' + _VALUES_FN.sub(r'excluded.\1', tail)
+
+    truncate = _TRUNCATE.match(sql)
+    if truncate:
+        sql = f'DELETE FROM {truncate.group(1)}'
+
+    view = _REPLACE_VIEW.match(sql)
+    if view:
+        name = view.group(1)
+        return (f'DROP VIEW IF EXISTS {name}', _REPLACE_VIEW.sub(f'CREATE VIEW {name}', sql)), True
+
+    table = _CREATE_TABLE.match(sql)
+    if table:
+        return _create_table(sql, table.group(1)), True
+
+    keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return (sql,), locking or keyword not in _READ_ONLY
+
+
+# --- Functions MySQL provides and SQLite does not --------------------------
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _curdate():
+    return date.today().isoformat()
+
+
+def _year(value):
+    return int(str(value)[:4]) if value else None
+
+
+def _adapt_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(Decimal, str)
+
+
+def _convert(value):
+    # Timestamps are stored as text; hand them back as datetimes like mysql.connector does
+    if isinstance(value, str) and _DATETIME_RE.fullmatch(value):
+        return datetime.fromisoformat(value)
+    return value
+
+
+# --- Connection and cursor wrappers ----------------------------------------
+
+_wal_enabled = set()
+_writer_locks = {}
+_writer_locks_guard = threading.Lock()
+
+
+def _writer_lock(path):
+    """One writer at a time per database file within this process"""
+    with _writer_locks_guard:
+        return _writer_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False, named_tuple=False):
+        self._connection = connection
+        self._cursor = connection._raw.cursor()
+        self._dictionary = dictionary
+        self._named_tuple = named_tuple
+        self._row_type = None
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        statements, writes = translate(operation)
+        if writes:
+            self._connection._begin()
+        self._row_type = None
+        if len(statements) == 1:
+            self._cursor.execute(statements[0], tuple(params or ()))
+        else:
+            # Expanded DDL never takes parameters
+            for statement in statements:
+                self._cursor.execute(statement)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        statements, writes = translate(operation)
+        if writes:
+            self._connection._begin()
+        for statement in statements:
+            self._cursor.executemany(statement, [tuple(p) for p in seq_params])
+
+    def _row(self, row):
+        values = [_convert(v) for v in row]
+        if self._dictionary:
+            return dict(zip(self.column_names, values))
+        if self._named_tuple:
+            if self._row_type is None:
+                self._row_type = namedtuple('Row', self.column_names, rename=True)
+            return self._row_type(*values)
+        return tuple(values)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Single-writer connection: writes take BEGIN IMMEDIATE plus a process-wide lock,
+    reads run in autocommit against the WAL so they never wait for the writer"""
+
+    def __init__(self, path, timeout):
+        self._raw = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                                    check_same_thread=False)
+        self._timeout = timeout
+        self._lock = _writer_lock(path)
+        self._in_transaction = False
+        for pragma in PRAGMAS:
+            self._raw.execute(pragma)
+        self._raw.create_function('NOW', 0, _now)
+        self._raw.create_function('CURDATE', 0, _curdate)
+        self._raw.create_function('YEAR', 1, _year, deterministic=True)
+
+    def _begin(self):
+        if self._in_transaction:
+            return
+        if not self._lock.acquire(timeout=self._timeout):
+            raise sqlite3.OperationalError('database is locked')
+        try:
+            self._raw.execute('BEGIN IMMEDIATE')
+        except Exception:
+            self._lock.release()
+            raise
+        self._in_transaction = True
+
+    def _end(self, statement):
+        if not self._in_transaction:
+            return
+        try:
+            self._raw.execute(statement)
+        finally:
+            self._in_transaction = False
+            self._lock.release()
+
+    def cursor(self, dictionary=False, named_tuple=False, **kwargs):
+        return SQLiteCursor(self, dictionary=dictionary, named_tuple=named_tuple)
+
+    def commit(self):
+        self._end('COMMIT')
+
+    def rollback(self):
+        self._end('ROLLBACK')
+
+    def close(self):
+        self.rollback()
+        self._raw.close()
+
+
+def connect(config, path=None):
+    path = path or config['SQLITE_PATH']
+    if path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = SQLiteConnection(path, config['SQLITE_BUSY_TIMEOUT'])
+    if path != ':memory:' and path not in _wal_enabled:
+        # Stored in the database file, so once per process is enough
+        connection._raw.execute('PRAGMA journal_mode = WAL')
+        _wal_enabled.add(path)
+    return connection
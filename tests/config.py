@@ -0,0 +1,32 @@
+"""Settings applied on top of config.Config for the test suite"""
+
+# Per-endpoint query budgets enforced by models.query_log.assert_query_budget.
+# Cart, checkout and checkout-confirm budgets hold for any cart size, so a
+# per-item query loop fails them.
+QUERY_BUDGETS = {
+    'customer.marketplace': 4,
+    'customer.free_plates': 3,
+    'customer.cart': 1,
+    'customer.checkout': 1,
+    'customer.confirm_order': 11,
+    'customer.claim_selected_plates': 11,
+    'customer.order_history': 1,
+    'restaurant.dashboard': 2,
+    'auth.login': 1,
+    'auth.profile': 2,
+}
+
+# Identical statements repeated this many times in one request are flagged as N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+TEST_CONFIG = {
+    'TESTING': True,
+    'DB_SHARDS': '',
+    'WARM_UP': False,
+    # No background profiler sync thread issuing queries during the budget tests
+    'PROFILER_POLL_SECONDS': 0,
+    # Feed events are visible to the search index as soon as they commit
+    'FEED_SETTLE_SECONDS': 0,
+    'QUERY_BUDGETS': QUERY_BUDGETS,
+    'N_PLUS_ONE_THRESHOLD': N_PLUS_ONE_THRESHOLD,
+}
@@ -0,0 +1,78 @@
+import os
+
+import mysql.connector
+import pytest
+
+from app import create_app
+from config import Config
+from models.database import init_db
+from tests.config import TEST_CONFIG
+from tests.helpers import user_client
+
+
+def _create_app(**config):
+    app = create_app()
+    app.config.update(TEST_CONFIG, **config)
+    # Replay the change feed on every request, so listings show up at once and budgets count it
+    app.extensions['plate_index'].refresh_seconds = 0
+    with app.app_context():
+        init_db()
+    return app
+
+
+def _fresh_mysql_database(name):
+    """Drop and re-create the MySQL test database; skip when no server is reachable"""
+    try:
+        db = mysql.connector.connect(host=Config.MYSQL_HOST, user=Config.MYSQL_USER,
+                                     password=Config.MYSQL_PASSWORD, port=Config.MYSQL_PORT)
+    except mysql.connector.Error as e:
+        pytest.skip(f'MySQL is not reachable: {e}')
+    cursor = db.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS `{name}`')
+    cursor.execute(f'CREATE DATABASE `{name}`')
+    cursor.close()
+    db.close()
+
+
+@pytest.fixture
+def app(tmp_path):
+    return _create_app(DB_BACKEND='sqlite', SQLITE_PATH=str(tmp_path / 'wnk.sqlite3'))
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    return _create_app(DB_BACKEND='sqlite', SQLITE_PATH=str(tmp_path / 'home.sqlite3'),
+                       DB_SHARDS=f"west={tmp_path / 'west.sqlite3'},east={tmp_path / 'east.sqlite3'}")
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def backend_app(request, tmp_path):
+    """An app on each backend. MySQL runs when TEST_MYSQL_DB names a scratch database
+    (wiped per test) on MYSQL_HOST, with the usual MYSQL_* credentials."""
+    if request.param == 'sqlite':
+        return _create_app(DB_BACKEND='sqlite', SQLITE_PATH=str(tmp_path / 'wnk.sqlite3'))
+    database = os.environ.get('TEST_MYSQL_DB')
+    if not database:
+        pytest.skip('set TEST_MYSQL_DB to run against MySQL')
+    _fresh_mysql_database(database)
+    return _create_app(DB_BACKEND='mysql', MYSQL_DB=database)
+
+
+@pytest.fixture
+def restaurant(app):
+    return user_client(app, 'restaurant@example.com', 'restaurant')
+
+
+@pytest.fixture
+def customer(app):
+    return user_client(app, 'customer@example.com', 'customer')
+
+
+@pytest.fixture
+def donor(app):
+    return user_client(app, 'donor@example.com', 'donner')
+
+
+@pytest.fixture
+def needy(app):
+    return user_client(app, 'needy@example.com', 'needy')
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from models.database import get_db
+
+PASSWORD = 'pw'
+
+
+def register(client, email, user_type, **fields):
+    data = dict(email=email, password=PASSWORD, confirm_password=PASSWORD, user_type=user_type,
+                name=email, address='1 Main St', phone='555', card_holder='Card Holder',
+                card_number='4111111111111111', expiry_date='12/2030', cvv='123')
+    data.update(fields)
+    response = client.post('/register', data=data, follow_redirects=True)
+    assert b'Registration successful' in response.data
+    return response
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': PASSWORD}, follow_redirects=True)
+    assert response.status_code == 200
+    return response
+
+
+def user_client(app, email, user_type):
+    """A test client registered and logged in as a new user"""
+    client = app.test_client()
+    register(client, email, user_type)
+    login(client, email)
+    return client
+
+
+def admin_client(app, email='admin@example.com'):
+    """A test client logged in as an admin; admins can't register through the site"""
+    execute(app, '''
+        INSERT INTO users (email, password_hash, user_type, name, address)
+        VALUES (%s, %s, 'admin', 'Admin', '1 Main St')
+    ''', (email, generate_password_hash(PASSWORD)))
+    client = app.test_client()
+    login(client, email)
+    return client
+
+
+def create_listing(client, title, price='5.00', quantity=10, starts_in=-5, ends_in=120):
+    """Post a listing as the logged-in restaurant; times are minutes from now"""
+    now = datetime.now()
+    fmt = '%Y-%m-%dT%H:%M'
+    response = client.post('/restaurant/create-listing', data=dict(
+        title=title, description=f'{title} description', price=price, quantity=quantity,
+        start_time=(now + timedelta(minutes=starts_in)).strftime(fmt),
+        end_time=(now + timedelta(minutes=ends_in)).strftime(fmt),
+    ))
+    assert response.status_code == 302
+    return response
+
+
+def fill_cart(client, plate_ids, qty=1):
+    for plate_id in plate_ids:
+        client.post('/add-to-cart', data={'plate_id': plate_id, 'qty': qty})
+
+
+def fill_needy_cart(client, reservation_ids, qty=1):
+    for reservation_id in reservation_ids:
+        client.post('/add-to-needy-cart', data={'reservation_id': reservation_id, 'qty': qty})
+
+
+def hold_admission(controller, keys):
+    """Hold slots for keys on another thread until the returned event is set"""
+    held, release = threading.Event(), threading.Event()
+
+    def run():
+        with controller.admit(keys):
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert held.wait(5)
+    return release, thread
+
+
+def query(app, sql, params=()):
+    """Rows of one statement against the test database"""
+    with app.app_context():
+        cursor = get_db().cursor(dictionary=True)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def execute(app, sql, params=()):
+    """Run and commit one statement against the test database"""
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        db.commit()
+        cursor.close()
+
+
+def plate_ids(app):
+    return [row['plate_id'] for row in query(app, 'SELECT plate_id FROM plates ORDER BY plate_id')]
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from app.admission import BUSY_MESSAGE, AdmissionController, AdmissionRejected
+from models.query_log import capture_queries
+from tests.helpers import create_listing, fill_cart, hold_admission, plate_ids, query
+
+
+def test_waiter_is_admitted_when_the_slot_frees():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait=5)
+    release, thread = hold_admission(controller, ['plate-1'])
+    threading.Timer(0.05, release.set).start()
+
+    started = time.monotonic()
+    with controller.admit(['plate-1']):
+        assert time.monotonic() - started >= 0.04
+    thread.join()
+    assert controller._slots == {}
+
+
+def test_waiter_gives_up_at_the_deadline():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait=0.05)
+    release, thread = hold_admission(controller, ['plate-1'])
+    with pytest.raises(AdmissionRejected):
+        with controller.admit(['plate-1']):
+            pass
+    release.set()
+    thread.join()
+    # Nothing is left queued or held once both requests are gone
+    assert controller._slots == {}
+
+
+def test_full_queue_rejects_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, max_wait=5)
+    release, thread = hold_admission(controller, ['plate-1'])
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected):
+        with controller.admit(['plate-1']):
+            pass
+    assert time.monotonic() - started < 1
+    release.set()
+    thread.join()
+
+
+def test_keys_are_taken_in_sorted_order_and_released_on_rejection():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait=0.05)
+    release, thread = hold_admission(controller, ['b'])
+    with pytest.raises(AdmissionRejected):
+        with controller.admit(['b', 'a']):
+            pass
+    # 'a' was taken first and handed back when 'b' timed out
+    assert 'a' not in controller._slots
+    release.set()
+    thread.join()
+
+    # Opposite key orders can't deadlock each other
+    controller.max_wait = 5
+    done = []
+
+    def admit(keys):
+        for _ in range(50):
+            with controller.admit(keys):
+                pass
+        done.append(keys)
+
+    threads = [threading.Thread(target=admit, args=(keys,)) for keys in (['a', 'b'], ['b', 'a'])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert len(done) == 2
+
+
+def test_busy_plate_turns_checkout_away_and_lets_the_retry_through(app, restaurant, customer):
+    create_listing(restaurant, 'Paella')
+    plate_id = plate_ids(app)[0]
+    controller = app.extensions['admission']
+    controller.max_concurrent, controller.max_wait = 1, 0.05
+    fill_cart(customer, [plate_id])
+
+    release, thread = hold_admission(controller, [('plate', plate_id)])
+    response = customer.post('/confirm-order', follow_redirects=True)
+    assert response.request.path == '/cart'
+    assert BUSY_MESSAGE.encode() in response.data
+    assert query(app, 'SELECT * FROM reservations') == []
+    release.set()
+    thread.join()
+
+    response = customer.post('/confirm-order', follow_redirects=True)
+    assert b'Order confirmed!' in response.data
+    assert controller._slots == {}
+
+
+def test_sold_out_cart_is_rejected_before_taking_locks(app, restaurant, customer):
+    create_listing(restaurant, 'Paella', quantity=1)
+    fill_cart(customer, plate_ids(app), qty=2)
+
+    with capture_queries(app) as log:
+        response = customer.post('/confirm-order', follow_redirects=True)
+    assert BUSY_MESSAGE.encode() in response.data
+    assert not any('FOR UPDATE' in record.normalized for record in log)
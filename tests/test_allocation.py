@@ -0,0 +1,89 @@
+import pytest
+
+from models import allocation
+from models.allocation import allocate, run_allocation_batch
+from models.change_feed import RESERVATION_CLAIMED
+from tests.helpers import create_listing, execute, plate_ids, query, user_client
+
+
+def test_allocate_round_robin_one_plate_per_round():
+    requests = [(1, 'a', 2), (2, 'b', 2), (3, 'c', 1)]
+    grants = allocate(requests, [(10, 3)], {})
+    # Three plates go one each before anyone gets a second
+    assert sorted(grants) == [('a', 10, 1), ('b', 10, 1), ('c', 10, 1)]
+
+
+def test_allocate_favours_fewest_claimed_today_then_first_seen():
+    requests = [(1, 'a', 1), (2, 'b', 1), (3, 'c', 1)]
+    # 'a' asked first but already has a plate today; 'b' and 'c' tie and 'b' asked first
+    assert allocate(requests, [(10, 1)], {'a': 1}) == [('b', 10, 1)]
+    assert sorted(allocate(requests, [(10, 2)], {'a': 1})) == [('b', 10, 1), ('c', 10, 1)]
+
+
+def test_allocate_respects_daily_limit_and_inventory_order():
+    requests = [(1, 'a', 2), (2, 'a', 1), (3, 'b', 2)]
+    grants = allocate(requests, [(10, 1), (11, 5)], {'b': 1})
+    # 'a' is capped at the daily limit, 'b' has one plate left today
+    assert sorted(grants) == [('a', 10, 1), ('a', 11, 1), ('b', 11, 1)]
+
+
+@pytest.fixture
+def donations(app, restaurant, donor):
+    create_listing(restaurant, 'Soup', quantity=10)
+    plate_id = plate_ids(app)[0]
+    donor_id = query(app, "SELECT user_id FROM users WHERE user_type = 'donner'")[0]['user_id']
+    execute(app, '''
+        INSERT INTO reservations (donor_id, plate_id, qty, status) VALUES (%s, %s, 3, 'DONATED')
+    ''', (donor_id, plate_id))
+    return plate_id
+
+
+def _request(app, user_id, qty, created_at=None):
+    if created_at is None:
+        execute(app, 'INSERT INTO claim_requests (user_id, qty) VALUES (%s, %s)', (user_id, qty))
+    else:
+        execute(app, 'INSERT INTO claim_requests (user_id, qty, created_at) VALUES (%s, %s, %s)',
+                (user_id, qty, created_at))
+
+
+def _user_id(app, email):
+    return query(app, 'SELECT user_id FROM users WHERE email = %s', (email,))[0]['user_id']
+
+
+def test_batch_allocates_and_expires_yesterdays_requests(app, donations):
+    user_client(app, 'first@example.com', 'needy')
+    user_client(app, 'second@example.com', 'needy')
+    first, second = _user_id(app, 'first@example.com'), _user_id(app, 'second@example.com')
+    _request(app, first, 2, created_at='2000-01-01 12:00:00')
+    _request(app, second, 2)
+
+    with app.app_context():
+        assert run_allocation_batch() == 2
+
+    statuses = [row['status'] for row in query(app, 'SELECT status FROM claim_requests ORDER BY request_id')]
+    assert statuses == ['EXPIRED', 'FILLED']
+    claimed = query(app, "SELECT user_id, qty FROM reservations WHERE status = 'CLAIMED'")
+    assert [(row['user_id'], row['qty']) for row in claimed] == [(second, 2)]
+    assert query(app, "SELECT qty FROM reservations WHERE status = 'DONATED'")[0]['qty'] == 1
+
+
+def test_batch_is_one_transaction(app, donations, monkeypatch):
+    user_client(app, 'first@example.com', 'needy')
+    user_client(app, 'second@example.com', 'needy')
+    _request(app, _user_id(app, 'first@example.com'), 2, created_at='2000-01-01 12:00:00')
+    _request(app, _user_id(app, 'second@example.com'), 2)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('read model sync failed')
+
+    monkeypatch.setattr(allocation, 'sync_reservations', fail)
+    with app.app_context(), pytest.raises(RuntimeError):
+        run_allocation_batch()
+
+    # Nothing from the failed batch stuck, the expiry included
+    statuses = [row['status'] for row in query(app, 'SELECT status FROM claim_requests ORDER BY request_id')]
+    assert statuses == ['PENDING', 'PENDING']
+    reservations = query(app, 'SELECT status, qty FROM reservations')
+    assert [(row['status'], row['qty']) for row in reservations] == [('DONATED', 3)]
+    assert query(app, 'SELECT COUNT(*) AS n FROM change_feed WHERE event_type = %s',
+                 (RESERVATION_CLAIMED,))[0]['n'] == 0
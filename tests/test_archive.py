@@ -0,0 +1,40 @@
+from models.archive import archive_closed
+from tests.helpers import admin_client, create_listing, execute, fill_cart, fill_needy_cart, plate_ids, query
+
+
+def test_finished_rows_move_to_the_archive_and_stay_reportable(app, restaurant, customer, donor, needy):
+    create_listing(restaurant, 'Brisket')
+    create_listing(restaurant, 'Cornbread')
+    brisket, cornbread = plate_ids(app)
+    fill_cart(customer, [brisket])
+    customer.post('/confirm-order')
+    fill_cart(donor, [cornbread])
+    donor.post('/confirm-order')
+    donation = query(app, "SELECT reservation_id FROM reservations WHERE status = 'DONATED'")[0]['reservation_id']
+    fill_needy_cart(needy, [donation])
+    needy.post('/claim-selected-plates')
+
+    # Both orders finished two days ago
+    execute(app, "UPDATE reservations SET status = 'PICKED_UP' WHERE status = 'CONFIRMED'")
+    execute(app, '''
+        UPDATE reservations SET created_at = DATE_SUB(NOW(), INTERVAL 2 DAY),
+               confirmed_at = DATE_SUB(NOW(), INTERVAL 2 DAY), claimed_at = DATE_SUB(NOW(), INTERVAL 2 DAY)
+    ''')
+    execute(app, 'UPDATE transactions SET created_at = DATE_SUB(NOW(), INTERVAL 2 DAY)')
+
+    with app.app_context():
+        # One row per chunk exercises the chunk loop
+        assert archive_closed(horizon_days=1, chunk_size=1) == (2, 2)
+
+    assert query(app, 'SELECT * FROM reservations') == []
+    assert query(app, 'SELECT * FROM transactions') == []
+    assert len(query(app, 'SELECT * FROM reservations_archive')) == 2
+    assert len(query(app, 'SELECT * FROM reservations_all')) == 2
+    assert len(query(app, 'SELECT * FROM transactions_all')) == 2
+
+    # Reports that cover finished orders read the archive through the *_all views
+    admin = admin_client(app)
+    year = query(app, 'SELECT claimed_at FROM reservations_archive WHERE claimed_at IS NOT NULL')[0]['claimed_at'].year
+    assert b'Cornbread' in admin.get('/admin/dashboard?report_type=donor_purchases').get_data()
+    assert b'needy@example.com' in admin.get(f'/admin/dashboard?report_type=free_plates&year={year}').get_data()
+    assert b'donor@example.com' in admin.get(f'/admin/dashboard?report_type=tax_report&year={year}').get_data()
@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from app.assets import DIST_DIR, MANIFEST, asset_url, brotli, load_manifest
+
+CSS = b'body { color: #333; }\n' * 50
+
+
+@pytest.fixture
+def built(app, tmp_path):
+    """The app serving a static folder with one stylesheet and one image, built with `flask assets build`"""
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'style.css').write_bytes(CSS)
+    (static / 'logo.png').write_bytes(b'\x89PNG not really')
+    app.static_folder = str(static)
+
+    result = app.test_cli_runner().invoke(args=['assets', 'build'])
+    assert result.exit_code == 0, result.output
+    load_manifest(app)
+    return app
+
+
+def test_build_writes_fingerprinted_files_and_manifest(built):
+    dist = os.path.join(built.static_folder, DIST_DIR)
+    with open(os.path.join(dist, MANIFEST)) as handle:
+        manifest = json.load(handle)
+
+    css = manifest['css/style.css']
+    assert css['path'].startswith('css/style.') and css['path'].endswith('.css')
+    assert 'gzip' in css['encodings']
+    with open(os.path.join(dist, css['path'] + '.gz'), 'rb') as handle:
+        assert gzip.decompress(handle.read()) == CSS
+    # Images are already compressed
+    assert manifest['logo.png']['encodings'] == []
+
+
+def test_asset_url_falls_back_to_static(built):
+    with built.test_request_context():
+        path = built.extensions['asset_manifest']['css/style.css']['path']
+        assert asset_url('css/style.css') == f'/assets/{path}'
+        assert asset_url('js/missing.js') == '/static/js/missing.js'
+
+
+def test_serve_negotiates_precompressed_variant(built):
+    client = built.test_client()
+    with built.test_request_context():
+        url = asset_url('css/style.css')
+
+    plain = client.get(url)
+    assert plain.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == CSS
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'br, gzip'})
+    assert compressed.status_code == 200
+    # Without the brotli package only the .gz variant is built
+    expected = 'br' if brotli is not None else 'gzip'
+    assert compressed.headers['Content-Encoding'] == expected
+    if expected == 'gzip':
+        assert gzip.decompress(compressed.data) == CSS
+
+    for response in (plain, compressed):
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.cache_control.immutable
+        assert response.cache_control.public
+        assert response.cache_control.max_age == 365 * 24 * 3600
+
+
+def test_serve_rejects_unfingerprinted_names(built):
+    assert built.test_client().get('/assets/css/style.css').status_code == 404
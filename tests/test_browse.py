@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from app.browse import BrowseApp
+from tests.helpers import create_listing, fill_cart, plate_ids
+
+
+def _request(browse, method, path, query=b'', headers=()):
+    """Drive one http request through the ASGI callable; returns (status, headers, body)"""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(name.encode(), value.encode()) for name, value in headers]}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(browse(scope, receive, send))
+    start, body = sent
+    return (start['status'], {name.decode(): value.decode() for name, value in start['headers']},
+            body['body'])
+
+
+@pytest.fixture
+def browse(app):
+    browse = BrowseApp(app, threads=2, max_queue=4)
+    yield browse
+    browse.executor.shutdown()
+
+
+def _session_cookie(client):
+    return ('Cookie', f"session={client.get_cookie('session').value}")
+
+
+def test_only_browse_reads_are_served(browse):
+    assert _request(browse, 'GET', '/healthz')[0] == 200
+    assert _request(browse, 'GET', '/cart')[0] == 404
+    assert _request(browse, 'POST', '/marketplace')[0] == 404
+    assert _request(browse, 'GET', '/no-such-page')[0] == 404
+
+
+def test_full_queue_is_shed_with_retry_after(browse):
+    browse._pending = browse.max_queue
+    status, headers, _ = _request(browse, 'GET', '/healthz')
+    assert status == 503
+    assert headers['retry-after'] == '1'
+
+    browse._pending = browse.max_queue - 1
+    assert _request(browse, 'GET', '/healthz')[0] == 200
+
+
+def test_streamed_page_gets_a_length_and_head_gets_no_body(app, browse, restaurant, customer):
+    create_listing(restaurant, 'Gnocchi')
+    fill_cart(customer, plate_ids(app))
+    customer.post('/confirm-order')
+    cookie = _session_cookie(customer)
+
+    # Order history streams under WSGI; here it is read in full first
+    assert 'Content-Length' not in customer.get('/order-history').headers
+    status, headers, body = _request(browse, 'GET', '/order-history', headers=[cookie])
+    assert status == 200
+    assert b'Gnocchi' in body
+    assert headers['content-length'] == str(len(body))
+
+    status, headers, body = _request(browse, 'HEAD', '/order-history', headers=[cookie])
+    assert status == 200
+    assert body == b''
+    assert int(headers['content-length']) > 0
+
+
+def test_lifespan_starts_and_stops(app):
+    browse = BrowseApp(app, threads=1, max_queue=1)
+    messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(browse({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert app.extensions['startup'].ready
@@ -0,0 +1,19 @@
+from models.change_feed import PLATE_CREATED, head_seq, read_events, record_events
+from models.database import get_db
+
+
+def test_unsettled_events_are_held_back(app):
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        record_events(cursor, [(PLATE_CREATED, 1, None), (PLATE_CREATED, 2, None)])
+        db.commit()
+        cursor.close()
+
+        app.config['FEED_SETTLE_SECONDS'] = 60
+        assert read_events(0) == []
+        assert head_seq() == 0
+
+        app.config['FEED_SETTLE_SECONDS'] = 0
+        assert [event['plate_id'] for event in read_events(0)] == [1, 2]
+        assert head_seq() == 2
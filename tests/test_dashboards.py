@@ -0,0 +1,38 @@
+from models.database import get_db
+from tests.helpers import admin_client, create_listing
+
+
+def test_restaurant_dashboard_streams_listings(restaurant):
+    create_listing(restaurant, 'Ramen')
+
+    response = restaurant.get('/restaurant/dashboard')
+    assert response.status_code == 200
+    assert b'Ramen' in response.get_data()
+
+
+def test_restaurant_dashboard_database_error_redirects(app, restaurant):
+    # The query fails before the streamed page starts, so the view can still redirect
+    with app.app_context():
+        db = get_db()
+        db.cursor().execute('DROP TABLE plates')
+        db.commit()
+
+    response = restaurant.get('/restaurant/dashboard', follow_redirects=True)
+    assert response.request.path == '/'
+    assert b'Error loading dashboard' in response.data
+
+
+def test_member_lookup_database_error_is_not_a_partial_page(app, customer):
+    client = admin_client(app)
+    response = client.get('/admin/dashboard?report_type=member_lookup&search_query=customer')
+    assert response.status_code == 200
+    assert b'customer@example.com' in response.get_data()
+
+    with app.app_context():
+        db = get_db()
+        db.cursor().execute('ALTER TABLE users RENAME COLUMN phone TO phone_number')
+        db.commit()
+
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    response = client.get('/admin/dashboard?report_type=member_lookup&search_query=customer')
+    assert response.status_code == 500
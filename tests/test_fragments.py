@@ -0,0 +1,20 @@
+from tests.helpers import create_listing, fill_cart, plate_ids
+
+# The slot markers plate cards used to split on, typed into a listing
+FORGED = 'Pie \x00bogus\x00 \x00qty\x00'
+
+
+def test_plate_text_cannot_forge_card_slots(app, restaurant, customer, donor, needy):
+    create_listing(restaurant, FORGED)
+    for _ in range(2):
+        # Second view is served from the fragment cache
+        response = customer.get('/marketplace')
+        assert response.status_code == 200
+        assert b'bogus' in response.data
+
+    fill_cart(donor, plate_ids(app))
+    donor.post('/confirm-order')
+    for _ in range(2):
+        response = needy.get('/free-plates')
+        assert response.status_code == 200
+        assert b'bogus' in response.data
@@ -0,0 +1,131 @@
+from models.change_feed import PLATE_UPDATED
+from models.database import get_db, shard_targets
+from models.geo import geocode_many, load_lookup, lookup_keys
+from tests.helpers import create_listing, login, query, register, user_client
+
+CENTER = (39.78, -89.65)
+# Roughly 1, 4 and 20 km due north of CENTER
+NEARBY = (('Near', 0.009), ('Middle', 0.036), ('Far', 0.18))
+
+
+def _restaurant(app, name, latitude='', longitude='', address='1 Main St'):
+    client = app.test_client()
+    email = f'{name.lower()}@example.com'
+    register(client, email, 'restaurant', name=name, address=address,
+             latitude=str(latitude), longitude=str(longitude))
+    login(client, email)
+    return client
+
+
+def _search(client, **params):
+    response = client.get('/api/plates', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_radius_search_returns_nearest_first(app, customer):
+    for name, offset in NEARBY:
+        create_listing(_restaurant(app, name, CENTER[0] + offset, CENTER[1]), f'{name} stew')
+
+    results = _search(customer, lat=CENTER[0], lng=CENTER[1], radius=5)
+    assert [plate['title'] for plate in results['plates']] == ['Near stew', 'Middle stew']
+    assert [round(plate['distance_km']) for plate in results['plates']] == [1, 4]
+    # Each radius counts every plate within it, whichever radius is selected
+    assert results['facets']['distance'] == [[2, 1], [5, 2], [10, 2], [25, 3]]
+
+    results = _search(customer, lat=CENTER[0], lng=CENTER[1], radius=25)
+    assert [plate['title'] for plate in results['plates']] == ['Near stew', 'Middle stew', 'Far stew']
+
+    # Without a position nothing is filtered out and no distances are given
+    results = _search(customer)
+    assert len(results['plates']) == 3
+    assert all(plate['distance_km'] is None for plate in results['plates'])
+
+
+def test_addresses_fall_back_to_less_specific_lookup_keys(app):
+    assert lookup_keys('12 Main St.,  Springfield, IL 62701') == [
+        '12 main st, springfield, il 62701', 'springfield, il 62701', 'il 62701', '62701']
+
+    with app.app_context():
+        load_lookup([('Springfield, IL 62701', 39.8, -89.6), ('62702', 39.7, -89.7)])
+        located = geocode_many(['12 Main St, Springfield, IL 62701', '9 Elm St, Nowhere, IL 62702',
+                                'Somewhere else'])
+    assert located == {'12 Main St, Springfield, IL 62701': (39.8, -89.6),
+                       '9 Elm St, Nowhere, IL 62702': (39.7, -89.7)}
+
+
+def test_near_home_uses_the_geocoded_address(app):
+    with app.app_context():
+        load_lookup([('Springfield, IL 62701', *CENTER)])
+    create_listing(_restaurant(app, 'Near', CENTER[0] + 0.009, CENTER[1]), 'Near stew')
+    create_listing(_restaurant(app, 'Far', CENTER[0] + 0.18, CENTER[1]), 'Far stew')
+    client = app.test_client()
+    register(client, 'home@example.com', 'customer', address='3 Oak St, Springfield, IL 62701')
+    login(client, 'home@example.com')
+
+    results = _search(client, near='home', radius=5)
+    assert [plate['title'] for plate in results['plates']] == ['Near stew']
+
+
+def _location(app, restaurant_id):
+    rows = query(app, 'SELECT latitude, longitude, source FROM restaurant_locations WHERE restaurant_id = %s',
+                 (restaurant_id,))
+    return rows[0] if rows else None
+
+
+def _plate_updates(app):
+    return query(app, 'SELECT COUNT(*) AS n FROM change_feed WHERE event_type = %s', (PLATE_UPDATED,))[0]['n']
+
+
+def test_profile_only_relocates_when_the_position_changes(app):
+    address = '12 Main St, Springfield, IL 62701'
+    with app.app_context():
+        load_lookup([('Springfield, IL 62701', *CENTER)])
+    client = _restaurant(app, 'Bistro', address=address)
+    create_listing(client, 'Soup')
+    restaurant_id = query(app, "SELECT user_id FROM users WHERE user_type = 'restaurant'")[0]['user_id']
+    assert _location(app, restaurant_id)['source'] == 'geocoded'
+
+    def update(**fields):
+        data = dict(name='Bistro', address=address, phone='555', latitude='', longitude='')
+        data.update(fields)
+        client.post('/profile', data=data)
+
+    # Same address, no typed-in position: nothing to re-index
+    updates = _plate_updates(app)
+    update()
+    assert _plate_updates(app) == updates
+
+    # A typed-in position wins and re-indexes the restaurant's plates
+    update(latitude='40.0', longitude='-89.0')
+    location = _location(app, restaurant_id)
+    assert (location['latitude'], location['longitude'], location['source']) == (40.0, -89.0, 'manual')
+    assert _plate_updates(app) == updates + 1
+
+    # Clearing it goes back to the geocoded address
+    update()
+    location = _location(app, restaurant_id)
+    assert (location['latitude'], location['longitude'], location['source']) == (*CENTER, 'geocoded')
+
+    # An unknown address clears the position
+    address = 'Nowhere'
+    update()
+    assert _location(app, restaurant_id) is None
+
+
+def test_locations_are_mirrored_to_every_shard(sharded_app):
+    client = _restaurant(sharded_app, 'Bistro', *CENTER)
+    create_listing(client, 'Soup')
+    restaurant_id = query(sharded_app, "SELECT user_id FROM users WHERE user_type = 'restaurant'")[0]['user_id']
+
+    with sharded_app.app_context():
+        for shard in [None, *shard_targets()]:
+            cursor = get_db(shard=shard).cursor()
+            cursor.execute('SELECT latitude, longitude FROM restaurant_locations WHERE restaurant_id = %s',
+                           (restaurant_id,))
+            assert cursor.fetchall() == [CENTER]
+            cursor.close()
+
+    customer = user_client(sharded_app, 'customer@example.com', 'customer')
+    results = _search(customer, lat=CENTER[0], lng=CENTER[1], radius=2)
+    assert [plate['title'] for plate in results['plates']] == ['Soup']
@@ -0,0 +1,93 @@
+import json
+import threading
+
+from app.admission import BUSY_MESSAGE
+from app.idempotency import STILL_PROCESSING_MESSAGE
+from tests.helpers import create_listing, execute, fill_cart, hold_admission, plate_ids, query
+
+
+def _confirm(client, key):
+    return client.post('/confirm-order', data={'idempotency_key': key}, follow_redirects=True)
+
+
+def _customer_id(app):
+    return query(app, "SELECT user_id FROM users WHERE user_type = 'customer'")[0]['user_id']
+
+
+def test_duplicate_submission_replays_the_first_result(app, restaurant, customer):
+    create_listing(restaurant, 'Curry')
+    fill_cart(customer, plate_ids(app), qty=2)
+
+    first = _confirm(customer, 'order-1')
+    assert b'Order confirmed!' in first.data
+    second = _confirm(customer, 'order-1')
+    assert second.request.path == first.request.path
+    assert b'Order confirmed!' in second.data
+
+    assert [row['qty'] for row in query(app, 'SELECT qty FROM reservations')] == [2]
+    assert query(app, 'SELECT quantity_available FROM plates')[0]['quantity_available'] == 8
+
+
+def test_concurrent_duplicate_waits_for_the_original(app, restaurant, customer):
+    create_listing(restaurant, 'Curry')
+    user_id = _customer_id(app)
+    # The original is still in flight in another worker
+    execute(app, '''
+        INSERT INTO idempotency_keys (user_id, idem_key, endpoint, status)
+        VALUES (%s, 'order-1', 'customer.confirm_order', 'PENDING')
+    ''', (user_id,))
+
+    def finish():
+        execute(app, '''
+            UPDATE idempotency_keys SET status = 'DONE', location = '/order-history', result = %s
+            WHERE user_id = %s AND idem_key = 'order-1'
+        ''', (json.dumps({'flashes': [['success', 'Order confirmed!']], 'session': {'cart': None}}), user_id))
+
+    timer = threading.Timer(0.1, finish)
+    timer.start()
+    fill_cart(customer, plate_ids(app))
+    response = _confirm(customer, 'order-1')
+    timer.join()
+
+    assert response.request.path == '/order-history'
+    assert b'Order confirmed!' in response.data
+    # The duplicate never ran the view; the original's session change cleared the cart
+    assert query(app, 'SELECT * FROM reservations') == []
+    with customer.session_transaction() as session:
+        assert 'cart' not in session
+
+
+def test_duplicate_gives_up_while_the_original_is_still_running(app, restaurant, customer):
+    create_listing(restaurant, 'Curry')
+    app.config['IDEMPOTENCY_WAIT_SECONDS'] = 0.05
+    execute(app, '''
+        INSERT INTO idempotency_keys (user_id, idem_key, endpoint, status)
+        VALUES (%s, 'order-1', 'customer.confirm_order', 'PENDING')
+    ''', (_customer_id(app),))
+    fill_cart(customer, plate_ids(app))
+
+    response = _confirm(customer, 'order-1')
+    assert response.request.path == '/cart'
+    assert STILL_PROCESSING_MESSAGE.encode() in response.data
+    assert query(app, 'SELECT * FROM reservations') == []
+
+
+def test_retry_after_busy_rejection_runs_again(app, restaurant, customer):
+    create_listing(restaurant, 'Curry')
+    plate_id = plate_ids(app)[0]
+    controller = app.extensions['admission']
+    controller.max_concurrent, controller.max_wait = 1, 0.05
+    fill_cart(customer, [plate_id])
+
+    release, thread = hold_admission(controller, [('plate', plate_id)])
+    response = _confirm(customer, 'order-1')
+    assert BUSY_MESSAGE.encode() in response.data
+    # The rejection isn't stored, so it can't be replayed
+    assert query(app, 'SELECT * FROM idempotency_keys') == []
+    release.set()
+    thread.join()
+
+    response = _confirm(customer, 'order-1')
+    assert b'Order confirmed!' in response.data
+    assert len(query(app, 'SELECT * FROM reservations')) == 1
+    assert query(app, 'SELECT status FROM idempotency_keys')[0]['status'] == 'DONE'
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import jobs
+from models.database import get_db
+from models.jobs import PRIORITY_HIGH, PRIORITY_LOW, claim, enqueue, requeue_stale, run
+from tests.helpers import execute, query
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """A recording handler and one that always raises"""
+    calls = []
+
+    def fail(payload):
+        raise RuntimeError('handler failed')
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test.record', calls.append)
+    monkeypatch.setitem(jobs.HANDLERS, 'test.fail', fail)
+    return calls
+
+
+def _enqueue(app, kind, **options):
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        job_id = enqueue(cursor, kind, **options)
+        db.commit()
+        cursor.close()
+    return job_id
+
+
+def _job(app, job_id):
+    return query(app, 'SELECT * FROM jobs WHERE job_id = %s', (job_id,))[0]
+
+
+def test_claim_takes_due_jobs_highest_priority_first(app, handlers):
+    low = _enqueue(app, 'test.record', priority=PRIORITY_LOW)
+    high = _enqueue(app, 'test.record', priority=PRIORITY_HIGH)
+    _enqueue(app, 'test.record', delay_seconds=3600)
+
+    with app.app_context():
+        claimed = claim('worker-1', limit=5)
+        assert [j['job_id'] for j in claimed] == [high, low]
+        assert [j['attempts'] for j in claimed] == [1, 1]
+        # Claimed jobs aren't handed to anyone else
+        assert claim('worker-2', limit=5) == []
+
+    row = _job(app, high)
+    assert (row['status'], row['attempts'], row['locked_by']) == ('RUNNING', 1, 'worker-1')
+
+
+def test_run_records_success(app, handlers):
+    job_id = _enqueue(app, 'test.record', payload={'n': 1})
+    with app.app_context():
+        assert run(claim('worker-1')[0]) is True
+    assert handlers == [{'n': 1}]
+    row = _job(app, job_id)
+    assert row['status'] == 'DONE' and row['finished_at'] is not None and row['locked_by'] is None
+
+
+def test_failing_job_backs_off_then_fails_after_max_attempts(app, handlers):
+    app.config['JOB_RETRY_BASE_SECONDS'] = 60
+    job_id = _enqueue(app, 'test.fail', max_attempts=2)
+
+    with app.app_context():
+        assert run(claim('worker-1')[0]) is False
+    row = _job(app, job_id)
+    assert row['status'] == 'QUEUED' and 'handler failed' in row['last_error']
+    # First retry waits the base delay, give or take the jitter
+    delay = (datetime.fromisoformat(str(row['run_after'])) - datetime.now()).total_seconds()
+    assert 25 <= delay <= 91
+    with app.app_context():
+        assert claim('worker-1') == []
+
+    execute(app, 'UPDATE jobs SET run_after = %s WHERE job_id = %s',
+            (datetime.now() - timedelta(seconds=1), job_id))
+    with app.app_context():
+        retry = claim('worker-1')[0]
+        assert retry['attempts'] == 2
+        assert run(retry) is False
+    row = _job(app, job_id)
+    assert row['status'] == 'FAILED' and row['finished_at'] is not None
+    with app.app_context():
+        assert claim('worker-1') == []
+
+
+def test_requeue_stale_only_touches_expired_locks(app, handlers):
+    stale = _enqueue(app, 'test.record')
+    fresh = _enqueue(app, 'test.record')
+    with app.app_context():
+        claim('worker-1', limit=2)
+    execute(app, 'UPDATE jobs SET locked_at = %s WHERE job_id = %s',
+            (datetime.now() - timedelta(minutes=10), stale))
+
+    with app.app_context():
+        assert requeue_stale(lock_timeout=60) == 1
+    assert _job(app, stale)['status'] == 'QUEUED'
+    assert _job(app, fresh)['status'] == 'RUNNING'
+
+
+def test_coalesce_skips_while_a_job_is_waiting(app, handlers):
+    first = _enqueue(app, 'test.record', coalesce=True)
+    assert first is not None
+    assert _enqueue(app, 'test.record', coalesce=True) is None
+
+    # Once the waiting job is running, the next trigger queues a new one
+    with app.app_context():
+        claim('worker-1')
+    assert _enqueue(app, 'test.record', coalesce=True) not in (None, first)
+    assert len(query(app, 'SELECT * FROM jobs')) == 2
+
+
+def test_enqueue_rolls_back_with_the_callers_transaction(app, handlers):
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("UPDATE users SET name = 'changed'")
+        enqueue(cursor, 'test.record')
+        db.rollback()
+        cursor.close()
+    assert query(app, 'SELECT * FROM jobs') == []
+
+
+def test_claim_request_and_its_allocation_job_commit_together(app, needy):
+    app.config['FREE_PLATE_ALLOCATION'] = 'batch'
+    needy.post('/request-free-plates', data={'qty': 1})
+    assert len(query(app, 'SELECT * FROM claim_requests')) == 1
+    assert [row['kind'] for row in query(app, 'SELECT kind FROM jobs')] == ['allocation.run']
+
+    # When the job can't be queued, the request doesn't stick either
+    execute(app, 'DROP TABLE jobs')
+    response = needy.post('/request-free-plates', data={'qty': 1}, follow_redirects=True)
+    assert b'Error requesting plates' in response.data
+    assert len(query(app, 'SELECT * FROM claim_requests')) == 1
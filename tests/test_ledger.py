@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+from tests.helpers import create_listing, fill_cart, plate_ids, query
+
+
+def test_balance_credits_match_transactions_exactly(app, restaurant, customer):
+    # Prices whose float products don't round-trip: 0.1 * 3 != 0.3
+    for title, price in (('Tea', '0.10'), ('Scone', '0.20'), ('Jam', '0.70')):
+        create_listing(restaurant, title, price=price)
+    fill_cart(customer, plate_ids(app), qty=3)
+    customer.post('/confirm-order')
+
+    amounts = [Decimal(str(row['amount'])) for row in query(app, 'SELECT amount FROM transactions')]
+    assert amounts == [Decimal('0.30'), Decimal('0.60'), Decimal('2.10')]
+    balance = query(app, 'SELECT balance, lifetime_total FROM restaurant_balances')[0]
+    assert Decimal(str(balance['balance'])) == sum(amounts) == Decimal('3.00')
+    assert Decimal(str(balance['lifetime_total'])) == Decimal('3.00')
+
+
+def test_seed_rebuilds_balances(app):
+    result = app.test_cli_runner().invoke(args=['seed', '--reservations', '200'])
+    assert result.exit_code == 0, result.output
+    assert 'Balances:' in result.output
+
+    earned = query(app, '''
+        SELECT payee_restaurant_id AS restaurant_id, SUM(amount) AS total FROM transactions
+        GROUP BY payee_restaurant_id ORDER BY payee_restaurant_id
+    ''')
+    balances = query(app, 'SELECT restaurant_id, lifetime_total FROM restaurant_balances ORDER BY restaurant_id')
+    assert earned
+    assert [(row['restaurant_id'], round(row['total'], 2)) for row in earned] == \
+        [(row['restaurant_id'], round(row['lifetime_total'], 2)) for row in balances]
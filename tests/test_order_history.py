@@ -0,0 +1,24 @@
+from models.database import get_db
+from tests.helpers import create_listing, fill_cart, plate_ids
+
+
+def test_order_history_streams_orders(app, restaurant, customer):
+    create_listing(restaurant, 'Lasagna')
+    fill_cart(customer, plate_ids(app))
+    customer.post('/confirm-order')
+
+    response = customer.get('/order-history')
+    assert response.status_code == 200
+    assert b'Lasagna' in response.get_data()
+
+
+def test_order_history_database_error_redirects(app, customer):
+    # The query fails before the streamed page starts, so the view can still redirect
+    with app.app_context():
+        db = get_db()
+        db.cursor().execute('DROP TABLE order_history_rows')
+        db.commit()
+
+    response = customer.get('/order-history', follow_redirects=True)
+    assert response.request.path == '/marketplace'
+    assert b'Error loading order history' in response.data
@@ -0,0 +1,47 @@
+import time
+
+from app.profiler import (SamplingProfiler, collapsed_stacks, current_session, profiled_requests,
+                          start_session, stop_session)
+
+
+def test_session_reaches_every_worker_and_samples_add_up(app):
+    with app.app_context():
+        workers = [SamplingProfiler(app), SamplingProfiler(app)]
+        session_id = start_session(percent=100, duration=30, interval=0.001)
+        for worker in workers:
+            worker.sync()
+            assert worker.active and worker.session_id == session_id
+
+        for worker in workers:
+            # Sample this thread as if it were serving a request
+            worker.end(worker.begin(), {'endpoint': 'customer.marketplace', 'pid': 1})
+            worker.begin()
+            time.sleep(0.05)
+            worker.end(session_id, {'endpoint': 'customer.cart', 'pid': 1})
+            worker.flush()
+
+        stacks = collapsed_stacks(session_id).splitlines()
+        assert stacks and all('test_profiler.py:' in line for line in stacks)
+        session = current_session()
+        assert session['running'] and session['samples'] == sum(int(line.rsplit(' ', 1)[1]) for line in stacks)
+        assert [r['endpoint'] for r in profiled_requests(session_id)] == ['customer.marketplace', 'customer.cart'] * 2
+
+        stop_session()
+        for worker in workers:
+            worker.sync()
+            assert not worker.active
+        assert not current_session()['running']
+
+
+def test_new_session_drops_old_samples(app):
+    with app.app_context():
+        worker = SamplingProfiler(app)
+        first = start_session()
+        worker.sync()
+        worker.end(worker.begin(), {'endpoint': 'customer.cart', 'pid': 1})
+        worker.flush()
+
+        second = start_session()
+        worker.sync()
+        assert worker.session_id == second
+        assert profiled_requests(first) == []
@@ -0,0 +1,108 @@
+"""Per-endpoint query budgets (tests/config.py) for the hot customer paths.
+
+Checkout, confirm and claim are measured with one and with several items: the
+budget is the same for both, so a query issued per cart item fails it.
+"""
+import pytest
+
+from models.query_log import assert_query_budget
+from tests.helpers import create_listing, fill_cart, fill_needy_cart, plate_ids, query
+
+CART_SIZES = (1, 5)
+
+
+@pytest.fixture
+def listings(app, restaurant):
+    for i in range(max(CART_SIZES)):
+        create_listing(restaurant, f'Dish {i}', quantity=10)
+    return plate_ids(app)
+
+
+@pytest.fixture
+def donations(app, donor, listings):
+    """Two open donations: one of two plates (claimed in part), one of a single plate"""
+    fill_cart(donor, listings[:1], qty=2)
+    fill_cart(donor, listings[1:2], qty=1)
+    donor.post('/confirm-order')
+    return [row['reservation_id'] for row in query(app, '''
+        SELECT reservation_id FROM reservations WHERE status = 'DONATED' ORDER BY reservation_id
+    ''')]
+
+
+def test_marketplace(customer, listings):
+    response, _ = assert_query_budget(customer, 'GET', '/marketplace')
+    assert b'Dish 4' in response.data
+
+
+@pytest.mark.parametrize('path', ['/cart', '/checkout'])
+def test_cart_pages_do_not_scale_with_cart_size(customer, listings, path):
+    counts = []
+    for size in CART_SIZES:
+        with customer.session_transaction() as sess:
+            sess['cart'] = []
+        fill_cart(customer, listings[:size])
+        response, log = assert_query_budget(customer, 'GET', path)
+        assert b'Dish 0' in response.data
+        counts.append(len(log))
+    assert counts[0] == counts[-1]
+
+
+@pytest.mark.parametrize('size', CART_SIZES)
+def test_confirm_order(app, customer, listings, size):
+    fill_cart(customer, listings[:size], qty=2)
+    response, _ = assert_query_budget(customer, 'POST', '/confirm-order')
+    assert response.status_code == 302
+
+    reservations = query(app, "SELECT plate_id, qty, pickup_code FROM reservations WHERE status = 'CONFIRMED'")
+    assert sorted(row['plate_id'] for row in reservations) == listings[:size]
+    assert all(row['qty'] == 2 and row['pickup_code'] for row in reservations)
+    stock = query(app, 'SELECT quantity_available FROM plates WHERE plate_id IN (%s)' % ','.join(['%s'] * size),
+                  listings[:size])
+    assert [row['quantity_available'] for row in stock] == [8] * size
+    assert len(query(app, 'SELECT * FROM order_history_rows')) == size
+
+
+@pytest.mark.parametrize('size', CART_SIZES)
+def test_donation_confirm_order(app, donor, listings, size):
+    fill_cart(donor, listings[:size])
+    assert_query_budget(donor, 'POST', '/confirm-order')
+    assert len(query(app, 'SELECT * FROM open_donation_rows')) == size
+
+
+def test_confirm_order_rejects_short_stock(app, customer, listings):
+    fill_cart(customer, listings[:2], qty=11)
+    response = customer.post('/confirm-order', follow_redirects=True)
+    assert response.request.path == '/cart'
+    assert query(app, 'SELECT * FROM reservations') == []
+    assert {row['quantity_available'] for row in query(app, 'SELECT quantity_available FROM plates')} == {10}
+
+
+def test_claim_selected_plates(app, needy, donations):
+    fill_needy_cart(needy, donations)
+    response, _ = assert_query_budget(needy, 'POST', '/claim-selected-plates')
+    assert response.status_code == 302
+
+    claimed = query(app, "SELECT plate_id, qty, pickup_code FROM reservations WHERE status = 'CLAIMED'")
+    assert len(claimed) == 2 and all(row['pickup_code'] for row in claimed)
+    # The two-plate donation was split: one plate is still open
+    assert [row['qty'] for row in query(app, "SELECT qty FROM reservations WHERE status = 'DONATED'")] == [1]
+    assert len(query(app, 'SELECT * FROM open_donation_rows')) == 1
+
+
+@pytest.mark.parametrize('user, path', [
+    ('needy', '/free-plates'),
+    ('customer', '/order-history'),
+    ('restaurant', '/restaurant/dashboard'),
+    ('customer', '/profile'),
+])
+def test_read_pages(request, donations, user, path):
+    client = request.getfixturevalue(user)
+    response, _ = assert_query_budget(client, 'GET', path)
+    assert response.status_code == 200
+
+
+def test_login(app, customer):
+    client = app.test_client()
+    response, _ = assert_query_budget(client, 'POST', '/login',
+                                      data={'email': 'customer@example.com', 'password': 'pw'})
+    assert response.status_code == 302
@@ -0,0 +1,11 @@
+from tests.helpers import create_listing
+
+
+def test_restaurant_rename_reaches_the_search_index(app, restaurant, customer):
+    create_listing(restaurant, 'Pad Thai')
+    assert b'Pad Thai' in customer.get('/marketplace?q=restaurant').data
+
+    restaurant.post('/profile', data={'name': 'Noodle Bar', 'address': '1 Main St', 'phone': '555'})
+
+    assert b'Pad Thai' in customer.get('/marketplace?q=noodle').data
+    assert b'Pad Thai' not in customer.get('/marketplace?q=restaurant').data
@@ -0,0 +1,38 @@
+import time
+
+from models.database import get_db, shard_for_restaurant
+
+
+def test_unassigned_restaurant_is_not_pinned_to_the_default_shard(sharded_app):
+    with sharded_app.app_context():
+        assert shard_for_restaurant(42) == 'west'
+
+        # Another worker assigns the restaurant after this one looked it up
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO shard_map (restaurant_id, shard) VALUES (42, 'east')")
+        db.commit()
+        cursor.close()
+
+        assert shard_for_restaurant(42) == 'east'
+
+
+def test_reassignment_reaches_workers_when_their_cache_expires(sharded_app):
+    sharded_app.config['SHARD_MAP_CACHE_SECONDS'] = 0.05
+    result = sharded_app.test_cli_runner().invoke(args=['shards', 'assign', '42', 'west'])
+    assert result.exit_code == 0, result.output
+    assert 'Running workers pick this up within 0.05s' in result.output
+
+    with sharded_app.app_context():
+        assert shard_for_restaurant(42) == 'west'
+
+        # `flask shards assign` run from another process
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("UPDATE shard_map SET shard = 'east' WHERE restaurant_id = 42")
+        db.commit()
+        cursor.close()
+
+        assert shard_for_restaurant(42) == 'west'
+        time.sleep(0.06)
+        assert shard_for_restaurant(42) == 'east'
@@ -0,0 +1,43 @@
+"""The main customer, donor and needy flows end to end, once per database backend"""
+import pytest
+
+from tests.helpers import create_listing, fill_cart, fill_needy_cart, plate_ids, query
+
+
+@pytest.fixture
+def app(backend_app):
+    return backend_app
+
+
+def test_checkout_and_order_history(app, restaurant, customer):
+    create_listing(restaurant, 'Ramen', quantity=5)
+    create_listing(restaurant, 'Gyoza', quantity=5)
+    fill_cart(customer, plate_ids(app), qty=2)
+    assert b'Gyoza' in customer.get('/checkout').data
+
+    response = customer.post('/confirm-order', follow_redirects=True)
+    assert b'Order confirmed! 2 item(s) ordered.' in response.data
+    assert [row['quantity_available'] for row in query(app, 'SELECT quantity_available FROM plates')] == [3, 3]
+
+    history = customer.get('/order-history').get_data()
+    codes = [row['pickup_code'] for row in query(app, "SELECT pickup_code FROM reservations WHERE status = 'CONFIRMED'")]
+    assert len(codes) == 2
+    assert all(code.encode() in history for code in codes)
+    assert b'Ramen' in history and b'Gyoza' in history
+
+
+def test_donate_claim_and_order_history(app, restaurant, donor, needy):
+    create_listing(restaurant, 'Lentil Soup')
+    fill_cart(donor, plate_ids(app), qty=2)
+    donor.post('/confirm-order')
+    assert b'Lentil Soup' in needy.get('/free-plates').data
+
+    donation = query(app, "SELECT reservation_id FROM reservations WHERE status = 'DONATED'")[0]['reservation_id']
+    fill_needy_cart(needy, [donation])
+    response = needy.post('/claim-selected-plates', follow_redirects=True)
+    assert b'Successfully claimed 1 plate(s)!' in response.data
+
+    assert b'Lentil Soup' in needy.get('/order-history').get_data()
+    # The other plate of the donation is still on offer
+    assert [row['qty'] for row in query(app, "SELECT qty FROM reservations WHERE status = 'DONATED'")] == [1]
+    assert b'Lentil Soup' in needy.get('/free-plates').data
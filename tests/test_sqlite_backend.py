@@ -0,0 +1,14 @@
+import pytest
+
+from models.database import DatabaseError
+from models.sqlite_backend import translate
+
+
+def test_load_data_is_a_database_error():
+    with pytest.raises(DatabaseError):
+        translate("LOAD DATA LOCAL INFILE '/tmp/plates.csv' INTO TABLE plates")
+
+
+def test_bound_interval_is_computed_in_sql():
+    (sql,), _ = translate('SELECT 1 FROM change_feed WHERE created_at <= DATE_SUB(NOW(), INTERVAL %s SECOND)')
+    assert "datetime('now', 'localtime', '-' || ? || ' seconds')" in sql
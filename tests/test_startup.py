@@ -0,0 +1,38 @@
+from app.startup import StartupState, warm_up
+from tests.helpers import create_listing, fill_cart, plate_ids
+
+
+def test_readyz_turns_ready_after_warm_up(app):
+    app.extensions['startup'] = StartupState()
+    client = app.test_client()
+
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['ready'] is False
+    assert client.get('/healthz').status_code == 200
+
+    warm_up(app)
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert set(response.get_json()['steps_ms']) == {'templates', 'connections', 'search_index', 'plate_cards'}
+
+
+def test_warm_up_primes_the_cards_pages_render(app, restaurant, customer, donor, needy):
+    for title, price in (('Bao', '4.10'), ('Pho', '7.35'), ('Udon', '6.00')):
+        create_listing(restaurant, title, price=price)
+    fill_cart(donor, plate_ids(app)[:1])
+    donor.post('/confirm-order')
+
+    cache = app.extensions['fragment_cache']
+    cache.clear()
+    app.extensions['startup'] = StartupState()
+    warm_up(app)
+    primed = cache.misses
+
+    for client, path in ((customer, '/marketplace'), (donor, '/marketplace'), (needy, '/free-plates')):
+        hits = cache.hits
+        response = client.get(path)
+        assert response.status_code == 200
+        assert cache.hits > hits
+    # Every card on those pages was already cached
+    assert cache.misses == primed
@@ -0,0 +1,11 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+The schema is not touched here; run `flask --app app init-db` once per deploy.
+"""
+from app import create_app
+from app.startup import precompile_templates
+
+app = create_app()
+
+# Compiled once in the gunicorn master and inherited by every forked worker
+precompile_templates(app)